@@ -18,6 +18,9 @@ from datetime import datetime
 from dotenv import load_dotenv
 from business_core import BusinessCore
 from database import db
+from kb_chunker import chunk_text, DEFAULT_MAX_CHARS as KB_CHUNK_MAX_CHARS
+from kb_cache import read_cache_stats
+from stats_aggregator import read_stats, write_stats, default_stats
 
 load_dotenv()
 
@@ -1391,6 +1394,24 @@ def render_system_status_panel():
             st.rerun()
         except Exception:
             pass
+    # 知识库检索缓存（由机器人进程定期写入）
+    kb_cache = read_cache_stats(os.path.join(BASE_DIR, "platforms", "telegram", "kb_cache_stats.json"))
+    if kb_cache:
+        kc1, kc2, kc3, kc4 = st.columns(4)
+        kc1.metric("KB 缓存命中率", f"{float(kb_cache.get('hit_rate', 0.0)) * 100:.1f}%")
+        kc2.metric("命中 / 未命中", f"{kb_cache.get('hits', 0)} / {kb_cache.get('misses', 0)}")
+        kc3.metric("缓存条目", f"{kb_cache.get('size', 0)} / {kb_cache.get('maxsize', 0)}")
+        kc4.metric("淘汰 / 过期", f"{kb_cache.get('evictions', 0)} / {kb_cache.get('expired', 0)}")
+        st.caption(f"KB 检索缓存统计更新于 {kb_cache.get('updated_at', '-')}")
+    # AI 客户端连接池（由机器人进程定期写入）
+    ai_pool = read_cache_stats(os.path.join(BASE_DIR, "platforms", "telegram", "ai_client_stats.json"))
+    if ai_pool:
+        ac1, ac2, ac3, ac4 = st.columns(4)
+        ac1.metric("AI 连接复用率", f"{float(ai_pool.get('connection_reuse_ratio', 0.0)) * 100:.1f}%")
+        ac2.metric("请求 / 新建连接", f"{ai_pool.get('requests', 0)} / {ai_pool.get('connections_opened', 0)}")
+        ac3.metric("客户端命中 / 创建", f"{ai_pool.get('client_hits', 0)} / {ai_pool.get('client_misses', 0)}")
+        ac4.metric("HTTP / OpenAI 客户端", f"{ai_pool.get('http_clients', 0)} / {ai_pool.get('openai_clients', 0)}")
+        st.caption(f"AI 连接池统计更新于 {ai_pool.get('updated_at', '-')}")
     trace_path = os.path.join(BASE_DIR, "platforms", "telegram", "logs", "trace.jsonl")
     logs = _read_trace_jsonl(str(trace_path), window_minutes)
     by_tid = {}
@@ -1559,6 +1580,7 @@ def render_system_status_panel():
         st.markdown(f"<div style='display:inline-block;width:12px;height:12px;border-radius:999px;background:{_node_color(ai_health)};margin-right:6px;'></div><span>{ai_health}</span>", unsafe_allow_html=True)
 
 TG_GROUP_CACHE_FILE = os.path.join(BASE_DIR, "platforms", "telegram", "group_cache.json")
+TG_STATS_FILE = os.path.join(BASE_DIR, "platforms", "telegram", "stats.json")
 TG_SELECTED_GROUPS_FILE = os.path.join(BASE_DIR, "platforms", "telegram", "selected_groups.json")
 TG_LOG_DIR = os.path.join(BASE_DIR, "platforms", "telegram", "logs")
 TG_SYSTEM_LOG_FILE = os.path.join(TG_LOG_DIR, "system.log")
@@ -1925,8 +1947,12 @@ def render_kb_panel():
                         st.rerun()
                         
                     if st.button(tr("common_delete"), key=del_key):
-                        db.delete_kb_item(it['id'])
-                        log_admin_op("kb_delete", {"id": it.get('id'), "title": it.get('title')})
+                        if it.get("parent_id"):
+                            # 长文档切分出的段落：整篇文档一起删除
+                            db.delete_kb_document(it["parent_id"])
+                        else:
+                            db.delete_kb_item(it['id'])
+                        log_admin_op("kb_delete", {"id": it.get('id'), "title": it.get('title'), "parent_id": it.get("parent_id")})
                         st.success(tr("common_success"))
                         st.rerun()
                         
@@ -2049,8 +2075,24 @@ def render_kb_panel():
                     "created_at": now_iso,
                     "updated_at": now_iso
                 }
-                db.add_kb_item(item)
-                log_admin_op("kb_import", {"id": new_id, "title": title.strip(), "source_file": safe_name})
+                passages = chunk_text(item["content"]) if len(item["content"]) > KB_CHUNK_MAX_CHARS else []
+                if len(passages) > 1:
+                    # 长文档（PDF/XLSX 等）按段落切分入库，每段单独可检索并通过 parent_id 关联原文档
+                    rows = []
+                    for i, passage in enumerate(passages):
+                        row = dict(item)
+                        row.update({
+                            "id": f"{new_id}-{i}",
+                            "title": f"{item['title']} #{i + 1}",
+                            "content": passage,
+                            "parent_id": new_id,
+                            "chunk_index": i
+                        })
+                        rows.append(row)
+                    db.bulk_import_kb_items(tenant_id, rows)
+                else:
+                    db.add_kb_item(item)
+                log_admin_op("kb_import", {"id": new_id, "title": title.strip(), "source_file": safe_name, "chunks": len(passages) or 1})
                 st.session_state["kb_import_success"] = f"{tr('common_success')}: {title}"
                 st.rerun()
 
@@ -2058,7 +2100,23 @@ def render_kb_panel():
         st.subheader(tr("kb_test_header"))
         query = st.text_input(tr("kb_test_input"), key="kb_query")
         topn = st.number_input(tr("kb_test_topn"), min_value=1, max_value=10, value=3, step=1, key="kb_topn")
-        if st.button(tr("kb_test_btn"), key="kb_search"):
+        engine = st.radio("Engine", ["bigram", "bm25", "dense", "fts5"], horizontal=True, key="kb_test_engine")
+        search_clicked = st.button(tr("kb_test_btn"), key="kb_search")
+        if search_clicked and engine == "fts5":
+            # 直接在 SQLite 全文索引内取前 topn 条，不加载整个知识库
+            import time
+            t0 = time.time()
+            ranked = db.search_kb(tenant_id, query, limit=int(topn))
+            elapsed_ms = (time.time() - t0) * 1000
+            st.info(f"Time: {elapsed_ms:.2f} ms, Found: {len(ranked)}")
+            for it in ranked:
+                tags_disp = it.get('tags','')
+                if isinstance(tags_disp, str) and tags_disp.startswith("["):
+                     try: tags_disp = ", ".join(json.loads(tags_disp))
+                     except: pass
+                st.write(f"- **{it.get('title','(Unamed)')}** | {it.get('category','-')} | {tags_disp} | score {it.get('score', 0):.3f}")
+                st.caption((it.get("content","") or "")[:300] + "...")
+        elif search_clicked:
             # Simple in-memory search for now, replacing retrieve_kb_context which used list
             # Ideally move search logic to BusinessCore or Database (if using vector search later)
             # For now, replicate simple keyword/similarity matching using loaded items
@@ -2076,7 +2134,7 @@ def render_kb_panel():
                 
                 try:
                     from main import retrieve_kb_context
-                    ranked = retrieve_kb_context(query, items, topn=int(topn))
+                    ranked = retrieve_kb_context(query, items, topn=int(topn), engine=engine)
                 except Exception:
                     ranked = [it for it in items if query.lower() in (it.get('title','') + it.get('content','')).lower()]
                     ranked = ranked[:int(topn)]
@@ -2218,6 +2276,27 @@ def render_telegram_panel():
     if active_tab in tab_map:
         tab_map[active_tab]()
 
+def _keep_unmanaged_config(new_text, old_text):
+    """
+    保存配置表单时保留表单未管理的键（如 GROUP_CONTEXT、GROUP_CACHE_TOUCH_SECONDS），
+    否则整文件重写会把手工添加的配置项丢掉
+    """
+    managed = set()
+    for line in new_text.splitlines():
+        if "=" in line and not line.strip().startswith("#"):
+            managed.add(line.split("=", 1)[0].strip())
+    extra = []
+    for line in (old_text or "").splitlines():
+        stripped = line.strip()
+        if "=" in stripped and not stripped.startswith("#"):
+            key = stripped.split("=", 1)[0].strip()
+            if key not in managed:
+                extra.append(stripped)
+                managed.add(key)
+    if not extra:
+        return new_text
+    return new_text.rstrip("\n") + "\n\n# 其它配置（表单未管理，保存时原样保留）\n" + "\n".join(extra) + "\n"
+
 def render_telegram_config():
     """Telegram 配置界面"""
     from admin import read_file, write_file
@@ -2317,6 +2396,7 @@ def render_telegram_config():
         'QUOTE_INTERVAL_SECONDS': 30.0,
         'QUOTE_MAX_LEN': 200,
         'KB_ONLY_REPLY': False,
+        'KB_RETRIEVAL_ENGINE': 'bigram',
         'HANDOFF_KEYWORDS': '',
         'HANDOFF_MESSAGE': '',
         'KB_FALLBACK_MESSAGE': ''
@@ -2366,6 +2446,9 @@ def render_telegram_config():
                 current_config[key] = raw_value
             elif key == 'KB_FALLBACK_MESSAGE':
                 current_config[key] = raw_value
+            elif key == 'KB_RETRIEVAL_ENGINE':
+                if value in ('bigram', 'bm25', 'dense', 'fts5'):
+                    current_config[key] = value
     
     col1, col2 = st.columns(2)
     
@@ -2390,6 +2473,14 @@ def render_telegram_config():
             help="开启后，回复将直接引用知识库内容，不调用AI与人设剧本",
             key="tg_kb_only_reply"
         )
+        kb_engine_options = ['bigram', 'bm25', 'dense', 'fts5']
+        kb_retrieval_engine = st.selectbox(
+            "🔎 知识库检索引擎",
+            kb_engine_options,
+            index=kb_engine_options.index(current_config.get('KB_RETRIEVAL_ENGINE', 'bigram')),
+            help="bigram: 双字重合打分（默认）；bm25: BM25 稀疏矩阵向量化打分（需要 numpy）；dense: 本地哈希 n-gram 向量语义检索（需要 numpy，矩阵 mmap 共享）；fts5: SQLite 全文索引检索",
+            key="tg_kb_retrieval_engine"
+        )
     
     with col2:
         group_reply = st.toggle(
@@ -2551,6 +2642,9 @@ CONV_ORCHESTRATION={'on' if orchestration_enabled else 'off'}
 # 知识库直答（不走剧本）
 KB_ONLY_REPLY={'on' if kb_only_reply else 'off'}
 
+# 知识库检索引擎 (bigram/bm25/dense/fts5)
+KB_RETRIEVAL_ENGINE={kb_retrieval_engine}
+
 # 对话呈现模式
 CONVERSATION_MODE={conv_value}
 
@@ -2581,6 +2675,7 @@ AUDIT_MAX_RETRIES={audit_max_retries}
 AUDIT_TEMPERATURE={audit_temperature:.1f}
 AUDIT_GUIDE_STRENGTH={guide_strength:.1f}
 """
+        new_config = _keep_unmanaged_config(new_config, read_file("platforms/telegram/config.txt", ""))
         write_file("platforms/telegram/config.txt", new_config)
         log_admin_op("tg_config_save", {"AUTO_QUOTE": auto_quote, "PRIVATE_REPLY": private_reply, "GROUP_REPLY": group_reply})
         st.success(tr("common_success"))
@@ -4157,8 +4252,8 @@ def render_telegram_stats():
         import json
         from datetime import datetime
         import pandas as pd
-        with open("platforms/telegram/stats.json", 'r', encoding='utf-8') as f:
-            stats = json.load(f)
+        # 机器人进程原子替换写入 stats.json，这里无锁读取最近一次落盘的快照
+        stats = read_stats(TG_STATS_FILE)
         
         # 计算成功率
         success_rate = 0
@@ -4235,18 +4330,8 @@ def render_telegram_stats():
         
         # 操作按钮
         if st.button("🗑️ 重置统计", use_container_width=True):
-            default_stats = {
-                "total_messages": 0,
-                "total_replies": 0,
-                "private_messages": 0,
-                "group_messages": 0,
-                "success_count": 0,
-                "error_count": 0,
-                "start_time": datetime.now().isoformat(),
-                "last_active": None
-            }
-            with open("platforms/telegram/stats.json", 'w', encoding='utf-8') as f:
-                json.dump(default_stats, f, indent=2, ensure_ascii=False)
+            # 机器人进程之后只把新增量合并进重置后的文件
+            write_stats(TG_STATS_FILE, default_stats())
             st.success("✅ 统计已重置")
             st.rerun()
         if st.button("刷新统计", use_container_width=True):
@@ -0,0 +1,130 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import List, Optional
+
+# 优先级：数值越小越先获得并发槽位
+PRIORITY_PRIVATE = 0
+PRIORITY_MENTION = 1
+PRIORITY_KEYWORD = 2
+PRIORITY_CONTEXT = 3
+
+PRIORITY_NAMES = {
+    PRIORITY_PRIVATE: "private",
+    PRIORITY_MENTION: "mention",
+    PRIORITY_KEYWORD: "keyword",
+    PRIORITY_CONTEXT: "context",
+}
+
+
+class AdmissionRejected(Exception):
+    """排队已满，本次请求被丢弃（入队时直接拒绝，或排队中被更高优先级的请求挤出）"""
+
+    def __init__(self, priority: int, queue_depth: int, evicted: bool = False):
+        super().__init__(f"admission rejected (priority={PRIORITY_NAMES.get(priority, priority)}, queue={queue_depth})")
+        self.priority = priority
+        self.queue_depth = queue_depth
+        self.evicted = evicted
+
+
+class AdmissionTicket:
+    """已获得的并发槽位；release 可重复调用，只生效一次"""
+
+    __slots__ = ("_controller", "priority", "wait_ms", "queue_depth", "_released")
+
+    def __init__(self, controller, priority: int, wait_ms: float, queue_depth: int):
+        self._controller = controller
+        self.priority = priority
+        self.wait_ms = wait_ms
+        self.queue_depth = queue_depth
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release()
+
+
+class AdmissionController:
+    """
+    LLM 生成路径前的全局准入控制：同时最多 max_concurrent 个请求在生成，其余按优先级排队（同优先级先到先得）；
+    排队数达到 max_queue 时，新请求若比队尾（优先级最低、最晚到达）更重要则挤掉队尾，否则直接拒绝。
+    只在事件循环线程内使用，不加锁。
+    """
+
+    def __init__(self, max_concurrent: int = 4, max_queue: int = 16):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_queue = max(0, int(max_queue))
+        self._active = 0
+        self._waiters: List[list] = []  # 堆：[priority, seq, future]
+        self._seq = itertools.count()
+        self.admitted = 0
+        self.shed = 0
+        self.max_wait_ms = 0.0
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def configure(self, max_concurrent: Optional[int] = None, max_queue: Optional[int] = None):
+        """热更新上限：并发上限调大时立即放行排队中的请求；调小时已在运行的请求不受影响"""
+        if max_concurrent is not None:
+            self.max_concurrent = max(1, int(max_concurrent))
+        if max_queue is not None:
+            self.max_queue = max(0, int(max_queue))
+        self._wake()
+
+    async def acquire(self, priority: int) -> AdmissionTicket:
+        start = time.perf_counter()
+        if self._active < self.max_concurrent and not self._waiters:
+            self._active += 1
+            return self._admit(priority, start, 0)
+
+        depth = len(self._waiters)
+        if depth >= self.max_queue:
+            worst = max(self._waiters, key=lambda e: (e[0], e[1])) if self._waiters else None
+            if worst is None or worst[0] <= priority:
+                self.shed += 1
+                raise AdmissionRejected(priority, depth)
+            self._waiters.remove(worst)
+            heapq.heapify(self._waiters)
+            self.shed += 1
+            worst[2].set_exception(AdmissionRejected(worst[0], depth, evicted=True))
+
+        fut = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self._seq), fut]
+        heapq.heappush(self._waiters, entry)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled() and fut.exception() is None:
+                # 槽位已分配给本请求但调用方被取消：归还槽位
+                self._release()
+            elif entry in self._waiters:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            raise
+        return self._admit(priority, start, depth)
+
+    def _admit(self, priority, start, depth) -> AdmissionTicket:
+        wait_ms = (time.perf_counter() - start) * 1000.0
+        self.admitted += 1
+        self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+        return AdmissionTicket(self, priority, wait_ms, depth)
+
+    def _release(self):
+        self._active = max(0, self._active - 1)
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self._active < self.max_concurrent:
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done():
+                continue
+            self._active += 1
+            fut.set_result(None)
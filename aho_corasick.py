@@ -0,0 +1,81 @@
+from collections import deque
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+
+
+class AhoCorasick:
+    """
+    多模式字符串匹配自动机 (Aho-Corasick)
+    一次线性扫描即可找出文本中所有模式串的出现位置，复杂度与模式数量无关。
+
+    用法:
+        ac = AhoCorasick([("价格", "kw"), ("人工", "handoff")])
+        for start, end, pattern, payload in ac.finditer(text): ...
+    """
+
+    def __init__(self, patterns: Optional[Iterable[Tuple[str, Any]]] = None):
+        self._goto: List[dict] = [{}]
+        self._fail: List[int] = [0]
+        # 每个状态直接输出的 (pattern, payload)，以及沿失败链的下一个有输出的状态
+        self._out: List[List[Tuple[str, Any]]] = [[]]
+        self._out_link: List[int] = [-1]
+        self._built = False
+        self._size = 0
+        if patterns:
+            for pattern, payload in patterns:
+                self.add(pattern, payload)
+            self.build()
+
+    def __len__(self):
+        return self._size
+
+    def add(self, pattern: str, payload: Any = None):
+        if not pattern:
+            return
+        state = 0
+        for ch in pattern:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._out_link.append(-1)
+            state = nxt
+        self._out[state].append((pattern, payload))
+        self._size += 1
+        self._built = False
+
+    def build(self):
+        queue = deque()
+        for nxt in self._goto[0].values():
+            self._fail[nxt] = 0
+            queue.append(nxt)
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                fs = self._fail[nxt]
+                self._out_link[nxt] = fs if self._out[fs] else self._out_link[fs]
+        self._built = True
+
+    def finditer(self, text: str) -> Iterator[Tuple[int, int, str, Any]]:
+        """按结束位置顺序产出 (start, end, pattern, payload)，end 为开区间"""
+        if not self._built:
+            self.build()
+        goto, fail, out, out_link = self._goto, self._fail, self._out, self._out_link
+        state = 0
+        for i, ch in enumerate(text or ""):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            s = state if out[state] else out_link[state]
+            while s > 0:
+                for pattern, payload in out[s]:
+                    yield i + 1 - len(pattern), i + 1, pattern, payload
+                s = out_link[s]
@@ -0,0 +1,154 @@
+import os
+import asyncio
+import atexit
+import inspect
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI
+
+logger = logging.getLogger("AIClientPool")
+
+# 连接池参数可通过 .env 调整；AI_HTTP2=on 需要安装 h2（pip install httpx[http2]），未安装时退回 HTTP/1.1
+DEFAULT_MAX_CONNECTIONS = 20
+DEFAULT_MAX_KEEPALIVE = 10
+DEFAULT_KEEPALIVE_EXPIRY = 30.0
+
+
+def ssl_verify_from_env() -> bool:
+    v = (os.getenv("HTTPX_VERIFY_SSL") or "").strip().lower()
+    return v not in ("0", "false", "no")
+
+
+def _env_number(name, default, cast):
+    try:
+        return cast(os.getenv(name) or default)
+    except (TypeError, ValueError):
+        return default
+
+
+# httpcore trace 扩展中代表“新建连接”的事件（连接池复用已有连接时不会出现）
+_CONNECT_EVENTS = ("connection.connect_tcp.complete", "connection.connect_unix_socket.complete")
+
+
+class AIClientRegistry:
+    """
+    进程级 AI HTTP 客户端注册表：
+    - httpx.AsyncClient 按 (verify, timeout) 共享，带 keep-alive 连接池上限，可选 HTTP/2；
+    - AsyncOpenAI 按 (base_url, api_key, verify, timeout) 缓存，底层复用同一个 httpx 客户端。
+    main.get_ai_client、编排模式的阶段路由、Auditor 与 RemoteAuditor 都从这里取客户端，
+    不再每条消息新建连接池。metrics() 给出请求数、新建连接数与连接复用率：
+    请求数由 httpx 的 request 事件钩子累计，新建连接数来自 httpcore 的 trace 扩展（公开接口，不读连接池内部状态）。
+    """
+
+    def __init__(self, max_connections: int = DEFAULT_MAX_CONNECTIONS, max_keepalive: int = DEFAULT_MAX_KEEPALIVE,
+                 keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY, http2: bool = False):
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive,
+                                   keepalive_expiry=keepalive_expiry)
+        self.http2 = bool(http2)
+        if self.http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("AI_HTTP2=on 但未安装 h2，使用 HTTP/1.1")
+                self.http2 = False
+        self._lock = threading.Lock()
+        self._http: Dict[Tuple[bool, float], httpx.AsyncClient] = {}
+        self._openai: Dict[Tuple[str, str, bool, float], Tuple[AsyncOpenAI, httpx.AsyncClient]] = {}
+        self._stats = {"requests": 0, "connections_opened": 0, "client_hits": 0, "client_misses": 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_connections=_env_number("AI_HTTP_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS, int),
+            max_keepalive=_env_number("AI_HTTP_MAX_KEEPALIVE", DEFAULT_MAX_KEEPALIVE, int),
+            keepalive_expiry=_env_number("AI_HTTP_KEEPALIVE_EXPIRY", DEFAULT_KEEPALIVE_EXPIRY, float),
+            http2=(os.getenv("AI_HTTP2") or "").strip().lower() in ("1", "on", "true", "yes"),
+        )
+
+    def http_client(self, verify: Optional[bool] = None, timeout: float = 30.0) -> httpx.AsyncClient:
+        verify = ssl_verify_from_env() if verify is None else bool(verify)
+        key = (verify, float(timeout))
+        with self._lock:
+            client = self._http.get(key)
+            if client is None or client.is_closed:
+                client = httpx.AsyncClient(timeout=float(timeout), verify=verify, http2=self.http2, limits=self.limits,
+                                           event_hooks={"request": [self._on_request]})
+                self._http[key] = client
+                logger.info(f"HTTP client created verify={verify} timeout={timeout} http2={self.http2}")
+            return client
+
+    async def _on_request(self, request: httpx.Request):
+        self._count("requests")
+        user_trace = request.extensions.get("trace")
+
+        async def trace(name, info):
+            if name in _CONNECT_EVENTS:
+                self._count("connections_opened")
+            if user_trace is not None:
+                ret = user_trace(name, info)
+                if inspect.isawaitable(ret):
+                    await ret
+
+        request.extensions["trace"] = trace
+
+    def _count(self, field: str):
+        with self._lock:
+            self._stats[field] += 1
+
+    def openai_client(self, base_url: str, api_key: str, verify: Optional[bool] = None,
+                      timeout: float = 30.0) -> AsyncOpenAI:
+        verify = ssl_verify_from_env() if verify is None else bool(verify)
+        key = (str(base_url or ""), str(api_key or ""), verify, float(timeout))
+        with self._lock:
+            entry = self._openai.get(key)
+            if entry is not None and not entry[1].is_closed:
+                self._stats["client_hits"] += 1
+                return entry[0]
+            self._stats["client_misses"] += 1
+        http_client = self.http_client(verify, timeout)
+        client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+        with self._lock:
+            self._openai[key] = (client, http_client)
+        return client
+
+    def metrics(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["http_clients"] = len(self._http)
+            stats["openai_clients"] = len(self._openai)
+        requests = stats["requests"]
+        stats["connection_reuse_ratio"] = round(1.0 - stats["connections_opened"] / requests, 4) if requests else 0.0
+        return stats
+
+    async def aclose(self):
+        with self._lock:
+            clients = list(self._http.values())
+            self._http.clear()
+            self._openai.clear()
+        for client in clients:
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning(f"Failed to close HTTP client: {e}")
+
+    def close(self):
+        """同步关闭（进程退出时）：事件循环仍可用时在其中关闭，否则新建一个临时循环"""
+        if not self._http:
+            return
+        try:
+            loop = asyncio.get_event_loop()
+            if loop.is_running():
+                loop.create_task(self.aclose())
+            elif not loop.is_closed():
+                loop.run_until_complete(self.aclose())
+            else:
+                asyncio.run(self.aclose())
+        except Exception:
+            pass
+
+
+registry = AIClientRegistry.from_env()
+atexit.register(registry.close)
@@ -1,12 +1,14 @@
+import asyncio
 import logging
 import json
 import os
-import httpx
 import random
 import hashlib
 import re
+from openai import APIConnectionError
 from auditor import Auditor, AuditResult
 from keyword_manager import KeywordManager
+from ai_client_pool import registry as ai_clients
 
 # 配置日志
 log_dir = os.path.join("platforms", "telegram", "logs")
@@ -52,13 +54,40 @@ class FallbackCache:
         return ""
 
 class RemoteAuditor:
-    def __init__(self, server_urls):
+    """
+    远程审核：按 AUDIT_SERVERS 顺序（上次成功的服务器优先）请求 /audit。
+    hedge_delay 为 0 时逐个故障切换；大于 0 时当前请求超过该秒数未返回（或已失败）就并行请求下一台，
+    先拿到结果的为准，其余请求取消。全部失败时 Fail-Closed。
+    """
+
+    def __init__(self, server_urls, hedge_delay: float = 0.0):
         self.server_urls = [url.strip() for url in server_urls.split(',') if url.strip()]
-        v = (os.getenv("HTTPX_VERIFY_SSL") or "").strip().lower()
-        verify = False if v in ("0","false","no") else True
-        self.client = httpx.AsyncClient(timeout=3.0, verify=verify)
+        self.hedge_delay = hedge_delay
         self.last_ok_url = None
-    
+
+    @property
+    def client(self):
+        # 共享连接池（按 SSL 验证与 3s 超时区分），不再每个实例新建 httpx 客户端
+        return ai_clients.http_client(timeout=3.0)
+
+    async def _request(self, url, payload) -> AuditResult:
+        # 确保 URL 格式正确
+        if not url.startswith("http"):
+            url = f"http://{url}"
+        audit_url = f"{url.rstrip('/')}/audit"
+
+        logger.info(f"Trying audit server: {audit_url}")
+        key = os.getenv("SUPERADMIN_KEY") or ""
+        response = await self.client.post(audit_url, json=payload, headers={"X-SuperAdmin-Key": key})
+        response.raise_for_status()
+        data = response.json()
+
+        # 兼容新旧格式
+        status = data.get('status', '')
+        if not status and 'approved' in data:
+            status = "PASS" if data['approved'] else "FAIL"
+        return AuditResult(status, data.get('reason', ''), data.get('suggestion', ''))
+
     async def audit_content(self, user_input, draft_reply, history) -> AuditResult:
         payload = {
             "user_input": user_input,
@@ -66,58 +95,95 @@ class RemoteAuditor:
             "history": history
         }
         
-        last_error = None
         ordered = []
-        if self.last_ok_url:
+        if self.last_ok_url in self.server_urls:
             ordered.append(self.last_ok_url)
         ordered.extend([u for u in self.server_urls if u != self.last_ok_url])
-        for url in ordered:
-            try:
-                # 确保 URL 格式正确
-                if not url.startswith("http"):
-                    url = f"http://{url}"
-                audit_url = f"{url.rstrip('/')}/audit"
-                
-                logger.info(f"Trying audit server: {audit_url}")
-                key = os.getenv("SUPERADMIN_KEY") or ""
-                response = await self.client.post(audit_url, json=payload, headers={"X-SuperAdmin-Key": key})
-                response.raise_for_status()
-                data = response.json()
-                
-                # 兼容新旧格式
-                status = data.get('status', '')
-                if not status and 'approved' in data:
-                    status = "PASS" if data['approved'] else "FAIL"
-                
-                self.last_ok_url = url
-                return AuditResult(status, data.get('reason', ''), data.get('suggestion', ''))
-            except Exception as e:
-                logger.warning(f"Audit failed at {url}: {e}")
-                last_error = e
-                continue
+
+        if self.hedge_delay and self.hedge_delay > 0 and len(ordered) > 1:
+            result, last_error = await self._audit_hedged(ordered, payload)
+        else:
+            result, last_error = None, None
+            for url in ordered:
+                try:
+                    result = await self._request(url, payload)
+                    self.last_ok_url = url
+                    break
+                except Exception as e:
+                    logger.warning(f"Audit failed at {url}: {e}")
+                    last_error = e
+        if result is not None:
+            return result
         
         # 所有服务器都失败
         logger.error(f"All audit servers failed. Last error: {last_error}")
         # 降级策略：返回 FAIL (System Error)，触发兜底
         return AuditResult("FAIL", "System Error (Fail-Closed)", "Audit system unavailable")
 
+    async def _audit_hedged(self, ordered, payload):
+        """对冲请求：每轮启动下一台服务器，再等待 hedge_delay 秒或任一请求结束"""
+        queue = list(ordered)
+        running = {}
+        last_error = None
+        try:
+            while queue or running:
+                if queue:
+                    url = queue.pop(0)
+                    running[asyncio.ensure_future(self._request(url, payload))] = url
+                done, _ = await asyncio.wait(list(running), timeout=self.hedge_delay if queue else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    url = running.pop(task)
+                    if task.exception() is None:
+                        self.last_ok_url = url
+                        return task.result(), None
+                    logger.warning(f"Audit failed at {url}: {task.exception()}")
+                    last_error = task.exception()
+            return None, last_error
+        finally:
+            for task in running:
+                task.cancel()
+
 class AuditManager:
-    def __init__(self, ai_client, model_name, config_loader=None, platform: str = "telegram"):
+    """
+    进程级审核服务：关键词表、兜底话术、本地审核提示词都在各自文件变化时热加载，
+    AUDIT_MODE / AUDIT_SERVERS 变化时重建审核器组合，每条消息只做实际的检查。
+    ai_client / model_name 为默认值，generate_with_audit 可按调用覆盖（编排模式按阶段路由）。
+    """
+
+    def __init__(self, ai_client=None, model_name=None, config_loader=None, platform: str = "telegram"):
         self.ai_client = ai_client
         self.model_name = model_name
         self.config_loader = config_loader
         self.platform = platform or "telegram"
         self.keyword_manager = KeywordManager()
         self._fallback_cache = FallbackCache(os.path.join("platforms", "telegram", "audit_fallback.txt"))
-        mode = self._get_config('AUDIT_MODE', 'local').lower()
-        servers = self._get_config('AUDIT_SERVERS', 'http://127.0.0.1:8000')
-        self.auditor_primary = Auditor()
+        self._local_auditor = None
+        self._auditors_key = None
+        self.auditor_primary = None
         self.auditor_secondary = None
-        if mode == 'dual':
-            self.auditor_secondary = RemoteAuditor(servers)
-        elif mode == 'remote':
-            self.auditor_primary = RemoteAuditor(servers)
-        logger.info(f"Audit mode: {mode}")
+        self.refresh()
+
+    def refresh(self):
+        """AUDIT_MODE / AUDIT_SERVERS 与上次不同时重建审核器（本地 Auditor 只创建一次）；AUDIT_HEDGE_DELAY_MS 每次同步"""
+        mode = str(self._get_config('AUDIT_MODE', 'local') or 'local').lower()
+        servers = str(self._get_config('AUDIT_SERVERS', 'http://127.0.0.1:8000') or '')
+        hedge_delay = max(0.0, self._get_float('AUDIT_HEDGE_DELAY_MS', 0)) / 1000.0
+        key = (mode, servers)
+        if key != self._auditors_key:
+            if self._local_auditor is None:
+                self._local_auditor = Auditor()
+            self.auditor_primary = self._local_auditor
+            self.auditor_secondary = None
+            if mode == 'dual':
+                self.auditor_secondary = RemoteAuditor(servers)
+            elif mode == 'remote':
+                self.auditor_primary = RemoteAuditor(servers)
+            self._auditors_key = key
+            logger.info(f"Audit mode: {mode}")
+        for auditor in (self.auditor_primary, self.auditor_secondary):
+            if isinstance(auditor, RemoteAuditor):
+                auditor.hedge_delay = hedge_delay
     
     def _get_config(self, key, default):
         cfg = {}
@@ -157,13 +223,16 @@ class AuditManager:
         except Exception:
             return True
 
-    async def generate_with_audit(self, messages, user_input, history, temperature=0.7):
+    async def generate_with_audit(self, messages, user_input, history, temperature=0.7, ai_client=None, model_name=None):
         """
         带审核的生成流程：
         生成 -> 审核 -> (不通过 -> 重试) * N -> 兜底话术
+        ai_client / model_name 未传入时使用构造时的默认值
         Returns:
             dict: {"content": str, "usage": dict}
         """
+        ai_client = ai_client or self.ai_client
+        model_name = model_name or self.model_name
         # 读取配置
         enabled = self._get_bool('AUDIT_ENABLED', False) and self._is_schedule_active()
         
@@ -172,7 +241,7 @@ class AuditManager:
             "prompt_tokens": 0,
             "completion_tokens": 0,
             "total_tokens": 0,
-            "model": self.model_name
+            "model": model_name
         }
 
         def accumulate_usage(new_usage):
@@ -186,8 +255,8 @@ class AuditManager:
 
         if not enabled:
             try:
-                response = await self.ai_client.chat.completions.create(
-                    model=self.model_name,
+                response = await ai_client.chat.completions.create(
+                    model=model_name,
                     messages=messages,
                     temperature=temperature,
                     max_tokens=500
@@ -197,7 +266,7 @@ class AuditManager:
                         "prompt_tokens": response.usage.prompt_tokens,
                         "completion_tokens": response.usage.completion_tokens,
                         "total_tokens": response.usage.total_tokens,
-                        "model": self.model_name
+                        "model": model_name
                     })
                 original = response.choices[0].message.content
                 rewritten = self.apply_style_guard(original)
@@ -219,6 +288,7 @@ class AuditManager:
                     "final_action": fb_action
                 }}
 
+        self.refresh()
         current_messages = messages.copy()
         retry_count = 0
         safe_input, cat_in, word_in = self.keyword_manager.check_text(user_input or "")
@@ -240,8 +310,8 @@ class AuditManager:
                 guide_text = "优先直接回答当前问题；避免营销语或具体方案；建议控制在200字内；保持中立与专业语气。"
             guidance_msg = {"role": "system", "content": guide_text}
             messages_injected = [guidance_msg] + current_messages
-            response = await self.ai_client.chat.completions.create(
-                model=self.model_name,
+            response = await ai_client.chat.completions.create(
+                model=model_name,
                 messages=messages_injected,
                 temperature=temperature,
                 max_tokens=500
@@ -251,7 +321,7 @@ class AuditManager:
                     "prompt_tokens": response.usage.prompt_tokens,
                     "completion_tokens": response.usage.completion_tokens,
                     "total_tokens": response.usage.total_tokens,
-                    "model": self.model_name
+                    "model": model_name
                 })
             original = response.choices[0].message.content
             rewritten = self.apply_style_guard(original)
@@ -280,30 +350,67 @@ class AuditManager:
                 "final_action": fb_action
             }}
         logger.info(f"Auditing draft: {rewritten[:30]}...")
-        primary_result = await self.auditor_primary.audit_content(user_input, rewritten, history)
-        if hasattr(primary_result, 'usage'):
+        # 固定本次使用的审核器，避免并发消息触发的 refresh 中途替换
+        auditor_primary, auditor_secondary = self.auditor_primary, self.auditor_secondary
+        if auditor_secondary:
+            primary_result, secondary_result = await self._run_dual_audit(
+                auditor_primary, auditor_secondary, user_input, rewritten, history)
+        else:
+            primary_result, secondary_result = await auditor_primary.audit_content(user_input, rewritten, history), None
+        if primary_result is not None and hasattr(primary_result, 'usage'):
             accumulate_usage(primary_result.usage)
-        audit_primary_passed = bool(primary_result.approved)
+        # 复审先 FAIL 时主审核被取消、没有结论，audit_primary_passed 记为 None（未执行），仍走兜底；
+        # 主审核 FAIL 时被取消的复审与原串行流程一致记为 True（未否决）
+        audit_primary_passed = bool(primary_result.approved) if primary_result is not None else None
         audit_secondary_passed = True
-        if audit_primary_passed and self.auditor_secondary:
-            secondary_result = await self.auditor_secondary.audit_content(user_input, rewritten, history)
+        if secondary_result is not None:
             audit_secondary_passed = bool(secondary_result.approved)
         if audit_primary_passed and audit_secondary_passed:
             final_action = "send_rewritten" if style_applied else "send_normal"
             return {"content": rewritten, "usage": total_usage, "status": {
                 "style_guard_applied": style_applied,
                 "audit_primary_passed": True,
-                "audit_secondary_passed": True if self.auditor_secondary else True,
+                "audit_secondary_passed": True if auditor_secondary else True,
                 "final_action": final_action
             }}
         fb_action, fb_msg = self._build_fallback(primary_result.suggestion if primary_result else "")
         return {"content": fb_msg, "usage": total_usage, "status": {
             "style_guard_applied": style_applied,
             "audit_primary_passed": audit_primary_passed,
-            "audit_secondary_passed": audit_secondary_passed if self.auditor_secondary else False if not audit_primary_passed else True,
+            "audit_secondary_passed": audit_secondary_passed if auditor_secondary else False if not audit_primary_passed else True,
             "final_action": fb_action
         }}
 
+    async def _run_dual_audit(self, primary, secondary, user_input, draft_reply, history):
+        """
+        双审核并发执行，总耗时取两者较慢者而非之和；任一方先返回 FAIL（异常按 FAIL 处理）即取消另一方。
+        返回 (主审核结果, 复审结果)，被取消的一方为 None。
+        """
+        tasks = {
+            asyncio.ensure_future(primary.audit_content(user_input, draft_reply, history)): 0,
+            asyncio.ensure_future(secondary.audit_content(user_input, draft_reply, history)): 1,
+        }
+        results = [None, None]
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    idx = tasks[task]
+                    try:
+                        results[idx] = task.result()
+                    except Exception as e:
+                        logger.error(f"{'Primary' if idx == 0 else 'Secondary'} audit raised: {e}")
+                        results[idx] = AuditResult("FAIL", f"Audit System Error: {e}", "System Error")
+                if any(r is not None and not r.approved for r in results):
+                    if pending:
+                        logger.info("Audit FAIL received, cancelling the other auditor")
+                    break
+            return results[0], results[1]
+        finally:
+            for task in pending:
+                task.cancel()
+
     def _get_fallback_message(self):
         msg = self._fallback_cache.get_message()
         if msg:
@@ -1,8 +1,9 @@
 import os
 import json
-import httpx
-from openai import AsyncOpenAI
+import time
 import logging
+from ai_client_pool import registry as ai_clients
+from config_registry import file_signature
 
 # 统一审核日志编码与路径
 _AUDIT_LOG_DIR = os.path.join("platforms", "telegram", "logs")
@@ -37,12 +38,20 @@ class AuditResult:
         }
 
 class Auditor:
-    def __init__(self, client=None, api_key=None, base_url=None, model_name=None):
+    """
+    本地 LLM 审核：长期存活，审核提示词 audit_prompt.txt 的签名至多每 check_interval 秒检查一次，变化时重新读取。
+    未显式传入 client 时每次从进程级注册表取客户端，HTTPX_VERIFY_SSL 切换后自动使用对应的连接池。
+    """
+
+    def __init__(self, client=None, api_key=None, base_url=None, model_name=None, check_interval=1.0, clock=time.monotonic):
         self.model_name = model_name or os.getenv('AI_MODEL_NAME')
-        
-        if client:
-            self.client = client
-        else:
+        self._client = client
+        self.check_interval = max(0.0, float(check_interval))
+        self._clock = clock
+        self._prompt_signature = None
+        self._prompt_checked_at = None
+
+        if not client:
             self.api_key = api_key or os.getenv('AI_API_KEY')
             self.base_url = base_url or os.getenv('AI_BASE_URL')
             
@@ -56,33 +65,50 @@ class Auditor:
                     self.base_url = self.base_url.replace("/chat/completions", "")
                 if not self.base_url.endswith("/v1"):
                     self.base_url = self.base_url.rstrip("/") + "/v1"
-
-            # 初始化客户端
-            _v = (os.getenv("HTTPX_VERIFY_SSL") or "").strip().lower()
-            _verify = False if _v in ("0","false","no") else True
-            http_client = httpx.AsyncClient(verify=_verify)
-            self.client = AsyncOpenAI(
-                api_key=self.api_key,
-                base_url=self.base_url,
-                http_client=http_client
-            )
         
         # 加载 Prompt
         self.prompt_path = os.path.join(os.path.dirname(__file__), 'platforms', 'telegram', 'audit_prompt.txt')
         self.system_prompt = self._load_prompt()
+        self._prompt_checked_at = self._clock()
+
+    @property
+    def client(self):
+        if self._client:
+            return self._client
+        # 从进程级注册表取客户端（与主流程相同 base_url / key 时复用同一连接池）
+        return ai_clients.openai_client(self.base_url, self.api_key, timeout=30.0)
+
+    @client.setter
+    def client(self, value):
+        self._client = value
 
     def _load_prompt(self):
         try:
+            signature = file_signature(self.prompt_path)
             with open(self.prompt_path, 'r', encoding='utf-8') as f:
-                return f.read().strip()
+                prompt = f.read().strip()
+            self._prompt_signature = signature
+            return prompt
         except Exception as e:
             _logger.error(f"Failed to load audit prompt: {e}")
             return "You are an AI content auditor. Respond in JSON with status('PASS'/'FAIL'), reason(str), suggestion(str)."
 
+    def _refresh_prompt(self):
+        """提示词文件签名变化时重新加载"""
+        now = self._clock()
+        if self._prompt_checked_at is not None and now - self._prompt_checked_at < self.check_interval:
+            return
+        self._prompt_checked_at = now
+        signature = file_signature(self.prompt_path)
+        if signature is not None and signature != self._prompt_signature:
+            self.system_prompt = self._load_prompt()
+            _logger.info(f"Reloaded audit prompt from {self.prompt_path}")
+
     async def audit_content(self, user_input, draft_reply, history) -> AuditResult:
         """
         审核内容
         """
+        self._refresh_prompt()
         audit_payload = {
             "user_input": user_input,
             "draft_reply": draft_reply,
@@ -0,0 +1,104 @@
+import asyncio
+import contextvars
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# 当前正在执行的合并批次；发送回复前调用 mark_batch_sent()，之后的新消息不再取消这次生成
+current_batch: "contextvars.ContextVar[Optional[_Batch]]" = contextvars.ContextVar("current_batch", default=None)
+
+
+class _Batch:
+    __slots__ = ("items", "timer", "task", "sent", "runs", "deferred", "owner", "key")
+
+    def __init__(self, item, owner: "Optional[ChatDebouncer]" = None, key: Optional[str] = None):
+        self.items: List[Any] = [item]
+        self.owner = owner
+        self.key = key
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.task: Optional[asyncio.Task] = None
+        self.sent = False
+        self.runs = 0
+        self.deferred: Optional[Callable[[], Any]] = None
+
+
+def mark_batch_sent(batch: "Optional[_Batch]" = None):
+    batch = batch or current_batch.get()
+    if batch is not None:
+        batch.sent = True
+        batch.deferred = None
+        if batch.owner is not None:
+            # 延迟发送的回复发出时 runner 早已返回：由这里把批次移出，避免每个会话残留一条记录
+            batch.owner._release(batch)
+
+
+def defer_batch(cancel: Callable[[], Any]) -> "Optional[_Batch]":
+    """
+    runner 把回复交给延迟发送而不是立即发送时调用：批次在真正发出（mark_batch_sent(batch)）之前保持打开，
+    期间的新消息会调用 cancel 撤回这条待发回复并合并重跑。返回当前批次（不在合并流程中时为 None）
+    """
+    batch = current_batch.get()
+    if batch is not None:
+        batch.deferred = cancel
+    return batch
+
+
+class ChatDebouncer:
+    """
+    按会话合并连续消息：同一会话的消息在 window 秒内没有新消息时才交给 runner(items) 生成一次回复；
+    runner 运行期间（回复尚未发出）若又来了新消息，取消这次生成，把新消息并入同一批次重新计时。
+    runner 在发送前调用 mark_batch_sent()，此后的新消息开启新批次；延迟发送的回复见 defer_batch。
+    """
+
+    def __init__(self):
+        self._batches: Dict[str, _Batch] = {}
+        self.merged = 0
+        self.cancelled = 0
+
+    def pending(self, chat_id) -> int:
+        batch = self._batches.get(str(chat_id))
+        return len(batch.items) if batch else 0
+
+    def submit(self, chat_id, item, window: float, runner: Callable[[List[Any]], Awaitable[None]]):
+        key = str(chat_id)
+        batch = self._batches.get(key)
+        if batch is not None and not batch.sent:
+            batch.items.append(item)
+            self.merged += 1
+            if batch.task is not None and not batch.task.done():
+                batch.task.cancel()
+                self.cancelled += 1
+            elif batch.deferred is not None:
+                cancel, batch.deferred = batch.deferred, None
+                cancel()
+                self.cancelled += 1
+        else:
+            batch = _Batch(item, self, key)
+            self._batches[key] = batch
+        if batch.timer is not None:
+            batch.timer.cancel()
+        batch.timer = asyncio.get_running_loop().call_later(max(0.0, window), self._fire, key, batch, runner)
+        return batch
+
+    def _fire(self, key, batch, runner):
+        batch.timer = None
+        batch.runs += 1
+        batch.task = asyncio.ensure_future(self._run(key, batch, runner))
+
+    async def _run(self, key, batch, runner):
+        current_batch.set(batch)
+        try:
+            await runner(list(batch.items))
+        except asyncio.CancelledError:
+            # 被新消息取代：批次保留，等待重新计时后带着全部消息再跑一次
+            return
+        finally:
+            self._release(batch)
+
+    def _release(self, batch: _Batch):
+        """批次没有待触发的计时、待发的回复，且生成已结束（或正是当前任务）时移出；已被新批次替换则不动"""
+        if batch.timer is not None or batch.deferred is not None:
+            return
+        task = batch.task
+        if task is not None and not task.done() and task is not asyncio.current_task():
+            return
+        if self._batches.get(batch.key) is batch:
+            del self._batches[batch.key]
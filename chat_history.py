@@ -0,0 +1,109 @@
+import bisect
+import threading
+from collections import OrderedDict, namedtuple
+from typing import Dict, Iterable, List, Optional
+
+# 缓冲区中的一条消息：与 Telethon Message 同名的只读字段，_should_auto_quote 等调用方可直接使用
+BufferedMessage = namedtuple("BufferedMessage", ["id", "out", "text", "date"])
+
+
+class ChatHistoryBuffer:
+    """
+    按会话的有界消息环形缓冲：由 NewMessage（收到的与发出的）和本进程的发送结果写入，
+    每个会话最多保留 per_chat 条（按消息 id 有序），会话数超过 max_chats 时淘汰最久未访问的会话。
+    会话首次被查询且尚未回填时，调用方可用 needs_backfill / seed 从 Telegram 拉取一次历史补齐。
+    """
+
+    def __init__(self, max_chats: int = 2000, per_chat: int = 32):
+        self.max_chats = max(1, int(max_chats))
+        self.per_chat = max(1, int(per_chat))
+        self._chats: "OrderedDict[str, List[BufferedMessage]]" = OrderedDict()
+        self._backfilled = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.backfills = 0
+
+    def __len__(self):
+        return len(self._chats)
+
+    def _bucket(self, chat_id) -> List[BufferedMessage]:
+        key = str(chat_id)
+        bucket = self._chats.get(key)
+        if bucket is None:
+            bucket = []
+            self._chats[key] = bucket
+            while len(self._chats) > self.max_chats:
+                evicted, _ = self._chats.popitem(last=False)
+                self._backfilled.discard(evicted)
+        else:
+            self._chats.move_to_end(key)
+        return bucket
+
+    def _insert(self, bucket: List[BufferedMessage], item: BufferedMessage):
+        ids = [m.id for m in bucket]
+        pos = bisect.bisect_left(ids, item.id)
+        if pos < len(bucket) and bucket[pos].id == item.id:
+            bucket[pos] = item
+        else:
+            bucket.insert(pos, item)
+            if len(bucket) > self.per_chat:
+                del bucket[0]
+
+    def add(self, chat_id, msg_id: int, out: bool, text: str, date=None):
+        if not text or not isinstance(text, str) or not isinstance(msg_id, int):
+            return
+        with self._lock:
+            self._insert(self._bucket(chat_id), BufferedMessage(int(msg_id), bool(out), text, date))
+
+    def add_message(self, chat_id, message):
+        """记录 Telethon Message（收到的或 send_message / reply 的返回值）"""
+        if message is None:
+            return
+        self.add(chat_id, getattr(message, "id", None), getattr(message, "out", False),
+                 getattr(message, "text", None) or getattr(message, "message", None), getattr(message, "date", None))
+
+    def needs_backfill(self, chat_id) -> bool:
+        with self._lock:
+            return str(chat_id) not in self._backfilled
+
+    def seed(self, chat_id, messages: Iterable):
+        """合并从 Telegram 拉取的历史，并标记该会话已回填"""
+        with self._lock:
+            bucket = self._bucket(chat_id)
+            for message in messages:
+                text = getattr(message, "text", None)
+                msg_id = getattr(message, "id", None)
+                if text and isinstance(text, str) and isinstance(msg_id, int):
+                    self._insert(bucket, BufferedMessage(int(msg_id), bool(getattr(message, "out", False)), text,
+                                                         getattr(message, "date", None)))
+            self._backfilled.add(str(chat_id))
+            self.backfills += 1
+
+    def mark_backfilled(self, chat_id):
+        with self._lock:
+            self._bucket(chat_id)
+            self._backfilled.add(str(chat_id))
+
+    def _before(self, chat_id, max_id: int) -> List[BufferedMessage]:
+        bucket = self._chats.get(str(chat_id))
+        if not bucket:
+            return []
+        self._chats.move_to_end(str(chat_id))
+        if not max_id:
+            return list(bucket)
+        pos = bisect.bisect_left([m.id for m in bucket], max_id)
+        return bucket[:pos]
+
+    def history(self, chat_id, limit: int = 8, max_id: int = 0) -> List[Dict[str, str]]:
+        """id < max_id 的最近 limit 条消息，按时间正序，格式同 get_chat_history"""
+        with self._lock:
+            msgs = self._before(chat_id, max_id)[-limit:] if limit > 0 else []
+            self.hits += 1
+        return [{"role": "assistant" if m.out else "user", "content": m.text} for m in msgs]
+
+    def previous(self, chat_id, max_id: int = 0) -> Optional[BufferedMessage]:
+        """id < max_id 的上一条消息"""
+        with self._lock:
+            msgs = self._before(chat_id, max_id)
+            self.hits += 1
+        return msgs[-1] if msgs else None
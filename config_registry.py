@@ -0,0 +1,75 @@
+import os
+import time
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# 两次检查文件签名之间的最小间隔：热修改在该时间内生效，其余调用直接返回内存中的解析结果
+DEFAULT_CHECK_INTERVAL_MS = 1000
+
+
+def file_signature(path: str) -> Optional[Tuple[int, int]]:
+    """文件签名 (mtime_ns, size)；文件不存在时为 None"""
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+
+class _WatchedFile:
+    __slots__ = ("path", "parser", "signature", "value", "checked_at", "loaded")
+
+    def __init__(self, path: str, parser: Callable[[str], Any]):
+        self.path = path
+        self.parser = parser
+        self.signature = None
+        self.value = None
+        self.checked_at = 0.0
+        self.loaded = False
+
+
+class ConfigRegistry:
+    """
+    被监视配置文件的注册表：每个文件保存一份解析后的快照，
+    距上次检查超过 check_interval_ms 才 stat 一次，签名 (mtime, size) 变化时才重新解析。
+    parser 接收文件路径并返回解析结果，需自行处理文件不存在/格式错误（返回默认值）；
+    返回的快照由所有调用方共享，调用方不要原地修改。
+    """
+
+    def __init__(self, check_interval_ms: float = DEFAULT_CHECK_INTERVAL_MS, clock=time.monotonic):
+        self.check_interval = max(0.0, float(check_interval_ms)) / 1000.0
+        self._clock = clock
+        self._files: Dict[str, _WatchedFile] = {}
+        self._lock = threading.Lock()
+        self.reloads = 0
+
+    def register(self, name: str, path: str, parser: Callable[[str], Any]):
+        with self._lock:
+            self._files[name] = _WatchedFile(path, parser)
+
+    def path(self, name: str) -> str:
+        return self._files[name].path
+
+    def get(self, name: str) -> Any:
+        entry = self._files[name]
+        now = self._clock()
+        if entry.loaded and now - entry.checked_at < self.check_interval:
+            return entry.value
+        with self._lock:
+            if entry.loaded and now - entry.checked_at < self.check_interval:
+                return entry.value
+            sig = file_signature(entry.path)
+            if not entry.loaded or sig != entry.signature:
+                entry.value = entry.parser(entry.path)
+                entry.signature = sig
+                entry.loaded = True
+                self.reloads += 1
+            entry.checked_at = now
+            return entry.value
+
+    def invalidate(self, name: Optional[str] = None):
+        """本进程写入文件后调用：下次 get 立即重新解析（不等待检查间隔，也不依赖 mtime 精度）"""
+        with self._lock:
+            entries = self._files.values() if name is None else [self._files[name]]
+            for entry in entries:
+                entry.loaded = False
@@ -1,15 +1,22 @@
 import sqlite3
 import json
 import os
+import uuid
+import hashlib
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterable, Callable
+
+from kb_index import bm25_terms, parse_tags
 
 class DatabaseManager:
     def __init__(self, db_path: str = "data/core.db"):
         self.db_path = db_path
+        self._kb_listeners = []
+        self._fts_enabled = False
         self._ensure_db_dir()
         self._init_schema()
         self._migrate_tables()
+        self._init_kb_fts()
 
     def _ensure_db_dir(self):
         dirname = os.path.dirname(self.db_path)
@@ -87,9 +94,30 @@ class DatabaseManager:
             content TEXT,
             source_file TEXT,
             created_at TIMESTAMP,
-            updated_at TIMESTAMP
+            updated_at TIMESTAMP,
+            content_hash TEXT,
+            parent_id TEXT,
+            chunk_index INTEGER
+        )
+        ''')
+
+
+        # 知识库版本号：任何进程对 knowledge_base 的写入都会通过触发器递增，供常驻快照判断是否需要重新加载
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS kb_versions (
+            tenant_id TEXT PRIMARY KEY,
+            version INTEGER DEFAULT 0
         )
         ''')
+        for event, ref in (("INSERT", "NEW"), ("UPDATE", "OLD"), ("DELETE", "OLD")):
+            cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS kb_version_on_{event.lower()}
+            AFTER {event} ON knowledge_base
+            BEGIN
+                INSERT INTO kb_versions (tenant_id, version) VALUES (COALESCE({ref}.tenant_id, ''), 1)
+                ON CONFLICT(tenant_id) DO UPDATE SET version = version + 1;
+            END
+            ''')
         
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS conversation_states (
@@ -185,6 +213,20 @@ class DatabaseManager:
                 
             if 'handoff_required' not in cs_columns:
                 cursor.execute("ALTER TABLE conversation_states ADD COLUMN handoff_required INTEGER DEFAULT 0")
+
+            # 检查 knowledge_base 表是否缺少 content_hash（增量同步用）
+            cursor.execute("PRAGMA table_info(knowledge_base)")
+            kb_columns = [info[1] for info in cursor.fetchall()]
+
+            if 'content_hash' not in kb_columns:
+                cursor.execute("ALTER TABLE knowledge_base ADD COLUMN content_hash TEXT")
+
+            # 长文档切分后的段落通过 parent_id 关联所属文档，chunk_index 为段落序号
+            if 'parent_id' not in kb_columns:
+                cursor.execute("ALTER TABLE knowledge_base ADD COLUMN parent_id TEXT")
+
+            if 'chunk_index' not in kb_columns:
+                cursor.execute("ALTER TABLE knowledge_base ADD COLUMN chunk_index INTEGER")
                 
             conn.commit()
         except Exception as e:
@@ -306,22 +348,320 @@ class DatabaseManager:
 
     # --- Knowledge Base Operations ---
 
+    # 全文索引：FTS5 表 kb_fts 的 rowid 取自映射表 kb_fts_ids（INTEGER PRIMARY KEY，VACUUM 后保持不变），
+    # 检索时经映射表按 id 关联 knowledge_base；knowledge_base 是 TEXT 主键，其隐式 rowid 可能被 VACUUM 重新编号，不能直接关联。
+    # 索引列存放应用侧切好的词项（英文按词、中文按 bigram，与 BM25 引擎一致），由 unicode61 分词器按空格切分。
+    # 写入由 KB 写方法在同一事务内维护，删除由触发器同步（其它进程直接删除也能覆盖）。
+
+    def _init_kb_fts(self):
+        conn = self._get_conn()
+        try:
+            cursor = conn.cursor()
+            has_map = cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'kb_fts_ids'"
+            ).fetchone()
+            if not has_map:
+                # 旧版索引直接按 knowledge_base.rowid 关联：丢弃后按新结构重建
+                cursor.execute("DROP TRIGGER IF EXISTS kb_fts_on_delete")
+                cursor.execute("DROP TABLE IF EXISTS kb_fts")
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS kb_fts USING fts5(title_terms, content_terms, tokenize='unicode61')"
+            )
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS kb_fts_ids (fts_rowid INTEGER PRIMARY KEY, kb_id TEXT NOT NULL UNIQUE)"
+            )
+            cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS kb_fts_on_delete
+            AFTER DELETE ON knowledge_base
+            BEGIN
+                DELETE FROM kb_fts WHERE rowid = (SELECT fts_rowid FROM kb_fts_ids WHERE kb_id = OLD.id);
+                DELETE FROM kb_fts_ids WHERE kb_id = OLD.id;
+            END
+            """)
+            self._fts_enabled = True
+            # 旧库或索引缺失时回填
+            kb_count = cursor.execute("SELECT COUNT(*) FROM knowledge_base").fetchone()[0]
+            fts_count = cursor.execute("SELECT COUNT(*) FROM kb_fts").fetchone()[0]
+            map_count = cursor.execute("SELECT COUNT(*) FROM kb_fts_ids").fetchone()[0]
+            if kb_count != fts_count or kb_count != map_count:
+                cursor.execute("DELETE FROM kb_fts")
+                cursor.execute("DELETE FROM kb_fts_ids")
+                cursor.execute("SELECT id, title, content FROM knowledge_base")
+                rows = [{"id": r[0], "title": r[1], "content": r[2]} for r in cursor.fetchall()]
+                self._index_kb_fts(cursor, rows)
+            conn.commit()
+        except sqlite3.OperationalError as e:
+            print(f"FTS5 unavailable, search_kb falls back to in-memory search: {e}")
+            self._fts_enabled = False
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _fts_terms(text: Optional[str]) -> str:
+        return " ".join(bm25_terms(text or ""))
+
+    def _index_kb_fts(self, cursor, items: Iterable[Dict]):
+        """按 id 重建给定条目的全文索引行（调用方负责提交事务）"""
+        if not self._fts_enabled:
+            return
+        items = list(items)
+        if not items:
+            return
+        ids = [(it['id'],) for it in items]
+        cursor.executemany(
+            "DELETE FROM kb_fts WHERE rowid = (SELECT fts_rowid FROM kb_fts_ids WHERE kb_id = ?)", ids
+        )
+        # 只为 knowledge_base 中存在的条目分配映射；已有映射的条目沿用原 fts_rowid
+        cursor.executemany(
+            "INSERT OR IGNORE INTO kb_fts_ids (kb_id) SELECT id FROM knowledge_base WHERE id = ?", ids
+        )
+        cursor.executemany(
+            "INSERT INTO kb_fts (rowid, title_terms, content_terms) SELECT fts_rowid, ?, ? FROM kb_fts_ids WHERE kb_id = ?",
+            [(self._fts_terms(it.get('title')), self._fts_terms(it.get('content')), it['id']) for it in items]
+        )
+
+    def search_kb(self, tenant_id: str, query: str, limit: int = 5, tags: Optional[List[str]] = None) -> List[Dict]:
+        """
+        在 SQLite 内检索知识库，返回按相关度排序的前 limit 条（字段同 get_kb_items，另含 score）
+        相关度为 FTS5 的 bm25，标题权重 2、正文权重 1；tags 非空时只返回含任一标签的条目
+        """
+        terms = list(dict.fromkeys(bm25_terms(query or "")))[:64]
+        if not terms or limit <= 0:
+            return []
+        if not self._fts_enabled:
+            from kb_index import BM25Index, KBIndex, np
+            items = self.get_kb_items(tenant_id)
+            if tags:
+                wanted = set(tags)
+                items = [it for it in items if wanted & set(parse_tags(it.get('tags')) or [])]
+            index = BM25Index(items) if np is not None else KBIndex(items)
+            return index.search(query, limit)
+
+        sql = """
+            SELECT kb.*, -bm25(kb_fts, 2.0, 1.0) AS score
+            FROM kb_fts
+            JOIN kb_fts_ids m ON m.fts_rowid = kb_fts.rowid
+            JOIN knowledge_base kb ON kb.id = m.kb_id
+            WHERE kb_fts MATCH ? AND kb.tenant_id = ?
+        """
+        params: List[Any] = [" OR ".join(f'"{t}"' for t in terms), tenant_id]
+        if tags:
+            sql += """
+            AND json_valid(kb.tags)
+            AND EXISTS (SELECT 1 FROM json_each(kb.tags) WHERE json_each.value IN ({}))
+            """.format(",".join("?" * len(tags)))
+            params.extend(tags)
+        sql += " ORDER BY bm25(kb_fts, 2.0, 1.0) LIMIT ?"
+        params.append(int(limit))
+        return self.execute_query(sql, tuple(params))
+
+    def add_kb_listener(self, callback):
+        """注册知识库变更回调: callback(action, item_id, data)，action 为 add / update / delete"""
+        if callback not in self._kb_listeners:
+            self._kb_listeners.append(callback)
+
+    def _notify_kb_change(self, action: str, item_id: str, data: Optional[Dict] = None):
+        for cb in list(self._kb_listeners):
+            try:
+                cb(action, item_id, data)
+            except Exception as e:
+                print(f"KB listener failed: {e}")
+
+    def get_kb_version(self, tenant_id: str) -> int:
+        rows = self.execute_query("SELECT version FROM kb_versions WHERE tenant_id = ?", (tenant_id,))
+        if rows and rows[0]['version'] is not None:
+            return int(rows[0]['version'])
+        return 0
+
     def get_kb_items(self, tenant_id: str) -> List[Dict]:
         query = "SELECT * FROM knowledge_base WHERE tenant_id = ? ORDER BY updated_at DESC"
         rows = self.execute_query(query, (tenant_id,))
         # Parse tags from JSON/String if needed, assuming simple string for now or comma-separated
         return rows
 
+    _KB_INSERT_SQL = """
+        INSERT INTO knowledge_base (id, tenant_id, title, category, tags, content, source_file, created_at, updated_at, content_hash,
+                                    parent_id, chunk_index)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """
+
+    @staticmethod
+    def _kb_content_hash(item: Dict) -> str:
+        """条目内容指纹：标题、分类、标签、正文、来源文件任一变化都会改变"""
+        tags = item.get('tags')
+        if not isinstance(tags, str):
+            tags = json.dumps(tags or [], ensure_ascii=False)
+        parts = (item.get('source_file'), item.get('category'), item.get('title'), tags, item.get('content'))
+        raw = "\x1f".join("" if p is None else str(p) for p in parts)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def _kb_row_params(cls, item: Dict) -> tuple:
+        return (
+            item['id'], item['tenant_id'], item['title'], item['category'],
+            item['tags'], item['content'], item['source_file'],
+            item['created_at'], item['updated_at'],
+            item.get('content_hash') or cls._kb_content_hash(item),
+            item.get('parent_id'), item.get('chunk_index')
+        )
+
     def add_kb_item(self, item: Dict):
-        query = """
-        INSERT INTO knowledge_base (id, tenant_id, title, category, tags, content, source_file, created_at, updated_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        conn = self._get_conn()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self._KB_INSERT_SQL, self._kb_row_params(item))
+            self._index_kb_fts(cursor, [item])
+            conn.commit()
+        finally:
+            conn.close()
+        self._notify_kb_change("add", item['id'], item)
+
+    def bulk_import_kb_items(self, tenant_id: str, items: Iterable[Dict], replace: bool = False,
+                             batch_size: int = 500, progress: Optional[Callable[[int], None]] = None) -> int:
+        """
+        批量导入知识库：单连接、单事务，按 batch_size 分批 executemany，全部写入后一次提交
+        items 可以是生成器（边解析边写入）；replace=True 时在同一事务内先清空该租户条目，
+        任一环节失败整体回滚，旧数据保持不变。progress(count) 在每批写入后回调。
+        返回写入条数。
+        """
+        conn = self._get_conn()
+        count = 0
+        try:
+            cursor = conn.cursor()
+            if replace:
+                cursor.execute("DELETE FROM knowledge_base WHERE tenant_id = ?", (tenant_id,))
+            batch = []
+            for item in items:
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    cursor.executemany(self._KB_INSERT_SQL, [self._kb_row_params(it) for it in batch])
+                    self._index_kb_fts(cursor, batch)
+                    count += len(batch)
+                    batch = []
+                    if progress:
+                        progress(count)
+            if batch:
+                cursor.executemany(self._KB_INSERT_SQL, [self._kb_row_params(it) for it in batch])
+                self._index_kb_fts(cursor, batch)
+                count += len(batch)
+                if progress:
+                    progress(count)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        self._notify_kb_change("bulk", None, {"tenant_id": tenant_id, "count": count, "replace": replace})
+        return count
+
+    def sync_kb_items(self, tenant_id: str, items: Iterable[Dict], source_files: Iterable[str],
+                      batch_size: int = 500, progress: Optional[Callable[[int], None]] = None) -> Dict[str, int]:
+        """
+        按内容哈希增量同步来源文件解析出的条目，只处理 source_file 属于 source_files 的行
+        （后台手动添加/上传的条目不受影响）：
+          - 哈希相同的条目原样保留（id、created_at 不变）
+          - 同一来源文件下标题相同但内容变化的条目原地更新，保留 id
+          - 其余新条目插入；数据库中多出的旧条目删除
+        单连接、单事务，失败整体回滚。progress(count) 在每批写入后回调。
+        返回 {"added", "updated", "deleted", "unchanged"} 计数。
         """
-        self.execute_update(query, (
-            item['id'], item['tenant_id'], item['title'], item['category'], 
-            item['tags'], item['content'], item['source_file'], 
-            item['created_at'], item['updated_at']
-        ))
+        sources = list(dict.fromkeys(source_files))
+        stats = {"added": 0, "updated": 0, "deleted": 0, "unchanged": 0}
+        conn = self._get_conn()
+        conn.row_factory = sqlite3.Row
+        try:
+            cursor = conn.cursor()
+            existing = []
+            if sources:
+                placeholders = ",".join("?" * len(sources))
+                cursor.execute(
+                    f"SELECT * FROM knowledge_base WHERE tenant_id = ? AND source_file IN ({placeholders}) "
+                    "ORDER BY created_at, rowid",
+                    (tenant_id, *sources)
+                )
+                existing = [dict(r) for r in cursor.fetchall()]
+
+            by_hash: Dict[str, List[Dict]] = {}
+            for row in existing:
+                # 旧版本导入的行没有哈希，按存量字段补算，避免首次同步把未变化的条目全部重写
+                row['content_hash'] = row.get('content_hash') or self._kb_content_hash(row)
+                by_hash.setdefault(row['content_hash'], []).append(row)
+
+            # 第一轮：内容完全相同的条目直接认领旧行
+            matched = set()
+            pending = []
+            for item in items:
+                h = self._kb_content_hash(item)
+                olds = by_hash.get(h)
+                if olds:
+                    matched.add(olds.pop(0)['id'])
+                    stats["unchanged"] += 1
+                else:
+                    pending.append((item, h))
+
+            # 第二轮：同来源同标题的旧行视为被编辑，原地更新
+            by_key: Dict[tuple, List[Dict]] = {}
+            for row in existing:
+                if row['id'] not in matched:
+                    by_key.setdefault((row['source_file'], row['title']), []).append(row)
+
+            inserts, updates, reindex = [], [], []
+            for item, h in pending:
+                olds = by_key.get((item.get('source_file'), item.get('title')))
+                if olds:
+                    old = olds.pop(0)
+                    matched.add(old['id'])
+                    updates.append((item['category'], item['tags'], item['content'], item['updated_at'], h,
+                                    item.get('parent_id'), item.get('chunk_index'), old['id']))
+                    reindex.append({"id": old['id'], "title": old['title'], "content": item['content']})
+                else:
+                    row = dict(item)
+                    row['id'] = row.get('id') or str(uuid.uuid4())
+                    row['tenant_id'] = tenant_id
+                    row['content_hash'] = h
+                    inserts.append(self._kb_row_params(row))
+                    reindex.append(row)
+            deletes = [(row['id'],) for row in existing if row['id'] not in matched]
+
+            written = 0
+            for sql, params in (
+                ("DELETE FROM knowledge_base WHERE id = ?", deletes),
+                ("UPDATE knowledge_base SET category = ?, tags = ?, content = ?, updated_at = ?, content_hash = ?, "
+                 "parent_id = ?, chunk_index = ? WHERE id = ?", updates),
+                (self._KB_INSERT_SQL, inserts),
+            ):
+                for i in range(0, len(params), batch_size):
+                    batch = params[i:i + batch_size]
+                    cursor.executemany(sql, batch)
+                    written += len(batch)
+                    if progress:
+                        progress(written)
+            self._index_kb_fts(cursor, reindex)
+            conn.commit()
+            stats["added"], stats["updated"], stats["deleted"] = len(inserts), len(updates), len(deletes)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        if inserts or updates or deletes:
+            self._notify_kb_change("bulk", None, {"tenant_id": tenant_id, **stats})
+        return stats
+
+    def delete_kb_document(self, parent_id: str) -> int:
+        """删除某个文档切分出的全部段落"""
+        conn = self._get_conn()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM knowledge_base WHERE parent_id = ?", (parent_id,))
+            count = cursor.rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        if count:
+            self._notify_kb_change("bulk", None, {"parent_id": parent_id, "deleted": count})
+        return count
 
     def update_kb_item(self, item_id: str, updates: Dict):
         # Construct dynamic update query
@@ -330,13 +670,28 @@ class DatabaseManager:
         for k, v in updates.items():
             fields.append(f"{k} = ?")
             values.append(v)
+        if 'content_hash' not in updates:
+            # 内容被手动修改，指纹置空，下次同步时按存量字段重新计算
+            fields.append("content_hash = NULL")
         values.append(item_id)
         
         query = f"UPDATE knowledge_base SET {', '.join(fields)} WHERE id = ?"
-        self.execute_update(query, tuple(values))
+        conn = self._get_conn()
+        conn.row_factory = sqlite3.Row
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query, tuple(values))
+            if 'title' in updates or 'content' in updates:
+                cursor.execute("SELECT id, title, content FROM knowledge_base WHERE id = ?", (item_id,))
+                self._index_kb_fts(cursor, [dict(r) for r in cursor.fetchall()])
+            conn.commit()
+        finally:
+            conn.close()
+        self._notify_kb_change("update", item_id, updates)
 
     def delete_kb_item(self, item_id: str):
         self.execute_update("DELETE FROM knowledge_base WHERE id = ?", (item_id,))
+        self._notify_kb_change("delete", item_id)
 
     def delete_conversation_state(self, tenant_id: str, platform: str, user_id: str):
         self.execute_update(
@@ -0,0 +1,123 @@
+import os
+import json
+import atexit
+import threading
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+
+class GroupCache:
+    """
+    群聊缓存（group_cache.json）的内存副本：record 只在新群、标题变化或 last_seen 超过 touch_seconds 时标记为脏，
+    后台线程至多每 flush_interval 秒把整份缓存原子写回一次；进程退出时自动落盘。
+    文件只由机器人进程写入，后台群聊选择器只读。
+    """
+
+    def __init__(self, path: str, flush_interval: float = 3.0):
+        self.path = path
+        self.flush_interval = float(flush_interval)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._data: Optional[Dict[str, Dict[str, Any]]] = None
+        self._seen_at: Dict[str, datetime] = {}
+        self._dirty = False
+        self._stop = threading.Event()
+        self._thread = None
+        self.flushes = 0
+        atexit.register(self.close)
+
+    def _ensure_loaded(self):
+        if self._data is not None:
+            return
+        data = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                loaded = json.load(f)
+            if isinstance(loaded, dict):
+                data = loaded
+        except (OSError, ValueError):
+            pass
+        self._data = data
+        for chat_id, entry in data.items():
+            try:
+                self._seen_at[chat_id] = datetime.fromisoformat((entry or {}).get("last_seen") or "")
+            except (AttributeError, ValueError):
+                pass
+
+    def get(self, chat_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._ensure_loaded()
+            entry = self._data.get(chat_id)
+            return dict(entry) if entry is not None else None
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            self._ensure_loaded()
+            return {k: dict(v) for k, v in self._data.items()}
+
+    def record(self, chat_id: str, title: str = "", touch_seconds: float = 60.0, now: Optional[datetime] = None) -> bool:
+        """更新群聊标题与 last_seen，返回本次是否产生了需要落盘的变化"""
+        now = now or datetime.now()
+        with self._lock:
+            self._ensure_loaded()
+            entry = self._data.get(chat_id)
+            changed = entry is None
+            entry = dict(entry or {})
+            if title and title != entry.get("title"):
+                entry["title"] = title
+                changed = True
+            entry.setdefault("title", "")
+            last = self._seen_at.get(chat_id)
+            if changed or last is None or (now - last).total_seconds() >= touch_seconds:
+                entry["last_seen"] = now.isoformat()
+                self._seen_at[chat_id] = now
+                changed = True
+            if not changed:
+                return False
+            self._data[chat_id] = entry
+            self._dirty = True
+        if self._thread is None:
+            self._start()
+        return True
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None and not self._stop.is_set():
+                self._thread = threading.Thread(target=self._run, name="group-cache-flush", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"⚠️ 保存群聊缓存失败: {e}")
+
+    def flush(self) -> bool:
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return False
+                data = json.dumps(self._data, ensure_ascii=False, indent=2)
+                self._dirty = False
+            try:
+                dirname = os.path.dirname(self.path)
+                if dirname:
+                    os.makedirs(dirname, exist_ok=True)
+                tmp = f"{self.path}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.write(data)
+                os.replace(tmp, self.path)
+            except OSError:
+                with self._lock:
+                    self._dirty = True
+                raise
+            self.flushes += 1
+            return True
+
+    def close(self):
+        self._stop.set()
+        try:
+            self.flush()
+        except OSError:
+            pass
@@ -0,0 +1,112 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class QueryCache:
+    """
+    有界 LRU + TTL 缓存（线程安全），用于缓存知识库检索结果
+    - 超过 maxsize 时淘汰最久未使用的条目；条目写入超过 ttl 秒后视为过期
+    - 记录 hits / misses / evictions / expired 计数，供后台查看命中率
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0, clock=time.monotonic):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = float(ttl)
+        self._clock = clock
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """返回 (是否命中, 值)"""
+        now = self._clock()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if self.ttl <= 0 or now - stored_at < self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._data[key]
+                self.expired += 1
+            self.misses += 1
+            return False, None
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = (self._clock(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expired": self.expired,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+def write_cache_stats(path: str, stats: Dict[str, Any]):
+    """原子写入统计文件（先写临时文件再替换），后台进程读取时不会读到半截内容"""
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    data = dict(stats)
+    data["updated_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+class CacheStatsWriter:
+    """
+    把 source() 返回的统计写入 path（write_cache_stats），与上次写入的内容相同时跳过。
+    作为 StatsAggregator 的 flush hook 在后台线程中调用，处理消息的事件循环不做磁盘 I/O
+    """
+
+    def __init__(self, path: str, source: Callable[[], Dict[str, Any]]):
+        self.path = path
+        self.source = source
+        # 以创建时的统计为起点：没有任何活动时不产生文件
+        self._last = source()
+
+    def __call__(self) -> bool:
+        stats = self.source()
+        if stats == self._last:
+            return False
+        write_cache_stats(self.path, stats)
+        self._last = stats
+        return True
+
+
+def read_cache_stats(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
@@ -0,0 +1,102 @@
+import re
+from typing import Iterable, Iterator, List
+
+# 单个段落的字符上限与相邻段落的重叠字符数：限制每次命中的检索开销与注入提示词的长度
+DEFAULT_MAX_CHARS = 800
+DEFAULT_OVERLAP = 120
+
+# 标题行：Markdown 标题、PDF 分页标记、中文章节编号
+_HEADING_RE = re.compile(r"^\s*(#{1,6}\s|第[一二三四五六七八九十百千零\d]+[章节部分条篇]|[一二三四五六七八九十]+、)")
+# 超过此长度的行视为正文而非标题（如以“第一条”开头的长段落）
+_HEADING_MAX_CHARS = 60
+# 句子边界：中英文句末标点之后（英文句号需后跟空白）
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[。！？!?；;…])|(?<=\.)(?=\s)")
+
+
+def _iter_lines(pieces: Iterable[str]) -> Iterator[str]:
+    """把任意切分的文本流重新按行产出（保留换行符），只缓存当前不完整的一行"""
+    pending = ""
+    for piece in pieces:
+        if not piece:
+            continue
+        pending += piece
+        start = 0
+        while True:
+            nl = pending.find("\n", start)
+            if nl == -1:
+                break
+            yield pending[start:nl + 1]
+            start = nl + 1
+        pending = pending[start:]
+    if pending:
+        yield pending
+
+
+class _PassageBuilder:
+    def __init__(self, max_chars: int, overlap: int):
+        self.max_chars = max_chars
+        self.overlap = overlap
+        self.units: List[str] = []
+        self.size = 0
+        self.fresh = 0  # 当前段落中非重叠部分的字符数
+
+    def _emit(self) -> Iterator[str]:
+        if self.fresh:
+            text = "".join(self.units).strip()
+            if text:
+                yield text
+        self.units, self.size, self.fresh = [], 0, 0
+
+    def flush(self) -> Iterator[str]:
+        yield from self._emit()
+
+    def push(self, unit: str) -> Iterator[str]:
+        if not unit:
+            return
+        # 超长句子按窗口硬切，窗口之间同样保留重叠
+        if len(unit) > self.max_chars:
+            step = max(1, self.max_chars - self.overlap)
+            for i in range(0, len(unit), step):
+                yield from self.push(unit[i:i + self.max_chars])
+                if i + self.max_chars >= len(unit):
+                    break
+            return
+        if self.size + len(unit) > self.max_chars and self.fresh:
+            tail = self.units[:]
+            yield from self._emit()
+            # 以上一段末尾若干完整句子作为重叠前缀
+            kept, total = [], 0
+            for u in reversed(tail):
+                if total + len(u) > self.overlap:
+                    break
+                kept.insert(0, u)
+                total += len(u)
+            while kept and total + len(unit) > self.max_chars:
+                total -= len(kept.pop(0))
+            self.units, self.size = kept, total
+        self.units.append(unit)
+        self.size += len(unit)
+        self.fresh += len(unit)
+
+
+def iter_chunks(pieces: Iterable[str], max_chars: int = DEFAULT_MAX_CHARS,
+                overlap: int = DEFAULT_OVERLAP) -> Iterator[str]:
+    """
+    流式切分文档：边读边产出长度不超过 max_chars 的段落
+    pieces 可以是文件对象、逐页/逐行的生成器或字符串列表；在标题行处强制分段，
+    其余在句子边界处分段，相邻段落重叠约 overlap 个字符
+    """
+    overlap = max(0, min(overlap, max_chars // 2))
+    builder = _PassageBuilder(max_chars, overlap)
+    for line in _iter_lines(pieces):
+        if len(line) <= _HEADING_MAX_CHARS and _HEADING_RE.match(line):
+            yield from builder.flush()
+        for unit in _SENTENCE_SPLIT_RE.split(line):
+            yield from builder.push(unit)
+    yield from builder.flush()
+
+
+def chunk_text(text: str, max_chars: int = DEFAULT_MAX_CHARS, overlap: int = DEFAULT_OVERLAP) -> List[str]:
+    if not text:
+        return []
+    return list(iter_chunks([text], max_chars, overlap))
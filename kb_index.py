@@ -0,0 +1,653 @@
+import os
+import re
+import json
+import time
+import difflib
+import heapq
+import hashlib
+import threading
+from collections import Counter
+from typing import List, Dict, Optional, Set
+
+try:
+    import numpy as np
+except ImportError:  # BM25 引擎为可选功能，缺少 numpy 时回退到 bigram 引擎
+    np = None
+
+
+def normalize_text(text):
+    text = text.lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    text = re.sub(r"[^0-9a-z\u4e00-\u9fff]+", "", text)
+    return text
+
+
+def bigram_tokens(text):
+    if not text:
+        return set()
+    if len(text) < 2:
+        return {text}
+    return set(text[i:i+2] for i in range(len(text) - 1))
+
+
+def parse_tags(tags):
+    """tags 字段在数据库中是 JSON 字符串，内存中统一为 list"""
+    if isinstance(tags, str):
+        try:
+            return json.loads(tags)
+        except Exception:
+            return [t.strip() for t in tags.split(",") if t.strip()]
+    return tags
+
+
+class _IndexedItem:
+    __slots__ = ("item", "order", "raw_title", "raw_content", "title", "content")
+
+    def __init__(self, item: Dict, order: int):
+        self.item = item
+        self.order = order
+        self.raw_title = item.get("title", "") or ""
+        self.raw_content = item.get("content", "") or ""
+        self.title = normalize_text(self.raw_title)
+        self.content = normalize_text(self.raw_content)
+
+
+class KBIndex:
+    """
+    知识库倒排索引：bigram -> 条目 id 集合 (posting list)
+    - 标题与正文分别建索引，保持 2.0 * 标题重合 + 1.0 * 正文重合 + 包含加分 的打分语义
+    - 检索时只对与查询共享至少一个 bigram 的候选条目打分
+    - 支持按条目增量更新 (add / update / remove)，以及按列表差量同步 (sync)
+    """
+
+    engine = "bigram"
+
+    def __init__(self, kb_items: Optional[List[Dict]] = None):
+        self._lock = threading.RLock()
+        self._entries: Dict[str, _IndexedItem] = {}
+        self._title_postings: Dict[str, Set[str]] = {}
+        self._content_postings: Dict[str, Set[str]] = {}
+        # 标题或正文归一化后长度 < 2 的条目：包含加分可能与 bigram 无关，始终作为候选
+        self._short_ids: Set[str] = set()
+        self._next_order = 0
+        self._source = None
+        if kb_items:
+            self.sync(kb_items)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def is_built_for(self, kb_items) -> bool:
+        return kb_items is not None and kb_items is self._source
+
+    def _key(self, item: Dict) -> str:
+        item_id = item.get("id")
+        return str(item_id) if item_id is not None else f"_anon_{id(item)}"
+
+    def _index_entry(self, key: str, entry: _IndexedItem):
+        self._entries[key] = entry
+        for tok in bigram_tokens(entry.title):
+            self._title_postings.setdefault(tok, set()).add(key)
+        for tok in bigram_tokens(entry.content):
+            self._content_postings.setdefault(tok, set()).add(key)
+        if len(entry.title) < 2 or len(entry.content) < 2:
+            self._short_ids.add(key)
+
+    def _unindex(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for postings, text in ((self._title_postings, entry.title), (self._content_postings, entry.content)):
+            for tok in bigram_tokens(text):
+                ids = postings.get(tok)
+                if ids is not None:
+                    ids.discard(key)
+                    if not ids:
+                        del postings[tok]
+        self._short_ids.discard(key)
+
+    def sync(self, kb_items: List[Dict]):
+        """
+        与给定条目列表同步：标题/正文未变化的条目复用已有索引，仅对新增/变更条目重建，
+        并删除列表中已不存在的条目。条目顺序以列表为准（用于同分排序）。
+        """
+        with self._lock:
+            seen = set()
+            for order, it in enumerate(kb_items):
+                key = self._key(it)
+                seen.add(key)
+                entry = self._entries.get(key)
+                title = it.get("title", "") or ""
+                content = it.get("content", "") or ""
+                if entry is not None and entry.raw_title == title and entry.raw_content == content:
+                    entry.item = it
+                    entry.order = order
+                    continue
+                if entry is not None:
+                    self._unindex(key)
+                self._index_entry(key, _IndexedItem(it, order))
+            for key in [k for k in self._entries if k not in seen]:
+                self._unindex(key)
+            self._next_order = len(kb_items)
+            self._source = kb_items
+
+    def add(self, item: Dict):
+        with self._lock:
+            key = self._key(item)
+            self._unindex(key)
+            self._index_entry(key, _IndexedItem(item, self._next_order))
+            self._next_order += 1
+
+    def update(self, item_id: str, updates: Dict):
+        with self._lock:
+            key = str(item_id)
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            item = dict(entry.item)
+            item.update(updates)
+            if "tags" in updates:
+                item["tags"] = parse_tags(item.get("tags"))
+            self._unindex(key)
+            self._index_entry(key, _IndexedItem(item, entry.order))
+
+    def remove(self, item_id: str):
+        with self._lock:
+            self._unindex(str(item_id))
+
+    def search(self, query_text: str, topn: int = 2) -> List[Dict]:
+        if not query_text:
+            return []
+        norm_q = normalize_text(query_text)
+        if not norm_q:
+            return []
+        q_tokens = bigram_tokens(norm_q)
+        q_len = max(1, len(q_tokens))
+        limit = max(1, topn)
+        with self._lock:
+            title_hits: Dict[str, int] = {}
+            content_hits: Dict[str, int] = {}
+            for tok in q_tokens:
+                for key in self._title_postings.get(tok, ()):
+                    title_hits[key] = title_hits.get(key, 0) + 1
+                for key in self._content_postings.get(tok, ()):
+                    content_hits[key] = content_hits.get(key, 0) + 1
+            if len(norm_q) < 2:
+                # 单字查询可能作为子串命中（包含加分）却不与任何 bigram 重合：所有条目都是候选
+                candidates = set(self._entries)
+            else:
+                candidates = set(title_hits) | set(content_hits) | self._short_ids
+
+            scored = []
+            matched = set()
+            for key in candidates:
+                entry = self._entries[key]
+                title, content = entry.title, entry.content
+                if not title and not content:
+                    continue
+                bonus = 0.0
+                if norm_q in title or title in norm_q:
+                    bonus += 0.6
+                if norm_q in content or content in norm_q:
+                    bonus += 0.3
+                title_overlap = title_hits.get(key, 0) / q_len
+                content_overlap = content_hits.get(key, 0) / q_len
+                base = 2.0 * title_overlap + 1.0 * content_overlap + bonus
+                if base > 0.0:
+                    matched.add(key)
+                    scored.append((base, entry.order, entry.item))
+
+            # 零分条目按相似度 * 0.5 兜底打分，该分数严格小于 0.5（相似度为 1 时必有包含加分）。
+            # 得分 >= 0.5 的命中不足 limit 条时，零分条目可能进入前 limit，与原逐条扫描一样对其余条目全部打分
+            if sum(1 for base, _, _ in scored if base >= 0.5) < limit:
+                for key, entry in self._entries.items():
+                    if key in matched:
+                        continue
+                    title, content = entry.title, entry.content
+                    if not title and not content:
+                        continue
+                    base = difflib.SequenceMatcher(None, norm_q, title + content).ratio() * 0.5
+                    scored.append((base, entry.order, entry.item))
+
+        scored.sort(key=lambda x: (-x[0], x[1]))
+        return [it for _, _, it in scored[:limit]]
+
+
+_TERM_RE = re.compile(r"[0-9a-z]+|[\u4e00-\u9fff]+")
+
+
+def bm25_terms(text):
+    """英文/数字按词切分，中文连续片段按 bigram 切分（单字片段保留单字）"""
+    terms = []
+    for run in _TERM_RE.findall((text or "").lower()):
+        if run[0] < "\u4e00" or len(run) < 2:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i+2] for i in range(len(run) - 1))
+    return terms
+
+
+class _RebuildOnWriteIndex:
+    """矩阵类引擎的公共部分：保存条目列表，任何写入只标记为脏，下次检索时整体重建"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._items: List[Dict] = []
+        self._source = None
+        self._dirty = True
+
+    def __len__(self):
+        return len(self._items)
+
+    def is_built_for(self, kb_items) -> bool:
+        return kb_items is not None and kb_items is self._source
+
+    def sync(self, kb_items: List[Dict]):
+        with self._lock:
+            self._items = list(kb_items)
+            self._source = kb_items
+            self._dirty = True
+
+    def ensure_built(self):
+        """立即重建（供后台线程预热，避免首条消息在事件循环里承担构建开销）"""
+        with self._lock:
+            if self._dirty:
+                self._build()
+
+    def _position(self, item_id) -> int:
+        for pos, it in enumerate(self._items):
+            if str(it.get("id")) == str(item_id):
+                return pos
+        return -1
+
+    def add(self, item: Dict):
+        with self._lock:
+            pos = self._position(item.get("id"))
+            if pos >= 0:
+                self._items[pos] = item
+            else:
+                self._items.append(item)
+            self._dirty = True
+
+    def update(self, item_id: str, updates: Dict):
+        with self._lock:
+            pos = self._position(item_id)
+            if pos < 0:
+                return
+            item = dict(self._items[pos])
+            item.update(updates)
+            if "tags" in updates:
+                item["tags"] = parse_tags(item.get("tags"))
+            self._items[pos] = item
+            self._dirty = True
+
+    def remove(self, item_id: str):
+        with self._lock:
+            pos = self._position(item_id)
+            if pos >= 0:
+                del self._items[pos]
+                self._dirty = True
+
+
+class BM25Index(_RebuildOnWriteIndex):
+    """
+    BM25 检索引擎：预先构建 词项-文档 稀疏矩阵（按词项存储的 CSR：indptr / doc_ids / weights）
+    权重已折算 IDF 与文档长度归一化，查询时一次 np.bincount 即可对全部条目打分。
+    标题词频按 title_weight 加权（与 bigram 引擎“标题重合 x2”一致）。
+    只返回得分大于 0 的条目；条目写入后标记为脏，下次检索时重建矩阵。
+    """
+
+    engine = "bm25"
+
+    def __init__(self, kb_items: Optional[List[Dict]] = None, k1: float = 1.5, b: float = 0.75, title_weight: float = 2.0):
+        if np is None:
+            raise RuntimeError("BM25Index requires numpy")
+        super().__init__()
+        self.k1 = k1
+        self.b = b
+        self.title_weight = title_weight
+        self._vocab: Dict[str, int] = {}
+        self._indptr = np.zeros(1, dtype=np.int64)
+        self._doc_ids = np.zeros(0, dtype=np.int32)
+        self._weights = np.zeros(0, dtype=np.float32)
+        if kb_items:
+            self.sync(kb_items)
+
+    def _build(self):
+        vocab: Dict[str, int] = {}
+        term_ids, doc_ids, tfs = [], [], []
+        doc_len = np.zeros(len(self._items), dtype=np.float64)
+        for doc, it in enumerate(self._items):
+            counts = Counter(bm25_terms(it.get("content", "") or ""))
+            for term, c in Counter(bm25_terms(it.get("title", "") or "")).items():
+                counts[term] += self.title_weight * c
+            for term, tf in counts.items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                doc_ids.append(doc)
+                tfs.append(tf)
+            doc_len[doc] = sum(counts.values())
+
+        n_docs = len(self._items)
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        tfs = np.asarray(tfs, dtype=np.float64)
+        df = np.bincount(term_ids, minlength=len(vocab)).astype(np.float64)
+        idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+        avgdl = float(doc_len.mean()) if n_docs and doc_len.sum() > 0 else 1.0
+        norm = self.k1 * (1.0 - self.b + self.b * doc_len[doc_ids] / avgdl)
+        weights = idf[term_ids] * tfs * (self.k1 + 1.0) / (tfs + norm)
+
+        order = np.argsort(term_ids, kind="stable")
+        self._vocab = vocab
+        self._indptr = np.concatenate(([0], np.cumsum(np.bincount(term_ids, minlength=len(vocab))))).astype(np.int64)
+        self._doc_ids = doc_ids[order]
+        self._weights = weights[order].astype(np.float32)
+        self._dirty = False
+
+    def search(self, query_text: str, topn: int = 2) -> List[Dict]:
+        if not query_text:
+            return []
+        with self._lock:
+            if self._dirty:
+                self._build()
+            items = self._items
+            vocab, indptr, doc_ids, weights = self._vocab, self._indptr, self._doc_ids, self._weights
+        if not items:
+            return []
+        tids = [vocab[t] for t in set(bm25_terms(query_text)) if t in vocab]
+        if not tids:
+            return []
+        idx = np.concatenate([doc_ids[indptr[t]:indptr[t + 1]] for t in tids])
+        w = np.concatenate([weights[indptr[t]:indptr[t + 1]] for t in tids])
+        scores = np.bincount(idx, weights=w, minlength=len(items))
+        limit = max(1, topn)
+        hit = np.flatnonzero(scores > 0)
+        if len(hit) > limit:
+            hit = hit[np.argpartition(-scores[hit], limit - 1)[:limit]]
+        # 得分降序，同分按条目原始顺序
+        hit = hit[np.lexsort((hit, -scores[hit]))]
+        return [items[i] for i in hit]
+
+
+def _top_hits(scores, limit: int, min_score: float):
+    """得分 >= min_score 的前 limit 个位置：得分降序，同分按条目原始顺序"""
+    hit = np.flatnonzero(scores >= min_score)
+    if len(hit) > limit:
+        hit = hit[np.argpartition(-scores[hit], limit - 1)[:limit]]
+    return hit[np.lexsort((hit, -scores[hit]))]
+
+
+class DenseIndex(_RebuildOnWriteIndex):
+    """
+    本地稠密检索（离线，无需远程 embedding 接口），能召回用词不完全相同的近义问法：
+    - 特征：归一化标题/正文的字符 n-gram，经稳定哈希映射到 n_features 个桶，标题按 title_weight 加权
+    - TF-IDF 加权后用带符号哈希（count sketch，一种稀疏随机投影）降到 dim 维，并做 L2 归一化
+    - 查询只需一次矩阵-向量乘积 (条目数 x dim) @ (dim,)，按余弦相似度排序
+    指定 store_dir 时矩阵与 IDF 以 .npy 存放、mmap 只读加载，多个进程共享同一份页缓存；
+    persist=True 的实例（机器人快照索引）负责在内容变化时重写存储，其它实例只在签名一致时复用，否则在内存中计算
+    """
+
+    engine = "dense"
+    STORE_NAME = "kb_embeddings"
+
+    def __init__(self, kb_items: Optional[List[Dict]] = None, dim: int = 1024, n_features: int = 1 << 18,
+                 ngram_range=(1, 3), title_weight: float = 2.0, min_score: float = 0.05,
+                 store_dir: Optional[str] = None, persist: bool = False):
+        if np is None:
+            raise RuntimeError("DenseIndex requires numpy")
+        super().__init__()
+        self.dim = int(dim)
+        self.n_features = int(n_features)
+        self.ngram_range = (int(ngram_range[0]), int(ngram_range[1]))
+        self.title_weight = title_weight
+        self.min_score = min_score
+        self.store_dir = store_dir
+        self.persist = persist
+        self._matrix = np.zeros((0, self.dim), dtype=np.float32)
+        self._idf = np.ones(self.n_features, dtype=np.float32)
+        self.mmapped = False
+        if kb_items:
+            self.sync(kb_items)
+
+    # --- 特征与投影 ---
+
+    def _gram_features(self, texts: List[str]):
+        """
+        一次性计算多段文本的字符 n-gram 特征：返回 (所属文本下标, 特征编号) 两个数组，重复出现即重复计数
+        特征编号为码点多项式哈希（跨进程稳定）经乘法散列后对 n_features 取模，不跨越文本边界
+        """
+        lens = np.fromiter((len(t) for t in texts), dtype=np.int64, count=len(texts))
+        codes = np.frombuffer("".join(texts).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        owner = np.repeat(np.arange(len(texts), dtype=np.int64), lens)
+        docs, feats = [], []
+        lo, hi = self.ngram_range
+        for n in range(lo, hi + 1):
+            m = len(codes) - n + 1
+            if m <= 0:
+                continue
+            h = np.full(m, n, dtype=np.uint64)
+            for k in range(n):
+                h = h * np.uint64(1000003) + codes[k:k + m]
+            valid = owner[:m] == owner[n - 1:n - 1 + m]
+            docs.append(owner[:m][valid])
+            feats.append(h[valid])
+        if not feats:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        h = np.concatenate(feats) * np.uint64(0x9E3779B97F4A7C15)
+        f = ((h >> np.uint64(24)) % np.uint64(self.n_features)).astype(np.int64)
+        return np.concatenate(docs), f
+
+    def _embed(self, r, f, weights, n_docs: int, idf=None):
+        """
+        r / f / weights: 每次特征出现所属的条目、特征编号与权重；idf 为空时按这些条目统计。
+        返回 (L2 归一化后的 条目数 x dim 矩阵, idf)
+        """
+        if idf is None:
+            # 文档频率：每个条目内的同一特征只计一次
+            keys = np.sort(r * self.n_features + f)
+            first = np.ones(len(keys), dtype=bool)
+            first[1:] = keys[1:] != keys[:-1]
+            df = np.bincount(keys[first] % self.n_features, minlength=self.n_features).astype(np.float32)
+            idf = (np.log((1.0 + n_docs) / (1.0 + df)) + 1.0).astype(np.float32)
+        if not len(f):
+            return np.zeros((n_docs, self.dim), dtype=np.float32), idf
+        # 带符号哈希投影：特征 f 落到第 f % dim 维，符号由 f // dim 的奇偶决定；重复特征自然累加为词频
+        sign = 1.0 - 2.0 * ((f // self.dim) & 1)
+        values = weights * idf[f] * sign
+        flat = np.bincount(r * self.dim + f % self.dim, weights=values, minlength=n_docs * self.dim)
+        matrix = flat.reshape(n_docs, self.dim).astype(np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix, idf
+
+    def _embed_items(self, items: List[Dict]):
+        n = len(items)
+        texts = [normalize_text(it.get("content", "") or "") for it in items]
+        texts += [normalize_text(it.get("title", "") or "") for it in items]
+        owner, f = self._gram_features(texts)
+        # 后一半文本是标题：归属到对应条目并按 title_weight 加权
+        is_title = owner >= n
+        weights = np.where(is_title, self.title_weight, 1.0)
+        return self._embed(np.where(is_title, owner - n, owner), f, weights, n)
+
+    def _embed_query(self, norm_q: str, idf):
+        owner, f = self._gram_features([norm_q])
+        return self._embed(owner, f, np.ones(len(f)), 1, idf)[0][0]
+
+    # --- 持久化 ---
+
+    def _params(self) -> Dict:
+        return {"dim": self.dim, "n_features": self.n_features, "ngram_range": list(self.ngram_range),
+                "title_weight": self.title_weight}
+
+    def _signature(self, items: List[Dict]) -> str:
+        h = hashlib.sha1(json.dumps(self._params(), sort_keys=True).encode("utf-8"))
+        for it in items:
+            for part in (it.get("id"), it.get("title"), it.get("content")):
+                h.update(str(part if part is not None else "").encode("utf-8"))
+                h.update(b"\x1f")
+            h.update(b"\x1e")
+        return h.hexdigest()
+
+    def _meta_path(self) -> str:
+        return os.path.join(self.store_dir, f"{self.STORE_NAME}.json")
+
+    def _load_store(self, signature: str):
+        try:
+            with open(self._meta_path(), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("signature") != signature:
+                return None
+            matrix = np.load(os.path.join(self.store_dir, meta["matrix"]), mmap_mode="r")
+            idf = np.load(os.path.join(self.store_dir, meta["idf"]), mmap_mode="r")
+        except (OSError, ValueError, KeyError):
+            return None
+        if matrix.shape != (meta.get("count"), self.dim) or idf.shape != (self.n_features,):
+            return None
+        return matrix, idf
+
+    def _save_store(self, signature: str, matrix, idf):
+        """先写带签名的新文件，再原子替换元数据；旧文件随后删除（已 mmap 的进程仍可继续读取）"""
+        os.makedirs(self.store_dir, exist_ok=True)
+        tag = signature[:16]
+        names = {"matrix": f"{self.STORE_NAME}-{tag}.npy", "idf": f"{self.STORE_NAME}-{tag}.idf.npy"}
+        for key, arr in (("matrix", matrix), ("idf", idf)):
+            path = os.path.join(self.store_dir, names[key])
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, arr)
+            os.replace(path + ".tmp", path)
+        meta = dict(names, signature=signature, count=int(matrix.shape[0]), params=self._params(),
+                    created_at=time.strftime("%Y-%m-%d %H:%M:%S"))
+        meta_path = self._meta_path()
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        os.replace(meta_path + ".tmp", meta_path)
+        keep = set(names.values())
+        for name in os.listdir(self.store_dir):
+            if name.startswith(f"{self.STORE_NAME}-") and name.endswith(".npy") and name not in keep:
+                try:
+                    os.remove(os.path.join(self.store_dir, name))
+                except OSError:
+                    pass
+
+    def _build(self):
+        items = self._items
+        signature = self._signature(items) if self.store_dir else None
+        stored = self._load_store(signature) if signature else None
+        if stored is None:
+            matrix, idf = self._embed_items(items)
+            if self.persist and signature:
+                try:
+                    self._save_store(signature, matrix, idf)
+                    stored = self._load_store(signature)
+                except OSError:
+                    stored = None
+            if stored is None:
+                self._matrix, self._idf, self.mmapped = matrix, idf, False
+        if stored is not None:
+            self._matrix, self._idf = stored
+            self.mmapped = True
+        self._dirty = False
+
+    def search(self, query_text: str, topn: int = 2) -> List[Dict]:
+        if not query_text:
+            return []
+        with self._lock:
+            if self._dirty:
+                self._build()
+            items, matrix, idf = self._items, self._matrix, self._idf
+        norm_q = normalize_text(query_text)
+        if not items or not norm_q:
+            return []
+        q = self._embed_query(norm_q, idf)
+        if not q.any():
+            return []
+        scores = matrix @ q
+        return [items[i] for i in _top_hits(scores, max(1, topn), self.min_score)]
+
+
+KB_ENGINES = {
+    "bigram": KBIndex,
+    "bm25": BM25Index,
+    "dense": DenseIndex,
+}
+
+
+def create_kb_index(engine: str = "bigram", kb_items: Optional[List[Dict]] = None, **options):
+    """
+    按名称创建检索引擎；未知名称或缺少 numpy 时回退到 bigram 引擎（可通过 .engine 查看实际引擎）
+    options 为 dense 引擎的存储参数（store_dir / persist），其它引擎忽略
+    """
+    cls = KB_ENGINES.get(str(engine or "bigram").lower(), KBIndex)
+    if cls in (BM25Index, DenseIndex) and np is None:
+        cls = KBIndex
+    if cls is DenseIndex:
+        return cls(kb_items, **options)
+    return cls(kb_items)
+
+
+GLOBAL_STAGE_TAGS = ("all", "global")
+
+
+class KBStagePartitions:
+    """
+    按阶段标签预先切分的知识库（编排模式使用）：
+    - 全局分区：无标签或带 all / global 标签的条目，所有阶段共享
+    - 阶段分区：按标签分组的其余条目
+    某阶段的检索范围 = 全局分区 + 该阶段分区（保持原列表顺序，与逐条过滤的结果一致），
+    首次访问时合并并建立该范围的检索索引，之后直接复用
+    """
+
+    def __init__(self, kb_items: List[Dict], engine: str = "bigram"):
+        self.engine = engine
+        self._source = kb_items
+        self._global: List[int] = []
+        self._stages: Dict[str, List[int]] = {}
+        for pos, it in enumerate(kb_items or []):
+            tags = it.get("tags") or []
+            if not isinstance(tags, (list, tuple, set)):
+                tags = [tags]
+            if (not tags) or any(t in tags for t in GLOBAL_STAGE_TAGS):
+                self._global.append(pos)
+            else:
+                for tag in dict.fromkeys(tags):
+                    self._stages.setdefault(tag, []).append(pos)
+        self._scoped: Dict[str, List[Dict]] = {}
+        self._indexes: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def is_built_for(self, kb_items) -> bool:
+        return kb_items is not None and kb_items is self._source
+
+    def stages(self) -> List[str]:
+        return list(self._stages)
+
+    def size(self, stage: Optional[str]) -> int:
+        return len(self._global) + len(self._stages.get(stage, ()))
+
+    def items_for(self, stage: Optional[str]) -> List[Dict]:
+        """返回该阶段可见的条目列表（只读，同一阶段每次返回同一对象）"""
+        scoped = self._scoped.get(stage)
+        if scoped is None:
+            with self._lock:
+                scoped = self._scoped.get(stage)
+                if scoped is None:
+                    positions = heapq.merge(self._global, self._stages.get(stage, ()))
+                    scoped = [self._source[p] for p in positions]
+                    self._scoped[stage] = scoped
+        return scoped
+
+    def search(self, query_text: str, stage: Optional[str], topn: int = 2) -> List[Dict]:
+        if not query_text:
+            return []
+        scoped = self.items_for(stage)
+        if not scoped:
+            return []
+        index = self._indexes.get(stage)
+        if index is None:
+            with self._lock:
+                index = self._indexes.get(stage)
+                if index is None:
+                    index = create_kb_index(self.engine, scoped)
+                    self._indexes[stage] = index
+        return index.search(query_text, topn)
@@ -1,8 +1,16 @@
 import json
 import os
+import time
 import logging
+from collections import namedtuple
 from datetime import datetime
 
+from aho_corasick import AhoCorasick
+from config_registry import file_signature
+
+# check_text / find_matches 的一次命中：start/end 为 text 中的字符偏移（end 为开区间）
+KeywordMatch = namedtuple("KeywordMatch", ["category", "word", "start", "end"])
+
 # Configure logger (write to audit.log for unified visibility)
 logger = logging.getLogger("KeywordManager")
 logger.setLevel(logging.INFO)
@@ -18,7 +26,13 @@ except Exception:
     pass
 
 class KeywordManager:
-    def __init__(self, config_path=None):
+    """
+    keywords.json 中各类别词表（allow / block / sensitive）的管理与匹配。
+    所有类别的词编译进同一个 Aho-Corasick 自动机，check_text 对文本只扫描一遍；
+    文件签名 (mtime, size) 至多每 check_interval 秒检查一次，变化时重新加载并在下次匹配时重编译。
+    """
+
+    def __init__(self, config_path=None, check_interval=1.0, clock=time.monotonic):
         if config_path:
             self.config_path = config_path
         else:
@@ -26,10 +40,19 @@ class KeywordManager:
         
         self.keywords = {}
         self.last_mtime = 0
-        self._load()
+        self.check_interval = max(0.0, float(check_interval))
+        self._clock = clock
+        self._signature = None
+        self._checked_at = None
+        self._automaton = None
+        self._load(force=True)
 
-    def _load(self):
+    def _load(self, force=False):
         """Load keywords from file if modified"""
+        now = self._clock()
+        if not force and self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
         try:
             if not os.path.exists(self.config_path):
                 self.keywords = {
@@ -40,11 +63,13 @@ class KeywordManager:
                 self._save()
                 return
 
-            mtime = os.path.getmtime(self.config_path)
-            if mtime > self.last_mtime:
+            signature = file_signature(self.config_path)
+            if signature != self._signature:
                 with open(self.config_path, 'r', encoding='utf-8') as f:
                     self.keywords = json.load(f)
-                self.last_mtime = mtime
+                self._signature = signature
+                self.last_mtime = os.path.getmtime(self.config_path)
+                self._automaton = None
                 logger.info(f"Loaded keywords from {self.config_path}")
         except Exception as e:
             logger.error(f"Failed to load keywords: {e}")
@@ -57,8 +82,10 @@ class KeywordManager:
             with open(tmp_path, 'w', encoding='utf-8') as f:
                 json.dump(self.keywords, f, ensure_ascii=False, indent=2)
             os.replace(tmp_path, self.config_path)
-            # Update mtime to prevent reloading own save
+            # Update signature to prevent reloading own save
+            self._signature = file_signature(self.config_path)
             self.last_mtime = os.path.getmtime(self.config_path)
+            self._automaton = None
             logger.info(f"KEYWORDS_SAVE path={self.config_path} total_block={len(self.keywords.get('block', []))} total_sensitive={len(self.keywords.get('sensitive', []))}")
         except Exception as e:
             logger.error(f"Failed to save keywords: {e}")
@@ -70,7 +97,7 @@ class KeywordManager:
 
     def add_keyword(self, category, word):
         """Add a keyword to a category"""
-        self._load()
+        self._load(force=True)
         if category not in self.keywords:
             self.keywords[category] = []
         
@@ -83,7 +110,7 @@ class KeywordManager:
 
     def remove_keyword(self, category, word):
         """Remove a keyword from a category"""
-        self._load()
+        self._load(force=True)
         if category in self.keywords and word in self.keywords[category]:
             self.keywords[category].remove(word)
             self._save()
@@ -93,7 +120,7 @@ class KeywordManager:
 
     def rename_keyword(self, category, old_word, new_word):
         """Rename a keyword within a category"""
-        self._load()
+        self._load(force=True)
         if category not in self.keywords:
             return False, f"Category '{category}' not found"
         items = self.keywords[category]
@@ -107,27 +134,51 @@ class KeywordManager:
         self._save()
         logger.info(f"KEYWORD_RENAME category={category} old={old_word} new={new_word}")
         return True, f"Renamed '{old_word}' to '{new_word}' in '{category}'"
+
+    def _compile(self):
+        patterns = []
+        for category, words in self.keywords.items():
+            if not isinstance(words, list):
+                continue
+            for idx, word in enumerate(words):
+                if word and isinstance(word, str):
+                    patterns.append((word, (category, idx)))
+        self._automaton = AhoCorasick(patterns)
+        return self._automaton
+
+    def _scan(self, text):
+        self._load()
+        automaton = self._automaton or self._compile()
+        return automaton.finditer(text or "")
+
+    def find_matches(self, text):
+        """
+        Find every keyword occurrence in one pass.
+        Returns: [KeywordMatch(category, word, start, end)] ordered by position
+        """
+        matches = [KeywordMatch(cat, word, start, end) for start, end, word, (cat, _) in self._scan(text)]
+        matches.sort(key=lambda m: (m.start, m.end))
+        return matches
+
     def check_text(self, text):
         """
         Check text against keywords.
         Returns: (is_safe, category, matched_word)
+        Allowlist takes precedence; otherwise block before sensitive. Within a category the
+        earliest entry in the list wins, as with the former per-word scan.
         """
-        self._load()
+        first = {}
+        for _, _, word, (cat, idx) in self._scan(text):
+            if cat in first and first[cat][0] <= idx:
+                continue
+            first[cat] = (idx, word)
         # Allowlist precedence
-        if 'allow' in self.keywords:
-            for word in self.keywords['allow']:
-                if word and word in text:
-                    return True, 'allow', word
+        if 'allow' in first:
+            return True, 'allow', first['allow'][1]
         # Check 'block' category (Hard Fail)
-        if 'block' in self.keywords:
-            for word in self.keywords['block']:
-                if word in text:
-                    return False, 'block', word
-        
+        if 'block' in first:
+            return False, 'block', first['block'][1]
         # Check 'sensitive' category (Soft Fail / Warning - for now treated as Fail for safety)
-        if 'sensitive' in self.keywords:
-            for word in self.keywords['sensitive']:
-                if word in text:
-                    return False, 'sensitive', word
-                    
+        if 'sensitive' in first:
+            return False, 'sensitive', first['sensitive'][1]
         return True, None, None
@@ -0,0 +1,149 @@
+import os
+import sys
+import queue
+import atexit
+import threading
+from typing import Dict, List
+
+# 单个日志文件的大小上限与保留的轮转份数（file.1 ... file.N）
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 3
+
+
+class LogSink:
+    """
+    后台批量日志写入：调用方只把 (文件, 行) 放入队列立即返回，写线程按文件分组批量追加，
+    超过 max_bytes 时按 RotatingFileHandler 的方式轮转。
+    flush() 等待队列中已有的行落盘；close() 在 flush 后停止写线程，进程退出时自动调用。
+    关闭之后的写入直接同步落盘，不会丢行。
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, backup_count: int = DEFAULT_BACKUP_COUNT,
+                 flush_interval: float = 0.5, max_batch: int = 1000):
+        self.max_bytes = int(max_bytes)
+        self.backup_count = max(0, int(backup_count))
+        self.flush_interval = float(flush_interval)
+        self.max_batch = max(1, int(max_batch))
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._closed = False
+        self._dirs = set()
+        self.written = 0
+        self.batches = 0
+        atexit.register(self.close)
+
+    def write(self, path: str, line: str):
+        if self._closed:
+            with self._write_lock:
+                self._write_batch({path: [line]})
+            return
+        if self._thread is None:
+            self._start()
+        self._queue.put((path, line))
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="log-sink", daemon=True)
+                self._thread.start()
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 5.0):
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            pending: Dict[str, List[str]] = {}
+            markers = []
+            stop = False
+            record = first
+            count = 0
+            while True:
+                if record is None:
+                    stop = True
+                elif isinstance(record, threading.Event):
+                    markers.append(record)
+                else:
+                    pending.setdefault(record[0], []).append(record[1])
+                    count += 1
+                if stop or count >= self.max_batch:
+                    break
+                try:
+                    record = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if pending:
+                with self._write_lock:
+                    self._write_batch(pending)
+            for marker in markers:
+                marker.set()
+            if stop:
+                # 停止前写完停止标记之后才入队的行
+                self._drain()
+                return
+
+    def _drain(self):
+        pending: Dict[str, List[str]] = {}
+        while True:
+            try:
+                record = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(record, threading.Event):
+                record.set()
+            elif record is not None:
+                pending.setdefault(record[0], []).append(record[1])
+        if pending:
+            with self._write_lock:
+                self._write_batch(pending)
+
+    def _write_batch(self, pending: Dict[str, List[str]]):
+        for path, lines in pending.items():
+            data = "".join(lines)
+            try:
+                dirname = os.path.dirname(path)
+                if dirname and dirname not in self._dirs:
+                    os.makedirs(dirname, exist_ok=True)
+                    self._dirs.add(dirname)
+                self._rotate_if_needed(path, len(data.encode("utf-8")))
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(data)
+                self.written += len(lines)
+            except Exception as e:
+                print(f"⚠️ 写入日志 {path} 失败: {e}", file=sys.stderr)
+        self.batches += 1
+
+    def _rotate_if_needed(self, path: str, incoming: int):
+        if self.max_bytes <= 0:
+            return
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        if size == 0 or size + incoming <= self.max_bytes:
+            return
+        if self.backup_count == 0:
+            os.remove(path)
+            return
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{path}.{i + 1}")
+        os.replace(path, f"{path}.1")
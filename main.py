@@ -7,10 +7,12 @@ import json
 import re
 import uuid
 import difflib
+import itertools
+import threading
+from collections import namedtuple
 from datetime import datetime
-import httpx # 必须确保已安装: pip install httpx
 from telethon import TelegramClient, events
-from openai import AsyncOpenAI, APIConnectionError
+from openai import APIConnectionError
 from dotenv import load_dotenv
 
 # --- Auto-setup Environment ---
@@ -39,6 +41,20 @@ from audit_manager import AuditManager
 from conversation_state_manager import ConversationStateManager
 from supervisor_agent import SupervisorAgent
 from stage_agent_runtime import StageAgentRuntime
+from kb_index import create_kb_index, normalize_text, bigram_tokens, bm25_terms, parse_tags, KBStagePartitions
+from qa_matcher import get_qa_matcher, get_qa_matcher_for_pairs
+from kb_chunker import iter_chunks
+from kb_cache import QueryCache, CacheStatsWriter
+from config_registry import ConfigRegistry
+from log_sink import LogSink
+from stats_aggregator import StatsAggregator
+from group_cache import GroupCache
+from chat_history import ChatHistoryBuffer
+from chat_debounce import ChatDebouncer, mark_batch_sent, defer_batch
+from outbound_scheduler import OutboundScheduler
+from triage import TriageCache
+from ai_client_pool import registry as ai_clients
+from admission import AdmissionController, AdmissionRejected, PRIORITY_CONTEXT, PRIORITY_NAMES
 
 # --- 1. 基础设置 ---
 # 解决 Windows 控制台乱码
@@ -65,19 +81,20 @@ PRIVATE_LOG_FILE = os.path.join(LOG_DIR, "private.log")
 GROUP_LOG_FILE = os.path.join(LOG_DIR, "group.log")
 TRACE_LOG_FILE = os.path.join(LOG_DIR, "trace.jsonl")
 
+# 日志经后台写线程批量落盘（按大小轮转），处理消息的协程不等待磁盘 I/O；进程退出时自动 flush
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+log_sink = LogSink(LOG_MAX_BYTES, LOG_BACKUP_COUNT)
+
 def _append_log(file_path, message):
-    os.makedirs(os.path.dirname(file_path), exist_ok=True)
     ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    with open(file_path, "a", encoding="utf-8") as f:
-        f.write(f"[{ts}] {message}\n")
+    log_sink.write(file_path, f"[{ts}] {message}\n")
 
 def log_trace_event(trace_id, event_type, payload):
     """
     记录结构化追踪日志 (JSONL 格式)
     符合 Automated Acceptance Execution Checklist 要求
     """
-    os.makedirs(os.path.dirname(TRACE_LOG_FILE), exist_ok=True)
-    
     # 构造标准事件结构
     event = {
         "trace_id": trace_id,
@@ -87,8 +104,8 @@ def log_trace_event(trace_id, event_type, payload):
     # 合并 payload
     event.update(payload)
     
-    with open(TRACE_LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(json.dumps(event, ensure_ascii=False) + "\n")
+    # 入队前序列化：payload 之后被修改也不影响已记录的内容
+    log_sink.write(TRACE_LOG_FILE, json.dumps(event, ensure_ascii=False) + "\n")
 
 def log_system(message):
     _append_log(SYSTEM_LOG_FILE, message)
@@ -132,27 +149,33 @@ log_system(f"🔧 AI 接口地址已修正为: {AI_BASE_URL}")
 
 # --- 3. 初始化客户端 (抗干扰模式) ---
 
-# 创建客户端的惰性初始化，避免在被其他线程导入时缺失事件循环
-http_client = None
-ai_client = None
+# 客户端由进程级注册表 ai_client_pool.registry 惰性创建并复用（按 base_url / api_key / SSL 验证 / 超时区分），
+# 编排模式的阶段路由、Auditor、RemoteAuditor 共用同一组连接池
+AI_HTTP_TIMEOUT = 30.0
+_ai_client_verify = None
 
 def get_ai_client():
-    global http_client, ai_client
-    if ai_client is None or http_client is None:
-        ssl_mode = _ssl_verify_default()
+    global _ai_client_verify
+    ssl_mode = _ssl_verify_default()
+    if ssl_mode != _ai_client_verify:
         log_system(f"🔌 初始化 AI 客户端: SSL验证={ssl_mode}")
-        http_client = httpx.AsyncClient(verify=ssl_mode, timeout=30.0)
-        ai_client = AsyncOpenAI(
-            api_key=AI_API_KEY,
-            base_url=AI_BASE_URL,
-            http_client=http_client
-        )
-    return ai_client
+        _ai_client_verify = ssl_mode
+    return ai_clients.openai_client(AI_BASE_URL, AI_API_KEY, verify=ssl_mode, timeout=AI_HTTP_TIMEOUT)
+
+_audit_manager = None
+
+def get_audit_manager():
+    # 进程级审核服务：关键词/兜底话术/审核提示词与 AUDIT_MODE、AUDIT_SERVERS 变化时由其自行热加载
+    global _audit_manager
+    if _audit_manager is None:
+        _audit_manager = AuditManager(None, AI_MODEL_NAME, load_config, platform="telegram")
+    return _audit_manager
 
 def reset_ai_client():
-    global http_client, ai_client
-    http_client = None
-    ai_client = None
+    # SSL 验证开关是注册表键的一部分：切换 HTTPX_VERIFY_SSL 后 get_ai_client 自然取到新客户端，
+    # 旧客户端保留给仍在进行的请求，进程退出时统一关闭
+    global _ai_client_verify
+    _ai_client_verify = None
     log_system("🔄 AI 客户端已重置 (准备重新初始化)")
 
 client = TelegramClient('userbot_session', int(TELEGRAM_API_ID), TELEGRAM_API_HASH)
@@ -162,12 +185,19 @@ client = TelegramClient('userbot_session', int(TELEGRAM_API_ID), TELEGRAM_API_HA
 
 # --- 4. 核心逻辑 ---
 
+# 热更新配置文件注册表：按 (mtime, size) 签名缓存解析结果，每个文件至多每 CONFIG_CHECK_INTERVAL_MS 检查一次
+# 处理消息时从内存读取；后台修改文件后在检查间隔内生效，本进程写文件后调用 config_registry.invalidate
+CONFIG_CHECK_INTERVAL_MS = 1000
+config_registry = ConfigRegistry(CONFIG_CHECK_INTERVAL_MS)
+
 def load_system_prompt():
     """
     热更新功能：从 prompt.txt 读取 AI 提示词
     这样可以在程序运行时随时修改 AI 人设，无需重启
     """
-    prompt_file = "platforms/telegram/prompt.txt"
+    return config_registry.get("prompt")
+
+def _parse_system_prompt(prompt_file):
     default_prompt = "你是一个幽默、专业的个人助理，帮机主回复消息。请用自然、友好的语气回复。"
     
     try:
@@ -187,9 +217,11 @@ def load_system_prompt():
 def load_keywords():
     """
     热更新功能：从 keywords.txt 读取群聊触发关键词
-    每次处理消息时重新读取，实现实时更新
+    文件变化后在检查间隔内生效（返回共享列表，只读）
     """
-    keywords_file = "platforms/telegram/keywords.txt"
+    return config_registry.get("keywords")
+
+def _parse_keywords(keywords_file):
     keywords = []
     
     try:
@@ -273,46 +305,11 @@ def load_qa_pairs(file_path):
         return []
     return qa_pairs
 
-def _normalize_text(text):
-    text = text.lower()
-    text = re.sub(r"\s+", " ", text).strip()
-    text = re.sub(r"[^0-9a-z\u4e00-\u9fff]+", "", text)
-    return text
-def _bigram_tokens(text):
-    if not text:
-        return set()
-    if len(text) < 2:
-        return {text}
-    return set(text[i:i+2] for i in range(len(text) - 1))
+_normalize_text = normalize_text
+_bigram_tokens = bigram_tokens
 
 def match_qa_reply(message_text, qa_pairs):
-    if not message_text:
-        return None
-    msg = message_text.strip()
-    if not msg:
-        return None
-    norm_msg = _normalize_text(msg)
-    if not norm_msg:
-        return None
-    msg_tokens = set(norm_msg[i:i+2] for i in range(len(norm_msg) - 1)) if len(norm_msg) >= 2 else set([norm_msg])
-    for q, a in qa_pairs:
-        if not q:
-            continue
-        norm_q = _normalize_text(q)
-        if not norm_q:
-            continue
-        if norm_q in norm_msg or norm_msg in norm_q:
-            return a
-        # token overlap for short queries
-        q_tokens = set(norm_q[i:i+2] for i in range(len(norm_q) - 1)) if len(norm_q) >= 2 else set([norm_q])
-        if q_tokens:
-            overlap = len(msg_tokens & q_tokens) / max(1, len(q_tokens))
-            if overlap >= 0.45:
-                return a
-        ratio = difflib.SequenceMatcher(None, norm_q, norm_msg).ratio()
-        if ratio >= 0.5:
-            return a
-    return None
+    return get_qa_matcher_for_pairs(qa_pairs).match(message_text)
 
 def _set_kb_refresh_off():
     try:
@@ -325,15 +322,110 @@ def _set_kb_refresh_off():
                     f.write("KB_REFRESH=off\n")
                 else:
                     f.write(line)
+        config_registry.invalidate("config")
         log_system("✅ KB_REFRESH 已自动重置为 off")
     except Exception as e:
         log_system(f"⚠️ 重置 KB_REFRESH 失败: {e}")
 
+# 知识库检索索引（按引擎名缓存）：load_kb_entries 时差量同步，本进程内的 KB 写入通过 db 回调增量更新
+# 引擎由 config.txt 的 KB_RETRIEVAL_ENGINE 选择：bigram（默认）/ bm25 / dense / fts5
+# fts5 在 SQLite 全文索引内取候选（db.search_kb），不需要常驻内存索引
+# dense 的条目矩阵以 .npy 存放在 KB_EMBED_DIR，机器人与后台进程均以 mmap 只读加载
+_kb_indexes = {}
+KB_SQL_ENGINES = ("fts5",)
+KB_EMBED_DIR = os.path.join("data", "knowledge_base")
+
+def _get_kb_index(engine):
+    engine = str(engine or "bigram").lower()
+    index = _kb_indexes.get(engine)
+    if index is None:
+        index = create_kb_index(engine, store_dir=KB_EMBED_DIR, persist=True)
+        if index.engine != engine:
+            log_system(f"⚠️ 检索引擎 {engine} 不可用（缺少 numpy?），已回退到 {index.engine}")
+        _kb_indexes[engine] = index
+    return index
+
+def _on_kb_change(action, item_id, data):
+    for index in list(_kb_indexes.values()):
+        if action == "add" and data:
+            item = dict(data)
+            item["tags"] = parse_tags(item.get("tags"))
+            index.add(item)
+        elif action == "update":
+            index.update(item_id, data or {})
+        elif action == "delete":
+            index.remove(item_id)
+
+db.add_kb_listener(_on_kb_change)
+
+# 知识库快照：以 kb_versions 版本号（任意进程写入 knowledge_base 都会递增）与 config.txt 的 mtime 为键，
+# 未变化时直接复用同一份条目列表，避免每条消息都全表查询、解析 tags 并重读配置
+KB_CONFIG_FILE = os.path.join("platforms", "telegram", "config.txt")
+_kb_snapshot = {"version": None, "config_mtime": None, "items": None, "by_id": None, "partitions": None, "engine": "bigram"}
+_kb_load_lock = threading.Lock()
+
+def _file_mtime(path):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
 def load_kb_entries():
+    """
+    返回知识库条目快照（只读，调用方不要修改列表本身）
+    仅当知识库版本或 config.txt 变化时才重新加载
+    """
+    cached, version, config_mtime = _kb_snapshot_lookup()
+    if cached is not None:
+        return cached
+
+    # 可能在线程池中被多个消息同时调用：串行化重新加载，避免重复导入
+    with _kb_load_lock:
+        cached, version, config_mtime = _kb_snapshot_lookup()
+        if cached is not None:
+            return cached
+        snap = _kb_snapshot
+        items = _load_kb_entries_uncached()
+        snap["engine"] = load_config().get("KB_RETRIEVAL_ENGINE", "bigram")
+        if snap["engine"] not in KB_SQL_ENGINES:
+            index = _get_kb_index(snap["engine"])
+            index.sync(items)
+            # 矩阵类引擎在加载线程里预先构建
+            if hasattr(index, "ensure_built"):
+                index.ensure_built()
+        # 空知识库不缓存：本地知识库文件随时可能被放入，下次消息需要重新尝试导入
+        if items and version is not None:
+            snap["version"] = version
+            snap["config_mtime"] = config_mtime
+            snap["items"] = items
+            snap["by_id"] = {it.get("id"): it for it in items}
+        else:
+            snap["items"] = None
+            snap["by_id"] = None
+        snap["partitions"] = None
+        return items
+
+def _kb_snapshot_lookup():
+    """返回 (命中的快照条目或 None, 当前知识库版本, 当前 config.txt 签名)"""
+    try:
+        version = db.get_kb_version("default")
+    except Exception as e:
+        log_system(f"⚠️ 读取知识库版本失败: {e}")
+        version = None
+    config_mtime = _file_mtime(KB_CONFIG_FILE)
+    snap = _kb_snapshot
+    if (snap["items"] is not None and version is not None
+            and snap["version"] == version and snap["config_mtime"] == config_mtime):
+        return snap["items"], version, config_mtime
+    return None, version, config_mtime
+
+def _load_kb_entries_uncached():
     """
     加载知识库条目：优先从 SQLite 数据库加载
     支持 KB_REFRESH=on 强制刷新
-    如果数据库为空，则尝试从本地 Knowledge Base.txt 自动解析并导入
+    如果数据库为空，则尝试从本地 Knowledge Base.txt / qa.txt / extra_kb.txt 自动解析并导入；
+    刷新时按内容哈希增量同步，未变化的条目保留原 id
     """
     items = []
     
@@ -353,242 +445,260 @@ def load_kb_entries():
             elif db_items:
                 # 正常加载
                 for it in db_items:
-                    if isinstance(it.get("tags"), str):
-                        try:
-                            it["tags"] = json.loads(it["tags"])
-                        except:
-                            it["tags"] = [t.strip() for t in it["tags"].split(",") if t.strip()]
+                    it["tags"] = parse_tags(it.get("tags"))
                 items.extend(db_items)
                 log_system(f"📚 从数据库加载了 {len(items)} 条知识库条目")
 
-        # 1. 执行重置
-        if need_reload:
-            log_system("🔄 执行知识库重置 (KB_REFRESH/AutoFix)...")
-            db.execute_update("DELETE FROM knowledge_base WHERE tenant_id = ?", ("default",))
-            items = [] # 确保为空，触发下方导入逻辑
+        # 1. 如果数据库为空（或需要重置），按内容哈希与本地文件增量同步：
+        #    只增删改变化的段落，未变化条目保留原 id；同步在单事务内完成，失败则整体回滚
+        if not items:
+            if need_reload:
+                log_system("🔄 执行知识库增量同步 (KB_REFRESH/AutoFix)...")
+            try:
+                stats = db.sync_kb_items("default", _iter_kb_file_rows(datetime.now().isoformat()),
+                                         KB_SOURCE_FILES, progress=_log_kb_import_progress)
+                if stats["added"] or stats["updated"] or stats["deleted"]:
+                    log_system(f"✅ 知识库同步完成：新增 {stats['added']} / 更新 {stats['updated']} / "
+                               f"删除 {stats['deleted']} / 未变 {stats['unchanged']}")
+                db_items = db.get_kb_items("default")
+                for it in db_items:
+                    it["tags"] = parse_tags(it.get("tags"))
+                items = db_items
+            except Exception as e:
+                log_system(f"❌ 知识库同步失败（已回滚）: {e}")
             if kb_refresh:
                 _set_kb_refresh_off()
 
-        # 2. 如果数据库为空（或已重置），执行导入
-        if not items:
-            kb_text_file = os.path.join(os.path.dirname(__file__), "platforms", "telegram", "Knowledge Base.txt")
-            if os.path.exists(kb_text_file):
-                try:
-                    with open(kb_text_file, "r", encoding="utf-8-sig") as f:
-                        content = f.read()
-                    
-                    if content.strip():
-                        log_system("📂 正在解析并导入本地知识库...")
-                        blocks = _parse_multi_lang_qa(content)
-                        md_blocks = []
-                        if not blocks:
-                            md_blocks = _parse_markdown_kb(content)
-                        
-                        count = 0
-                        ts = datetime.now().isoformat()
-                        
-                        if blocks:
-                            for b in blocks:
-                                q_sc = b.get('q_sc', '')
-                                q_tc = b.get('q_tc', '')
-                                a_sc = b.get('a_sc', '')
-                                a_tc = b.get('a_tc', '')
-                                
-                                # 构造更丰富的检索内容
-                                full_content = f"Question: {q_sc}\nQuestion_TC: {q_tc}\nAnswer: {a_sc}\nAnswer_TC: {a_tc}"
-                                
-                                new_id = str(uuid.uuid4())
-                                new_item = {
-                                    "id": new_id,
-                                    "tenant_id": "default",
-                                    "title": q_sc[:100] if q_sc else "无标题QA",
-                                    "category": "qa",
-                                    "tags": json.dumps(["telegram", "kb", "parsed"], ensure_ascii=False),
-                                    "content": full_content,
-                                    "source_file": "platforms/telegram/Knowledge Base.txt",
-                                    "created_at": ts,
-                                    "updated_at": ts
-                                }
-                                db.add_kb_item(new_item)
-                                
-                                # Add to memory
-                                new_item["tags"] = ["telegram", "kb", "parsed"]
-                                items.append(new_item)
-                                count += 1
-                            
-                            log_system(f"✅ 成功导入 {count} 条 QA 知识库条目！")
-                        elif md_blocks:
-                            log_system("⚠️ QA解析为空，采用 Markdown 标题分割导入...")
-                            for mb in md_blocks:
-                                new_id = str(uuid.uuid4())
-                                new_item = {
-                                    "id": new_id,
-                                    "tenant_id": "default",
-                                    "title": mb['title'][:100],
-                                    "category": "markdown",
-                                    "tags": json.dumps(["telegram", "kb", "markdown"], ensure_ascii=False),
-                                    "content": mb['content'],
-                                    "source_file": "platforms/telegram/Knowledge Base.txt",
-                                    "created_at": ts,
-                                    "updated_at": ts
-                                }
-                                db.add_kb_item(new_item)
-                                new_item["tags"] = ["telegram", "kb", "markdown"]
-                                items.append(new_item)
-                                count += 1
-                            log_system(f"✅ 成功导入 {count} 条 Markdown 知识库条目！")
-                        else:
-                             # Fallback: 如果解析失败但文件不为空，仍尝试整本导入（避免完全无数据）
-                             log_system("⚠️ 解析结果为空，执行整本导入(Fallback)...")
-                             new_id = str(uuid.uuid4())
-                             new_item = {
-                                "id": new_id,
-                                "tenant_id": "default",
-                                "title": "默认知识库 (Fallback)",
-                                "category": "text",
-                                "tags": json.dumps(["telegram", "kb", "fallback"], ensure_ascii=False),
-                                "content": content,
-                                "source_file": "platforms/telegram/Knowledge Base.txt",
-                                "created_at": ts,
-                                "updated_at": ts
-                             }
-                             db.add_kb_item(new_item)
-                             new_item["tags"] = ["telegram", "kb", "fallback"]
-                             items.append(new_item)
-
-                except Exception as e:
-                    log_system(f"❌ 初始化导入失败: {e}")
-
-            # 3. 尝试导入 qa.txt (如果存在且数据库为空/重置)
-            qa_file = os.path.join(os.path.dirname(__file__), "platforms", "telegram", "qa.txt")
-            if os.path.exists(qa_file):
-                try:
-                    with open(qa_file, "r", encoding="utf-8") as f:
-                        qa_content = f.read()
-                    
-                    if qa_content.strip():
-                        log_system("📂 正在解析并导入 qa.txt (补充知识库)...")
-                        qa_blocks = _parse_multi_lang_qa(qa_content)
-                        
-                        if qa_blocks:
-                            qa_count = 0
-                            ts = datetime.now().isoformat()
-                            for b in qa_blocks:
-                                q_sc = b.get('q_sc', '')
-                                q_tc = b.get('q_tc', '')
-                                a_sc = b.get('a_sc', '')
-                                a_tc = b.get('a_tc', '')
-                                
-                                full_content = f"Question: {q_sc}\nQuestion_TC: {q_tc}\nAnswer: {a_sc}\nAnswer_TC: {a_tc}"
-                                
-                                new_id = str(uuid.uuid4())
-                                new_item = {
-                                    "id": new_id,
-                                    "tenant_id": "default",
-                                    "title": q_sc[:100] if q_sc else "QA Pair",
-                                    "category": "qa_txt",
-                                    "tags": json.dumps(["telegram", "kb", "qa_txt"], ensure_ascii=False),
-                                    "content": full_content,
-                                    "source_file": "platforms/telegram/qa.txt",
-                                    "created_at": ts,
-                                    "updated_at": ts
-                                }
-                                db.add_kb_item(new_item)
-                                items.append(new_item)
-                                qa_count += 1
-                            log_system(f"✅ 成功从 qa.txt 导入 {qa_count} 条知识库条目！")
-                except Exception as e:
-                    log_system(f"⚠️ 导入 qa.txt 失败: {e}")
-
-            # 4. 尝试导入 extra_kb.txt (如 PDF 导入内容)
-            extra_file = os.path.join(os.path.dirname(__file__), "platforms", "telegram", "extra_kb.txt")
-            if os.path.exists(extra_file):
-                try:
-                    with open(extra_file, "r", encoding="utf-8") as f:
-                        extra_content = f.read()
-                    
-                    if extra_content.strip():
-                        log_system("📂 正在解析并导入 extra_kb.txt (额外知识库)...")
-                        # 优先尝试 Markdown 解析
-                        extra_blocks = _parse_markdown_kb(extra_content)
-                        
-                        extra_count = 0
-                        ts = datetime.now().isoformat()
-                        
-                        if extra_blocks:
-                            for mb in extra_blocks:
-                                new_id = str(uuid.uuid4())
-                                new_item = {
-                                    "id": new_id,
-                                    "tenant_id": "default",
-                                    "title": mb['title'][:100],
-                                    "category": "markdown",
-                                    "tags": json.dumps(["telegram", "kb", "extra"], ensure_ascii=False),
-                                    "content": mb['content'],
-                                    "source_file": "platforms/telegram/extra_kb.txt",
-                                    "created_at": ts,
-                                    "updated_at": ts
-                                }
-                                db.add_kb_item(new_item)
-                                items.append(new_item)
-                                extra_count += 1
-                            log_system(f"✅ 成功从 extra_kb.txt 导入 {extra_count} 条 Markdown 知识库条目！")
-                        else:
-                             # Fallback to full content
-                             log_system("⚠️ extra_kb.txt 解析结果为空，执行整本导入...")
-                             new_id = str(uuid.uuid4())
-                             new_item = {
-                                "id": new_id,
-                                "tenant_id": "default",
-                                "title": "额外知识库 (Full)",
-                                "category": "text",
-                                "tags": json.dumps(["telegram", "kb", "extra", "fallback"], ensure_ascii=False),
-                                "content": extra_content,
-                                "source_file": "platforms/telegram/extra_kb.txt",
-                                "created_at": ts,
-                                "updated_at": ts
-                             }
-                             db.add_kb_item(new_item)
-                             items.append(new_item)
-                             log_system("✅ 成功从 extra_kb.txt 导入整本内容")
-
-                except Exception as e:
-                    log_system(f"⚠️ 导入 extra_kb.txt 失败: {e}")
-
     except Exception as e:
         log_system(f"⚠️ 加载知识库失败: {e}")
-        
+
     return items
 
-def retrieve_kb_context(query_text, kb_items, topn=2):
+def _log_kb_import_progress(count):
+    log_system(f"📥 知识库同步进度: {count} 条")
+
+# 由本地文件导入的条目来源；增量同步只管理这些来源的行，后台手动添加/上传的条目不受影响
+KB_SOURCE_FILES = (
+    "platforms/telegram/Knowledge Base.txt",
+    "platforms/telegram/qa.txt",
+    "platforms/telegram/extra_kb.txt",
+)
+
+def _new_kb_row(title, category, tags, content, source_file, ts):
+    return {
+        "id": str(uuid.uuid4()),
+        "tenant_id": "default",
+        "title": title,
+        "category": category,
+        "tags": json.dumps(tags, ensure_ascii=False),
+        "content": content,
+        "source_file": source_file,
+        "created_at": ts,
+        "updated_at": ts
+    }
+
+def _iter_doc_rows(title, category, tags, pieces, source_file, ts):
+    """
+    整本导入的长文档流式切分为有界、相互重叠的段落，每段一行，
+    通过 parent_id（按来源文件确定，增量同步时保持稳定）关联所属文档
+    """
+    parent_id = f"doc:{source_file}"
+    for i, passage in enumerate(iter_chunks(pieces)):
+        row = _new_kb_row(f"{title} #{i + 1}", category, tags, passage, source_file, ts)
+        row["parent_id"] = parent_id
+        row["chunk_index"] = i
+        yield row
+
+def _qa_block_content(b):
+    # 构造更丰富的检索内容
+    return f"Question: {b.get('q_sc', '')}\nQuestion_TC: {b.get('q_tc', '')}\nAnswer: {b.get('a_sc', '')}\nAnswer_TC: {b.get('a_tc', '')}"
+
+def _peek(iterator):
+    """取出生成器的第一个元素，返回 (first, 完整迭代器)；为空时 first 为 None"""
+    first = next(iterator, None)
+    if first is None:
+        return None, iter(())
+    return first, itertools.chain([first], iterator)
+
+def _iter_kb_file_rows(ts):
+    """
+    按 Knowledge Base.txt -> qa.txt -> extra_kb.txt 的顺序流式产出待导入的知识库行
+    单个文件读取/解析失败只跳过该文件
+    """
+    base = os.path.join(os.path.dirname(__file__), "platforms", "telegram")
+
+    # 1. Knowledge Base.txt：多语言 QA 优先，其次 Markdown 标题分割，最后整本导入
+    kb_text_file = os.path.join(base, "Knowledge Base.txt")
+    if os.path.exists(kb_text_file):
+        try:
+            with open(kb_text_file, "r", encoding="utf-8-sig") as f:
+                content = f.read()
+        except Exception as e:
+            log_system(f"❌ 初始化导入失败: {e}")
+            content = ""
+        if content.strip():
+            log_system("📂 正在解析并导入本地知识库...")
+            src = KB_SOURCE_FILES[0]
+            first, blocks = _peek(_iter_multi_lang_qa(content))
+            count = 0
+            if first is not None:
+                for b in blocks:
+                    q_sc = b.get('q_sc', '')
+                    yield _new_kb_row(q_sc[:100] if q_sc else "无标题QA", "qa", ["telegram", "kb", "parsed"], _qa_block_content(b), src, ts)
+                    count += 1
+                log_system(f"✅ 成功导入 {count} 条 QA 知识库条目！")
+            else:
+                first, md_blocks = _peek(_iter_markdown_kb(content))
+                if first is not None:
+                    log_system("⚠️ QA解析为空，采用 Markdown 标题分割导入...")
+                    for mb in md_blocks:
+                        yield _new_kb_row(mb['title'][:100], "markdown", ["telegram", "kb", "markdown"], mb['content'], src, ts)
+                        count += 1
+                    log_system(f"✅ 成功导入 {count} 条 Markdown 知识库条目！")
+                else:
+                    # Fallback: 如果解析失败但文件不为空，仍尝试整本导入（避免完全无数据）
+                    log_system("⚠️ 解析结果为空，执行整本导入(Fallback)，按段落切分...")
+                    yield from _iter_doc_rows("默认知识库 (Fallback)", "text", ["telegram", "kb", "fallback"], content.splitlines(True), src, ts)
+
+    # 2. qa.txt（补充知识库）
+    qa_file = os.path.join(base, "qa.txt")
+    if os.path.exists(qa_file):
+        try:
+            with open(qa_file, "r", encoding="utf-8") as f:
+                qa_content = f.read()
+        except Exception as e:
+            log_system(f"⚠️ 导入 qa.txt 失败: {e}")
+            qa_content = ""
+        if qa_content.strip():
+            log_system("📂 正在解析并导入 qa.txt (补充知识库)...")
+            qa_count = 0
+            for b in _iter_multi_lang_qa(qa_content):
+                q_sc = b.get('q_sc', '')
+                yield _new_kb_row(q_sc[:100] if q_sc else "QA Pair", "qa_txt", ["telegram", "kb", "qa_txt"], _qa_block_content(b), KB_SOURCE_FILES[1], ts)
+                qa_count += 1
+            if qa_count:
+                log_system(f"✅ 成功从 qa.txt 导入 {qa_count} 条知识库条目！")
+
+    # 3. extra_kb.txt（如 PDF 导入内容）：优先 Markdown 解析，否则整本导入
+    extra_file = os.path.join(base, "extra_kb.txt")
+    if os.path.exists(extra_file):
+        try:
+            with open(extra_file, "r", encoding="utf-8") as f:
+                extra_content = f.read()
+        except Exception as e:
+            log_system(f"⚠️ 导入 extra_kb.txt 失败: {e}")
+            extra_content = ""
+        if extra_content.strip():
+            log_system("📂 正在解析并导入 extra_kb.txt (额外知识库)...")
+            src = KB_SOURCE_FILES[2]
+            first, extra_blocks = _peek(_iter_markdown_kb(extra_content))
+            if first is not None:
+                extra_count = 0
+                for mb in extra_blocks:
+                    yield _new_kb_row(mb['title'][:100], "markdown", ["telegram", "kb", "extra"], mb['content'], src, ts)
+                    extra_count += 1
+                log_system(f"✅ 成功从 extra_kb.txt 导入 {extra_count} 条 Markdown 知识库条目！")
+            else:
+                log_system("⚠️ extra_kb.txt 解析结果为空，执行整本导入，按段落切分...")
+                n = 0
+                for row in _iter_doc_rows("额外知识库 (Full)", "text", ["telegram", "kb", "extra", "fallback"], extra_content.splitlines(True), src, ts):
+                    yield row
+                    n += 1
+                log_system(f"✅ 成功从 extra_kb.txt 导入整本内容（{n} 个段落）")
+
+# 检索结果缓存：同一问题反复出现时直接复用结果
+# 键为 (归一化查询, 阶段范围, topn, 引擎, 快照版本)，只对 load_kb_entries 返回的快照生效；
+# 知识库或 config.txt 变化后快照版本随之变化，旧键自然失效。
+# 命中统计由 stats_counter 的后台线程定期写入 KB_CACHE_STATS_FILE 供后台展示，不在事件循环中写盘
+KB_CACHE_STATS_FILE = os.path.join("platforms", "telegram", "kb_cache_stats.json")
+_kb_query_cache = QueryCache(maxsize=1024, ttl=300.0)
+
+def _kb_cache_key(kind, query_text, scope, topn, engine):
+    snap = _kb_snapshot
+    if snap["items"] is None or snap["version"] is None:
+        return None
+    # bigram / dense 引擎按归一化文本打分（dense 取其字符 n-gram）；bm25 / fts5 按词项切分（英文词间空格有意义）
+    norm = normalize_text(query_text) if engine in ("bigram", "dense") else " ".join(bm25_terms(query_text))
+    if not norm:
+        return None
+    return (kind, norm, scope, topn, engine, snap["version"], snap["config_mtime"])
+
+def _kb_cached(key, compute):
+    if key is None:
+        return compute()
+    found, value = _kb_query_cache.get(key)
+    if not found:
+        value = compute()
+        _kb_query_cache.put(key, value)
+    return value
+
+def retrieve_kb_context(query_text, kb_items, topn=2, engine=None):
     if not query_text or (not kb_items):
         return []
-    norm_q = _normalize_text(query_text)
-    if not norm_q:
+    engine = engine or _kb_snapshot["engine"]
+    if kb_items is _kb_snapshot["items"]:
+        key = _kb_cache_key("kb", query_text, None, topn, engine)
+        return list(_kb_cached(key, lambda: _retrieve_kb_uncached(query_text, kb_items, topn, engine)))
+    return _retrieve_kb_uncached(query_text, kb_items, topn, engine)
+
+def _retrieve_kb_uncached(query_text, kb_items, topn, engine):
+    if engine in KB_SQL_ENGINES:
+        return _retrieve_kb_fts(query_text, kb_items, topn)
+    # 常驻索引只服务于 load_kb_entries 返回的列表；其它列表（如测试或子集）临时建索引
+    index = _get_kb_index(engine)
+    if not index.is_built_for(kb_items):
+        index = create_kb_index(engine, kb_items, store_dir=KB_EMBED_DIR)
+    return index.search(query_text, topn)
+
+def get_kb_stage_partitions(kb_items):
+    """
+    返回 kb_items 的阶段分区（KBStagePartitions）；对 load_kb_entries 的快照列表只构建一次并随快照缓存
+    """
+    snap = _kb_snapshot
+    engine = snap["engine"]
+    if kb_items is snap["items"] and kb_items is not None:
+        parts = snap["partitions"]
+        if parts is None or not parts.is_built_for(kb_items) or parts.engine != engine:
+            parts = KBStagePartitions(kb_items, engine)
+            snap["partitions"] = parts
+        return parts
+    return KBStagePartitions(kb_items, engine)
+
+def retrieve_kb_for_stage(query_text, partitions, stage, topn=2):
+    """在某阶段可见范围（全局分区 + 阶段分区）内检索"""
+    def compute():
+        if partitions.engine in KB_SQL_ENGINES:
+            return _retrieve_kb_uncached(query_text, partitions.items_for(stage), topn, partitions.engine)
+        return partitions.search(query_text, stage, topn)
+    if not query_text:
         return []
-    q_tokens = _bigram_tokens(norm_q)
-    scored = []
-    for it in kb_items:
-        title = _normalize_text((it.get("title","") or ""))
-        content = _normalize_text((it.get("content","") or ""))
-        if not title and not content:
-            continue
-        t_tokens = _bigram_tokens(title)
-        c_tokens = _bigram_tokens(content)
-        title_overlap = len(q_tokens & t_tokens) / max(1, len(q_tokens))
-        content_overlap = len(q_tokens & c_tokens) / max(1, len(q_tokens))
-        bonus = 0.0
-        if norm_q in title or title in norm_q:
-            bonus += 0.6
-        if norm_q in content or content in norm_q:
-            bonus += 0.3
-        base = 2.0 * title_overlap + 1.0 * content_overlap + bonus
-        if base == 0.0:
-            text_all = title + content
-            base = difflib.SequenceMatcher(None, norm_q, text_all).ratio() * 0.5
-        scored.append((base, it))
-    scored.sort(key=lambda x: x[0], reverse=True)
-    return [it for _, it in scored[:max(1, topn)]]
+    if partitions is _kb_snapshot["partitions"]:
+        key = _kb_cache_key("stage", query_text, stage, topn, partitions.engine)
+        return list(_kb_cached(key, compute))
+    return compute()
+
+def _retrieve_kb_fts(query_text, kb_items, topn):
+    """
+    在 SQLite FTS5 内取前 topn 个候选，再映射回 kb_items 中的同一对象（只返回列表内的条目）
+    kb_items 为阶段过滤后的子集时多取一些候选再过滤
+    """
+    snap = _kb_snapshot
+    full = kb_items is snap["items"] and snap["by_id"] is not None
+    limit = topn if full else max(topn * 10, 50)
+    try:
+        rows = db.search_kb("default", query_text, limit)
+    except Exception as e:
+        log_system(f"⚠️ FTS5 检索失败，回退到 bigram: {e}")
+        return create_kb_index("bigram", kb_items).search(query_text, topn)
+    by_id = snap["by_id"] if full else {it.get("id"): it for it in kb_items}
+    hits = []
+    for row in rows:
+        it = by_id.get(row.get("id"))
+        if it is not None:
+            hits.append(it)
+            if len(hits) >= topn:
+                break
+    return hits
 
 def _split_sentences(s):
     if not s:
@@ -648,6 +758,16 @@ def detect_qa_only(query_text, kb_hits):
         return False, {}
     return True, reason
 
+def detect_qa_only_cached(query_text, kb_hits):
+    """detect_qa_only 的缓存版本：按原始问题文本与命中条目 id 缓存（只对快照中的命中生效）"""
+    hit_ids = tuple(it.get("id") for it in (kb_hits or []))
+    key = None
+    snap = _kb_snapshot
+    if snap["items"] is not None and snap["version"] is not None and query_text and query_text.strip():
+        key = ("qa_only", query_text.strip(), hit_ids, snap["version"], snap["config_mtime"])
+    enabled, reason = _kb_cached(key, lambda: detect_qa_only(query_text, kb_hits))
+    return enabled, dict(reason)
+
 def _filter_sentences_by_user(text, user_text):
     sents = _split_sentences(text)
     if not sents:
@@ -770,27 +890,25 @@ def _parse_qa_pairs_from_text(content):
     return pairs
 
 def _parse_multi_lang_qa(content):
-    blocks = []
+    return list(_iter_multi_lang_qa(content))
+
+def _iter_multi_lang_qa(content):
+    """逐块产出多语言 QA（QA-xxx 分隔，【问题-简体】/【问题-繁体】/【答案-简体】/【答案-繁体】）"""
     if not content:
-        return blocks
-    lines = content.splitlines()
+        return
     cur = {"q_sc":"", "q_tc":"", "a_sc":"", "a_tc":""}
     cur_key = None
-    def flush():
-        nonlocal cur
-        if any(cur.values()):
-            blocks.append({k: (v.strip()) for k, v in cur.items()})
-        cur = {"q_sc":"", "q_tc":"", "a_sc":"", "a_tc":""}
-    for raw in lines:
+    for raw in content.splitlines():
         line = (raw or "").strip()
         if not line:
-            if cur_key:
-                (cur[cur_key] if cur_key else "")
             continue
         if line.startswith("====="):
              continue
         if line.startswith("QA-"):
-            flush()
+            block = {k: v.strip() for k, v in cur.items()}
+            if any(block.values()):
+                yield block
+            cur = {"q_sc":"", "q_tc":"", "a_sc":"", "a_tc":""}
             cur_key = None
             continue
         if line.startswith("【问题-简体】"):
@@ -811,8 +929,9 @@ def _parse_multi_lang_qa(content):
             continue
         if cur_key:
             cur[cur_key] += ("\n" + line)
-    flush()
-    return [b for b in blocks if any(b.values())]
+    block = {k: v.strip() for k, v in cur.items()}
+    if any(block.values()):
+        yield block
 
 def _match_multi_lang_qa(blocks, user_msg):
     if not blocks or not user_msg:
@@ -839,17 +958,19 @@ def _parse_markdown_kb(content):
     """
     通用 Markdown 分割器：按标题（#）分割知识库
     """
-    lines = content.splitlines()
-    blocks = []
+    return list(_iter_markdown_kb(content))
+
+def _iter_markdown_kb(content):
+    """逐段产出按 Markdown 标题分割的 {"title", "content"}"""
     current_title = "General"
     current_content = []
     
-    for line in lines:
+    for line in content.splitlines():
         if line.strip().startswith('#'):
             if current_content:
                 text = "\n".join(current_content).strip()
                 if text:
-                    blocks.append({"title": current_title, "content": text})
+                    yield {"title": current_title, "content": text}
             current_title = line.strip().lstrip('#').strip()
             current_content = [line]
         else:
@@ -858,16 +979,16 @@ def _parse_markdown_kb(content):
     if current_content:
         text = "\n".join(current_content).strip()
         if text:
-            blocks.append({"title": current_title, "content": text})
-            
-    return blocks
+            yield {"title": current_title, "content": text}
 
 def load_config():
     """
     热更新功能：从 config.txt 读取功能开关配置
-    返回配置字典
+    返回配置字典（各调用方共享的快照，只读）
     """
-    config_file = "platforms/telegram/config.txt"
+    return config_registry.get("config")
+
+def _parse_config(config_file):
     config = {
         'PRIVATE_REPLY': True,   # 默认开启私聊回复
         'GROUP_REPLY': True,     # 默认开启群聊回复
@@ -876,13 +997,21 @@ def load_config():
         'AUDIT_ENABLED': True,   # 默认开启内容审核
         'AUDIT_MAX_RETRIES': 3,  # 默认最大重试次数
         'AUDIT_TEMPERATURE': 0.0, # 默认审核温度
+        'AUDIT_HEDGE_DELAY_MS': 0,  # 远程审核对冲请求的延迟（毫秒），0 为逐个故障切换
         'REPLY_DELAY_MIN_SECONDS': 3.0,
         'REPLY_DELAY_MAX_SECONDS': 10.0,
         'AUTO_QUOTE': False,
         'QUOTE_INTERVAL_SECONDS': 30.0,
         'QUOTE_MAX_LEN': 200,
+        'GROUP_CACHE_TOUCH_SECONDS': 60.0,  # 群聊 last_seen 的刷新粒度（秒）
+        'HISTORY_BACKFILL': True,  # 会话首次使用时从 Telegram 回填历史到内存缓冲
+        'DEBOUNCE_SECONDS': 0.0,  # 同一会话连续消息的合并窗口（秒），0 为关闭
+        'ADMISSION_MAX_CONCURRENT': 4,  # 同时进行的 LLM 生成上限
+        'ADMISSION_MAX_QUEUE': 16,      # 排队上限，超出后按优先级丢弃
+        'ADMISSION_SHED_REPLY': True,   # 被丢弃的私聊 / @ / 关键词消息回复 KB_FALLBACK_MESSAGE（off 为静默）
         'CONV_ORCHESTRATION': False,
         'KB_ONLY_REPLY': False,
+        'KB_RETRIEVAL_ENGINE': 'bigram',  # bigram / bm25 / dense / fts5
         'CONVERSATION_MODE': 'ai_visible'  # ai_visible / human_simulated
     }
     
@@ -901,17 +1030,22 @@ def load_config():
                     value = value.strip().lower()
                     raw_value = line.split('=', 1)[1].strip()
                     
-                    if key in ['PRIVATE_REPLY', 'GROUP_REPLY', 'GROUP_CONTEXT', 'AUDIT_ENABLED', 'AUTO_QUOTE', 'CONV_ORCHESTRATION', 'KB_ONLY_REPLY']:
+                    if key in ['PRIVATE_REPLY', 'GROUP_REPLY', 'GROUP_CONTEXT', 'AUDIT_ENABLED', 'AUTO_QUOTE', 'CONV_ORCHESTRATION', 'KB_ONLY_REPLY',
+                               'HISTORY_BACKFILL', 'ADMISSION_SHED_REPLY']:
                         config[key] = (value == 'on')
                     elif key == 'CONVERSATION_MODE':
                         if value in ['ai_visible', 'human_simulated']:
                             config[key] = value
+                    elif key == 'KB_RETRIEVAL_ENGINE':
+                        if value in ['bigram', 'bm25', 'dense', 'fts5']:
+                            config[key] = value
                     elif key in ['AI_TEMPERATURE', 'AUDIT_TEMPERATURE']:
                         try:
                             config[key] = float(value)
                         except ValueError:
                             pass
-                    elif key in ['REPLY_DELAY_MIN_SECONDS', 'REPLY_DELAY_MAX_SECONDS', 'QUOTE_INTERVAL_SECONDS']:
+                    elif key in ['REPLY_DELAY_MIN_SECONDS', 'REPLY_DELAY_MAX_SECONDS', 'QUOTE_INTERVAL_SECONDS',
+                                 'GROUP_CACHE_TOUCH_SECONDS', 'DEBOUNCE_SECONDS']:
                         try:
                             config[key] = float(value)
                         except ValueError:
@@ -931,7 +1065,7 @@ def load_config():
                         config[key] = raw_value
                     elif key == 'KB_FALLBACK_MESSAGE':
                         config[key] = raw_value
-                    elif key == 'QUOTE_MAX_LEN':
+                    elif key in ['QUOTE_MAX_LEN', 'ADMISSION_MAX_CONCURRENT', 'ADMISSION_MAX_QUEUE', 'AUDIT_HEDGE_DELAY_MS']:
                         try:
                             config[key] = int(value)
                         except ValueError:
@@ -949,50 +1083,44 @@ TG_PLATFORM_DIR = "platforms/telegram"
 GROUP_CACHE_FILE = os.path.join(TG_PLATFORM_DIR, "group_cache.json")
 SELECTED_GROUPS_FILE = os.path.join(TG_PLATFORM_DIR, "selected_groups.json")
 
-def load_group_cache():
-    try:
-        with open(GROUP_CACHE_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            if isinstance(data, dict):
-                return data
-    except:
-        pass
-    return {}
+# 群聊缓存常驻内存：只有新群、标题变化或 last_seen 超过 GROUP_CACHE_TOUCH_SECONDS（config.txt）时才标记为脏，
+# 后台至多每 GROUP_CACHE_FLUSH_SECONDS 秒原子写回 group_cache.json 一次
+GROUP_CACHE_FLUSH_SECONDS = 3.0
+group_cache = GroupCache(GROUP_CACHE_FILE, GROUP_CACHE_FLUSH_SECONDS)
 
-def save_group_cache(cache):
-    os.makedirs(os.path.dirname(GROUP_CACHE_FILE), exist_ok=True)
-    with open(GROUP_CACHE_FILE, 'w', encoding='utf-8') as f:
-        json.dump(cache, f, ensure_ascii=False, indent=2)
+def load_group_cache():
+    return group_cache.snapshot()
 
-async def record_group(event):
+async def record_group(event, touch_seconds=60.0):
     if not event.is_group:
         return
     chat_id = getattr(event, 'chat_id', None)
     if chat_id is None:
         return
     chat_id_str = str(chat_id)
-    cache = load_group_cache()
     chat_obj = getattr(event, 'chat', None) or getattr(event.message, 'chat', None)
     title = ""
     if chat_obj:
         title = getattr(chat_obj, 'title', None) or getattr(chat_obj, 'name', None) or ""
     else:
-        try:
-            chat = await event.get_chat()
-            title = getattr(chat, 'title', None) or getattr(chat, 'name', None) or ""
-        except:
-            title = ""
-    entry = dict(cache.get(chat_id_str, {}))
-    entry['title'] = title or entry.get('title', '')
-    entry['last_seen'] = datetime.now().isoformat()
-    cache[chat_id_str] = entry
-    save_group_cache(cache)
-    descriptor = title or str(chat_id)
-    log_system(f"🗂️ 缓存群聊: {descriptor} ({chat_id})")
+        # 只有缓存里还没有标题时才请求 Telegram
+        known = group_cache.get(chat_id_str)
+        if not known or not known.get('title'):
+            try:
+                chat = await event.get_chat()
+                title = getattr(chat, 'title', None) or getattr(chat, 'name', None) or ""
+            except:
+                title = ""
+    if group_cache.record(chat_id_str, title, touch_seconds):
+        descriptor = title or str(chat_id)
+        log_system(f"🗂️ 缓存群聊: {descriptor} ({chat_id})")
 
 def load_selected_group_ids():
+    return config_registry.get("selected_groups")
+
+def _parse_selected_group_ids(path):
     try:
-        with open(SELECTED_GROUPS_FILE, 'r', encoding='utf-8') as f:
+        with open(path, 'r', encoding='utf-8') as f:
             data = json.load(f)
         raw_ids = data.get('selected_ids', [])
         result = set()
@@ -1001,65 +1129,125 @@ def load_selected_group_ids():
                 result.add(int(raw))
             except:
                 pass
-        return result
+        return frozenset(result)
     except:
-        return set()
+        return frozenset()
+
+config_registry.register("config", os.path.join(TG_PLATFORM_DIR, "config.txt"), _parse_config)
+config_registry.register("keywords", os.path.join(TG_PLATFORM_DIR, "keywords.txt"), _parse_keywords)
+config_registry.register("prompt", os.path.join(TG_PLATFORM_DIR, "prompt.txt"), _parse_system_prompt)
+config_registry.register("selected_groups", SELECTED_GROUPS_FILE, _parse_selected_group_ids)
 
 
+# 统计计数在内存中累加，后台每 STATS_FLUSH_SECONDS 秒合并写入 stats.json（原子替换），退出时自动落盘
+STATS_FILE = os.path.join(TG_PLATFORM_DIR, "stats.json")
+STATS_FLUSH_SECONDS = 5.0
+stats_counter = StatsAggregator(STATS_FILE, STATS_FLUSH_SECONDS)
+stats_counter.add_flush_hook(CacheStatsWriter(KB_CACHE_STATS_FILE, _kb_query_cache.stats))
+# AI 客户端连接池统计（请求数 / 新建连接数 / 复用率），同样由后台线程写入供后台缓存面板展示
+AI_CLIENT_STATS_FILE = os.path.join(TG_PLATFORM_DIR, "ai_client_stats.json")
+stats_counter.add_flush_hook(CacheStatsWriter(AI_CLIENT_STATS_FILE, ai_clients.metrics))
+
 def load_stats():
-    """加载统计数据"""
-    stats_file = "platforms/telegram/stats.json"
-    default_stats = {
-        "total_messages": 0,
-        "total_replies": 0,
-        "private_messages": 0,
-        "group_messages": 0,
-        "success_count": 0,
-        "error_count": 0,
-        "start_time": datetime.now().isoformat(),
-        "last_active": None
-    }
-    
-    try:
-        with open(stats_file, 'r', encoding='utf-8') as f:
-            stats = json.load(f)
-            if stats.get('start_time') is None:
-                stats['start_time'] = datetime.now().isoformat()
-            return stats
-    except:
-        return default_stats
+    """加载统计数据（已落盘的总数 + 内存中尚未落盘的增量）"""
+    return stats_counter.snapshot()
+
+# 会话消息环形缓冲：收到的消息、本进程发出的回复与机主在其它设备发出的消息都写入内存，
+# 组装上下文与自动引用判断直接读缓冲；会话首次使用时（HISTORY_BACKFILL=on）从 Telegram 回填一次
+CHAT_HISTORY_MAX_CHATS = 2000
+CHAT_HISTORY_PER_CHAT = 32
+chat_history = ChatHistoryBuffer(CHAT_HISTORY_MAX_CHATS, CHAT_HISTORY_PER_CHAT)
+
+# 连续消息合并：DEBOUNCE_SECONDS（config.txt）> 0 时，同一会话窗口内的消息合并为一次生成
+chat_debouncer = ChatDebouncer()
+InboundMessage = namedtuple("InboundMessage", ["event", "msg", "trace_id", "priority", "handoff"])
+
+# 消息分流规则：keywords.txt、HANDOFF_KEYWORDS 与群聊白名单编译成一个 AC 自动机 + 集合，
+# 只在这些配置的快照变化（ConfigRegistry 重新解析）时重建
+_triage_cache = TriageCache()
+
+def get_triage_rules(config=None):
+    config = config or load_config()
+    return _triage_cache.get(load_keywords(), config.get('HANDOFF_KEYWORDS', ''), load_selected_group_ids())
 
-def save_stats(stats):
-    """保存统计数据"""
-    stats_file = "platforms/telegram/stats.json"
+# LLM 生成的全局准入控制：并发上限与排队上限来自 config.txt（ADMISSION_MAX_CONCURRENT / ADMISSION_MAX_QUEUE），
+# 排队按 私聊 > @ > 关键词 > 群聊上下文 的优先级放行
+admission = AdmissionController()
+
+async def _ensure_history_backfilled(chat_id, max_id=0):
+    if not chat_history.needs_backfill(chat_id):
+        return
+    if not load_config().get('HISTORY_BACKFILL', True):
+        chat_history.mark_backfilled(chat_id)
+        return
     try:
-        stats['last_active'] = datetime.now().isoformat()
-        with open(stats_file, 'w', encoding='utf-8') as f:
-            json.dump(stats, f, indent=2, ensure_ascii=False)
+        messages = [m async for m in client.iter_messages(chat_id, limit=CHAT_HISTORY_PER_CHAT, max_id=max_id)]
+        chat_history.seed(chat_id, messages)
     except Exception as e:
-        log_system(f"⚠️ 保存统计失败: {e}")
+        # 回填失败不重试：之后的上下文只来自缓冲
+        log_system(f"⚠️ 回填会话历史失败 ({chat_id}): {e}")
+        chat_history.mark_backfilled(chat_id)
 
 async def get_chat_history(chat_id, limit=8, max_id=0):
-    """获取聊天上下文"""
-    messages = []
-    try:
-        async for msg in client.iter_messages(chat_id, limit=limit, max_id=max_id):
-            if msg.text:
-                role = "assistant" if msg.out else "user"
-                messages.append({"role": role, "content": msg.text})
-        return messages[::-1]
-    except Exception:
-        return []
+    """获取聊天上下文（id < max_id 的最近 limit 条）"""
+    await _ensure_history_backfilled(chat_id, max_id)
+    return chat_history.history(chat_id, limit, max_id)
 
 async def _get_prev_incoming_message(chat_id, max_id=0):
-    try:
-        async for msg in client.iter_messages(chat_id, limit=1, max_id=max_id):
-            if msg and msg.text and not msg.out:
-                return msg
-    except Exception:
-        return None
+    await _ensure_history_backfilled(chat_id, max_id)
+    prev = chat_history.previous(chat_id, max_id)
+    if prev and prev.text and not prev.out:
+        return prev
     return None
 
+async def _deliver_reply(chat_id, text, quote_target=None):
+    """发送回复（引用 quote_target 或直接发送）并写入会话缓冲"""
+    if quote_target is not None:
+        sent = await quote_target.reply(text)
+    else:
+        sent = await client.send_message(chat_id, text)
+    chat_history.add_message(chat_id, sent)
+    return sent
+
+async def _send_reply(event, text, quote=False):
+    """立即发送回复"""
+    # 回复一旦开始发送，之后到达的消息不再取消本次生成，而是进入新的合并批次
+    mark_batch_sent()
+    return await _deliver_reply(event.chat_id, text, event if quote else None)
+
+async def _send_job(job):
+    if job.context is not None:
+        mark_batch_sent(job.context)
+    return await _deliver_reply(job.chat_id, job.text, job.quote_target)
+
+def _on_send_error(job, e):
+    log_system(f"❌ 发送回复失败 ({job.chat_id}): {e}")
+    stats_counter.incr('error_count')
+
+# 拟人延迟发送：生成完成后把回复交给调度器按 send_at 发送，处理流程立即返回；
+# 等待期间由调度器显示“正在输入”，合并窗口内的新消息可撤回尚未发出的回复
+outbound = OutboundScheduler(_send_job, typing=lambda chat_id: client.action(chat_id, 'typing'), on_error=_on_send_error)
+
+def _reply_delay(config):
+    dmin = float(config.get('REPLY_DELAY_MIN_SECONDS', 3.0))
+    dmax = float(config.get('REPLY_DELAY_MAX_SECONDS', 10.0))
+    if dmin > dmax:
+        dmin, dmax = dmax, dmin
+    return random.uniform(dmin, dmax)
+
+async def _schedule_reply(event, msg, trace_id, config, reply, on_sent):
+    """REPLY_DELAY_MIN/MAX_SECONDS 随机延迟后由 outbound 发送，发出后调用 on_sent()"""
+    use_quote = await _should_auto_quote(event, msg, config)
+    job = outbound.schedule_in(event.chat_id, reply, _reply_delay(config), event if use_quote else None,
+                               lambda job, sent: on_sent())
+
+    def _supersede():
+        if outbound.cancel_job(job):
+            log_trace_event(trace_id, "REPLY_SUPERSEDED", {"content_len": len(reply)})
+
+    job.context = defer_batch(_supersede)
+    return job
+
 def _similar(a, b):
     if not a or not b:
         return 0.0
@@ -1091,35 +1279,35 @@ async def _should_auto_quote(event, msg, config):
         return False
     return True
 
+@client.on(events.NewMessage(outgoing=True))
+async def record_outgoing(event):
+    # 机主在其它设备上发出的消息也进入会话缓冲（本进程的发送已在 _send_reply 中记录，按 id 去重）
+    if event.message.text:
+        chat_history.add_message(event.chat_id, event.message)
+
 @client.on(events.NewMessage(incoming=True))
 async def handler(event):
     # 只处理有文本内容的消息
     if not event.message.text:
         return
+    chat_history.add_message(event.chat_id, event.message)
     
     # 1. MSG_RECEIVED (Trace Start)
     trace_id = str(uuid.uuid4())
     msg = event.message.text
-    sender = await event.get_sender()
     user_id = str(event.chat_id)
     
-    # 加载统计数据
-    stats = load_stats()
-    stats['total_messages'] += 1
-    
-    name = getattr(sender, 'first_name', '朋友')
+    stats_counter.incr('total_messages')
     
     # 【热更新】实时读取配置
     config = load_config()
-    keywords = load_keywords()
-    context_reply_enabled = config.get('GROUP_CONTEXT', False)
     orch_enabled = bool(config.get('CONV_ORCHESTRATION', False))
     
     # 记录消息类型
     if event.is_private:
-        stats['private_messages'] += 1
+        stats_counter.incr('private_messages')
     elif event.is_group:
-        stats['group_messages'] += 1
+        stats_counter.incr('group_messages')
 
     if orch_enabled:
         log_trace_event(trace_id, "MSG_RECEIVED", {
@@ -1128,142 +1316,162 @@ async def handler(event):
             "platform": "telegram"
         })
     
-    # 【功能开关检查】
-    if event.is_private and not config['PRIVATE_REPLY']:
-        # 私聊回复已关闭
-        log_private(f"[trace:{trace_id}] 🔕 私聊回复已关闭，忽略消息 [{name}]: {msg}")
-        return
-    
-    if event.is_group and not config['GROUP_REPLY']:
-        # 群聊回复已关闭
-        log_group(f"🔕 群聊回复已关闭，忽略消息 [{name}]: {msg}")
-        return
+    # 【分流】功能开关、群聊白名单、触发词与转人工关键词在一次扫描内判定
+    triage = get_triage_rules(config).decide(msg, config, event.is_private, event.is_group,
+                                             event.mentioned, getattr(event, 'chat_id', None))
 
-    if event.is_group:
-        await record_group(event)
-        selected_group_ids = load_selected_group_ids()
-        if selected_group_ids:
-            chat_id = getattr(event, 'chat_id', None)
-            if chat_id is None or int(chat_id) not in selected_group_ids:
-                chat_obj = getattr(event, 'chat', None) or getattr(event.message, 'chat', None)
-                chat_name = getattr(chat_obj, 'title', None) or getattr(chat_obj, 'name', None) if chat_obj else ""
-                descriptor = chat_name or str(chat_id)
-                log_group(f"🛑 群聊 [{descriptor}] 不在白名单，跳过回复")
-                return
-    
-    # 【智能触发逻辑】
-    should_reply = False
-    
-    if event.is_private:
-        # 私聊：直接回复（已经通过开关检查）
-        should_reply = True
-        log_private(f"[trace:{trace_id}] 📩 收到私聊 [{name}]: {msg}")
-    elif event.is_group:
-        # 群聊：需要满足以下任一条件（已经通过开关检查）
-        if event.mentioned:
-            # 条件1：被 @ 了
-            should_reply = True
-            log_group(f"📩 群聊被 @ [{name}]: {msg}")
-        elif keywords:
-            # 条件2：消息包含关键词
-            for keyword in keywords:
-                if keyword.lower() in msg.lower():
-                    should_reply = True
-                    log_group(f"📩 群聊触发关键词 [{keyword}] [{name}]: {msg}")
-                    break
-        elif context_reply_enabled:
-            should_reply = True
-            log_group(f"📩 群聊上下文触发 [{name}]: {msg}")
-    
-    # 如果不满足回复条件，直接返回
-    if not should_reply:
+    if event.is_group and triage.reason != "group_off":
+        await record_group(event, config.get('GROUP_CACHE_TOUCH_SECONDS', 60.0))
+
+    if triage.action != "reply":
+        _log_ignored(event, trace_id, msg, triage)
         return
 
-    def _handoff_intent_detect(user_msg):
-        if not user_msg:
-            return False
-        s = (user_msg or "").strip().lower()
-        keys_raw = str(config.get('HANDOFF_KEYWORDS', '') or '')
-        keys = [k.strip().lower() for k in keys_raw.split(',') if k.strip()]
-        if keys and any(k in s for k in keys):
-            return True
-        return False
+    # 确定要回复后才解析发送者（只用于日志）
+    sender = await event.get_sender()
+    name = getattr(sender, 'first_name', '朋友')
+    if triage.reason == "private":
+        log_private(f"[trace:{trace_id}] 📩 收到私聊 [{name}]: {msg}")
+    elif triage.reason == "mention":
+        log_group(f"📩 群聊被 @ [{name}]: {msg}")
+    elif triage.reason == "keyword":
+        log_group(f"📩 群聊触发关键词 [{triage.keyword}] [{name}]: {msg}")
+    else:
+        log_group(f"📩 群聊上下文触发 [{name}]: {msg}")
 
-    if _handoff_intent_detect(msg):
+    inbound = InboundMessage(event, msg, trace_id, triage.priority, triage.handoff)
+    window = float(config.get('DEBOUNCE_SECONDS', 0.0) or 0.0)
+    if window > 0:
+        chat_debouncer.submit(event.chat_id, inbound, window, _reply_merged)
+        return
+    await _reply_pipeline(event, msg, trace_id, config, triage.priority, triage.handoff)
+
+def _log_ignored(event, trace_id, msg, triage):
+    if triage.reason == "private_off":
+        log_private(f"[trace:{trace_id}] 🔕 私聊回复已关闭，忽略消息 [{event.sender_id}]: {msg}")
+    elif triage.reason == "group_off":
+        log_group(f"🔕 群聊回复已关闭，忽略消息 [{event.sender_id}]: {msg}")
+    elif triage.reason == "not_selected":
+        chat_id = getattr(event, 'chat_id', None)
+        chat_obj = getattr(event, 'chat', None) or getattr(event.message, 'chat', None)
+        chat_name = getattr(chat_obj, 'title', None) or getattr(chat_obj, 'name', None) if chat_obj else ""
+        descriptor = chat_name or str(chat_id)
+        log_group(f"🛑 群聊 [{descriptor}] 不在白名单，跳过回复")
+
+async def _reply_merged(items):
+    """合并窗口到期：把批次内的消息拼成一条，以最后一条消息（及其 trace_id）为主生成一次回复"""
+    event, trace_id = items[-1].event, items[-1].trace_id
+    msg = "\n".join(it.msg for it in items)
+    merged_ids = [it.trace_id for it in items]
+    priority = min(it.priority for it in items)
+    handoff = any(it.handoff for it in items)
+    if len(items) > 1:
+        log_trace_event(trace_id, "MSG_MERGED", {"merged_trace_ids": merged_ids, "count": len(items)})
+        for it in items[:-1]:
+            log_trace_event(it.trace_id, "MERGED_INTO", {"into_trace_id": trace_id})
+    try:
+        await _reply_pipeline(event, msg, trace_id, load_config(), priority, handoff, history_max_id=items[0].event.id)
+    except asyncio.CancelledError:
+        # 回复发出前同一会话又来了新消息：放弃本次生成，由新批次连同这些消息重新生成
+        log_trace_event(trace_id, "GENERATION_SUPERSEDED", {"merged_trace_ids": merged_ids})
+        raise
+
+async def _reply_pipeline(event, msg, trace_id, config, priority=PRIORITY_CONTEXT, handoff=False, history_max_id=None):
+    """已决定回复的消息：转人工（handoff 由分流阶段判定）/ QA / 知识库 / 编排 / 审核生成并发送"""
+    if handoff:
         reply = (config.get('HANDOFF_MESSAGE') or "").strip()
         if not reply:
             log_system("⚠️ HANDOFF_MESSAGE 未配置，已禁止默认兜底；跳过发送")
             return
-        dmin = float(config.get('REPLY_DELAY_MIN_SECONDS', 3.0))
-        dmax = float(config.get('REPLY_DELAY_MAX_SECONDS', 10.0))
-        if dmin > dmax:
-            dmin, dmax = dmax, dmin
-        delay = random.uniform(dmin, dmax)
-        await asyncio.sleep(delay)
-        use_quote = await _should_auto_quote(event, msg, config)
-        if use_quote:
-            await event.reply(reply)
-        else:
-            await client.send_message(event.chat_id, reply)
+
+        def _sent():
+            if event.is_private:
+                log_private(f"[trace:{trace_id}] HANDOFF_REPLY: {reply}")
+            else:
+                log_group(f"HANDOFF_REPLY: {reply}")
+            stats_counter.incr('total_replies')
+            stats_counter.incr('success_count')
+
+        await _schedule_reply(event, msg, trace_id, config, reply, _sent)
+        return
+
+    qa_file = os.path.join(os.path.dirname(__file__), 'platforms', 'telegram', 'qa.txt')
+    # qa.txt 未变化时复用已编译的匹配器（按 mtime/size 失效）
+    qa_reply = get_qa_matcher(qa_file, load_qa_pairs).match(msg)
+    if qa_reply:
+        log_trace_event(trace_id, "QA_HIT", {"reply_len": len(qa_reply)})
+        await _send_reply(event, qa_reply, True)
+        log_trace_event(trace_id, "REPLY_SENT", {"content_len": len(qa_reply)})
         if event.is_private:
-            log_private(f"[trace:{trace_id}] HANDOFF_REPLY: {reply}")
+            log_private(f"[trace:{trace_id}] QA_REPLY: {qa_reply}")
         else:
-            log_group(f"HANDOFF_REPLY: {reply}")
-        stats['total_replies'] += 1
-        stats['success_count'] += 1
-        save_stats(stats)
+            log_group(f"QA_REPLY: {qa_reply}")
         return
 
+    # 以下会调用 LLM（知识库问答 / 编排 / 审核生成），先经过全局准入控制
+    admission.configure(config.get('ADMISSION_MAX_CONCURRENT', 4), config.get('ADMISSION_MAX_QUEUE', 16))
+    try:
+        ticket = await admission.acquire(priority)
+    except AdmissionRejected as e:
+        await _shed_reply(event, trace_id, config, e)
+        return
+    log_trace_event(trace_id, "QUEUE_WAIT", {
+        "wait_ms": round(ticket.wait_ms, 1),
+        "priority": PRIORITY_NAMES.get(priority, priority),
+        "queue_depth": ticket.queue_depth
+    })
+    try:
+        await _generate_reply(event, msg, trace_id, config, handoff, history_max_id)
+    finally:
+        ticket.release()
+
+async def _shed_reply(event, trace_id, config, rejected):
+    """排队已满被丢弃：私聊 / @ / 关键词触发的消息按 ADMISSION_SHED_REPLY 回复 KB_FALLBACK_MESSAGE，否则静默"""
+    stats_counter.incr('shed_count')
+    reply = (config.get('KB_FALLBACK_MESSAGE') or "").strip()
+    send = bool(reply) and config.get('ADMISSION_SHED_REPLY', True) and rejected.priority < PRIORITY_CONTEXT
+    log_trace_event(trace_id, "LOAD_SHED", {
+        "priority": PRIORITY_NAMES.get(rejected.priority, rejected.priority),
+        "queue_depth": rejected.queue_depth,
+        "evicted": rejected.evicted,
+        "action": "fallback" if send else "silent"
+    })
+    log_system(f"⚠️ 生成队列已满，丢弃消息 ({event.chat_id}, {PRIORITY_NAMES.get(rejected.priority)})")
+    if send:
+        await _send_reply(event, reply, True)
+
+async def _generate_reply(event, msg, trace_id, config, handoff=False, history_max_id=None):
     async with client.action(event.chat_id, 'typing'):
         # 【热更新】每次处理消息前重新读取提示词
         system_prompt = load_system_prompt()
         
         # 获取历史记录（保持上下文）
-        history = await get_chat_history(event.chat_id, max_id=event.id)
-        qa_file = os.path.join(os.path.dirname(__file__), 'platforms', 'telegram', 'qa.txt')
-        qa_pairs = load_qa_pairs(qa_file)
-        qa_reply = match_qa_reply(msg, qa_pairs)
-        if qa_reply:
-            log_trace_event(trace_id, "QA_HIT", {"reply_len": len(qa_reply)})
-            await event.reply(qa_reply)
-            log_trace_event(trace_id, "REPLY_SENT", {"content_len": len(qa_reply)})
-            if event.is_private:
-                log_private(f"[trace:{trace_id}] QA_REPLY: {qa_reply}")
-            else:
-                log_group(f"QA_REPLY: {qa_reply}")
-            return
+        # 合并回复时只取批次首条消息之前的历史，批次内的消息已拼入 msg
+        history = await get_chat_history(event.chat_id, max_id=history_max_id or event.id)
         
-        # 默认上下文处理
-        kb_items = load_kb_entries()
+        # 默认上下文处理（知识库重新加载/批量导入可能较慢，放到线程池执行，不阻塞事件循环）
+        kb_items = await asyncio.get_running_loop().run_in_executor(None, load_kb_entries)
         kb_context = ""
         system_with_kb = system_prompt
 
         if config.get('KB_ONLY_REPLY', False):
-            if _handoff_intent_detect(msg):
+            if handoff:
                 conv_mode = config.get('CONVERSATION_MODE', 'ai_visible')
                 reply = get_mode_specific_response(conv_mode, 'handoff')
                 
                 if not reply:
                     log_system("⚠️ HANDOFF_MESSAGE 未配置（KB_ONLY 分支），跳过发送")
                     return
-                dmin = float(config.get('REPLY_DELAY_MIN_SECONDS', 3.0))
-                dmax = float(config.get('REPLY_DELAY_MAX_SECONDS', 10.0))
-                if dmin > dmax:
-                    dmin, dmax = dmax, dmin
-                delay = random.uniform(dmin, dmax)
-                await asyncio.sleep(delay)
-                use_quote = await _should_auto_quote(event, msg, config)
-                if use_quote:
-                    await event.reply(reply)
-                else:
-                    await client.send_message(event.chat_id, reply)
-                if event.is_private:
-                    log_private(f"[trace:{trace_id}] KB_ONLY_HANDOFF: {reply}")
-                else:
-                    log_group(f"KB_ONLY_HANDOFF: {reply}")
-                stats['total_replies'] += 1
-                stats['success_count'] += 1
-                save_stats(stats)
+
+                def _sent():
+                    if event.is_private:
+                        log_private(f"[trace:{trace_id}] KB_ONLY_HANDOFF: {reply}")
+                    else:
+                        log_group(f"KB_ONLY_HANDOFF: {reply}")
+                    stats_counter.incr('total_replies')
+                    stats_counter.incr('success_count')
+
+                await _schedule_reply(event, msg, trace_id, config, reply, _sent)
                 return
             log_system(f"[Trace] KB_ONLY Logic. Msg: {msg[:30]}...")
             kb_hits = retrieve_kb_context(msg, kb_items, topn=3)
@@ -1337,24 +1545,16 @@ async def handler(event):
                 if not reply:
                     log_system("⚠️ KB_FALLBACK_MESSAGE 未配置（KB_ONLY RAG Miss），跳过发送")
                     return
-            dmin = float(config.get('REPLY_DELAY_MIN_SECONDS', 3.0))
-            dmax = float(config.get('REPLY_DELAY_MAX_SECONDS', 10.0))
-            if dmin > dmax:
-                dmin, dmax = dmax, dmin
-            delay = random.uniform(dmin, dmax)
-            await asyncio.sleep(delay)
-            use_quote = await _should_auto_quote(event, msg, config)
-            if use_quote:
-                await event.reply(reply)
-            else:
-                await client.send_message(event.chat_id, reply)
-            if event.is_private:
-                log_private(f"[trace:{trace_id}] KB_ONLY_REPLY: {reply}")
-            else:
-                log_group(f"KB_ONLY_REPLY: {reply}")
-            stats['total_replies'] += 1
-            stats['success_count'] += 1
-            save_stats(stats)
+
+            def _sent():
+                if event.is_private:
+                    log_private(f"[trace:{trace_id}] KB_ONLY_REPLY: {reply}")
+                else:
+                    log_group(f"KB_ONLY_REPLY: {reply}")
+                stats_counter.incr('total_replies')
+                stats_counter.incr('success_count')
+
+            await _schedule_reply(event, msg, trace_id, config, reply, _sent)
             return
         
         # 编排模式专用变量
@@ -1414,40 +1614,34 @@ async def handler(event):
                     # ... (Handoff logging logic kept simple for brevity) ...
                     conv_mode = config.get('CONVERSATION_MODE', 'ai_visible')
                     handoff_msg = get_mode_specific_response(conv_mode, 'handoff')
-                    await event.reply(handoff_msg)
+                    await _send_reply(event, handoff_msg, True)
                     return
 
                 # --- 3. Stage Agent Execution ---
                 # 4. KB_RETRIEVED (Stage Scope Filtering)
                 current_stage = state.get("current_stage", "S0")
-                # Filter KB items that have the current stage tag OR are global (no tags or 'all')
-                filtered_kb = []
-                for it in kb_items:
-                    tags = it.get("tags") or []
-                    # Allow Global (empty tags or 'all'/'global') OR specific stage match
-                    if (not tags) or ("all" in tags) or ("global" in tags) or (current_stage in tags):
-                        filtered_kb.append(it)
+                # KB items that have the current stage tag OR are global (no tags or 'all'/'global'):
+                # 快照预先按阶段分区，这里只是查表 + 在该分区的索引内检索
+                kb_partitions = get_kb_stage_partitions(kb_items)
+                filtered_kb = kb_partitions.items_for(current_stage)
                 
-                kb_hits = retrieve_kb_context(msg, filtered_kb, topn=2)
+                kb_hits = retrieve_kb_for_stage(msg, kb_partitions, current_stage, topn=2)
                 
                 log_trace_event(trace_id, "KB_RETRIEVED", {
                     "stage_scope": [current_stage],
                     "hits": [{"kb_id": it.get("id"), "tags": it.get("tags")} for it in kb_hits]
                 })
-                qa_only_enabled, qa_reason = detect_qa_only(msg, kb_hits)
+                qa_only_enabled, qa_reason = detect_qa_only_cached(msg, kb_hits)
                 if qa_only_enabled and kb_hits:
                     kb_hits = kb_hits[:1]
                     log_trace_event(trace_id, "QA_ONLY", {"enabled": True, "reason": qa_reason})
 
                 stager = StageAgentRuntime(tenant_id)
-                rdec = stager.route_decision(state, history, filtered_kb) # Use filtered KB
+                rdec = stager.route_decision(state, history, filtered_kb, kb_hits=kb_partitions.size(current_stage)) # Use filtered KB
                 
-                http_client2 = httpx.AsyncClient(verify=_ssl_verify_default(), timeout=30.0)
-                ai_client_orch = AsyncOpenAI(
-                    api_key=AI_API_KEY,
-                    base_url=rdec.get("base_url") or AI_BASE_URL,
-                    http_client=http_client2
-                )
+                # 阶段路由可能指定不同的 base_url：同样从注册表取，相同路由复用连接
+                ai_client_orch = ai_clients.openai_client(rdec.get("base_url") or AI_BASE_URL, AI_API_KEY,
+                                                          verify=_ssl_verify_default(), timeout=AI_HTTP_TIMEOUT)
                 model_override = rdec.get("model") or AI_MODEL_NAME
                 temp_override = float(rdec.get("temperature") or config.get('AI_TEMPERATURE', 0.7))
                 
@@ -1500,7 +1694,7 @@ async def handler(event):
         # Fallback to standard logic if not orch enabled or failed (system_with_kb prepared)
         if not orch_enabled and not kb_context:
              kb_hits = retrieve_kb_context(msg, kb_items, topn=2)
-             qa_only_enabled, qa_reason = detect_qa_only(msg, kb_hits)
+             qa_only_enabled, qa_reason = detect_qa_only_cached(msg, kb_hits)
              if qa_only_enabled and kb_hits:
                  kb_hits = kb_hits[:1]
                  log_trace_event(trace_id, "QA_ONLY", {"enabled": True, "reason": qa_reason})
@@ -1541,14 +1735,14 @@ async def handler(event):
                     # 但作为连接失败的兜底，这是可以接受的。
                     current_client = get_ai_client() if attempt > 0 else ai_client_orch
                     
-                    audit_manager = AuditManager(current_client, model_override, load_config, platform="telegram")
-                    
                     # 6. STYLE_GUARD / AUDIT (Implied)
-                    gen_result = await audit_manager.generate_with_audit(
+                    gen_result = await get_audit_manager().generate_with_audit(
                         messages=messages,
                         user_input=msg,
                         history=history,
-                        temperature=temp_override
+                        temperature=temp_override,
+                        ai_client=current_client,
+                        model_name=model_override
                     )
                     break # Success
                 except APIConnectionError as e:
@@ -1572,7 +1766,10 @@ async def handler(event):
             log_trace_event(trace_id, "STYLE_GUARD", {"applied": sg_applied})
             if orch_enabled or status_block:
                 if "audit_primary_passed" in status_block:
-                    log_trace_event(trace_id, "AUDIT_PRIMARY", {"passed": bool(status_block.get("audit_primary_passed"))})
+                    primary_passed = status_block.get("audit_primary_passed")
+                    # None：双审核并发时复审先 FAIL，主审核被取消未出结论
+                    log_trace_event(trace_id, "AUDIT_PRIMARY", {"passed": bool(primary_passed)} if primary_passed is not None
+                                    else {"passed": None, "skipped": True})
                 if "audit_secondary_passed" in status_block:
                     log_trace_event(trace_id, "AUDIT_SECONDARY", {"passed": bool(status_block.get("audit_secondary_passed"))})
                 if "final_action" in status_block:
@@ -1624,39 +1821,28 @@ async def handler(event):
 
             if 'qa_only_enabled' in locals() and qa_only_enabled:
                 reply = enforce_qa_only(reply, msg)
-            dmin = float(config.get('REPLY_DELAY_MIN_SECONDS', 3.0))
-            dmax = float(config.get('REPLY_DELAY_MAX_SECONDS', 10.0))
-            if dmin > dmax:
-                dmin, dmax = dmax, dmin
-            delay = random.uniform(dmin, dmax)
-            await asyncio.sleep(delay)
-            
-            use_quote = await _should_auto_quote(event, msg, config)
-            if use_quote:
-                await event.reply(reply)
-            else:
-                await client.send_message(event.chat_id, reply)
-            
-            if event.is_private:
-                log_private(f"[trace:{trace_id}] AI_REPLY: {reply}")
-            else:
-                log_group(f"AI_REPLY: {reply}")
-            
-            if orch_enabled:
-                log_trace_event(trace_id, "REPLY_SENT", {"content_len": len(reply)})
-            
-            # 统计成功回复
-            stats['total_replies'] += 1
-            stats['success_count'] += 1
-            save_stats(stats)
+
+            def _sent():
+                if event.is_private:
+                    log_private(f"[trace:{trace_id}] AI_REPLY: {reply}")
+                else:
+                    log_group(f"AI_REPLY: {reply}")
+                
+                if orch_enabled:
+                    log_trace_event(trace_id, "REPLY_SENT", {"content_len": len(reply)})
+                
+                # 统计成功回复
+                stats_counter.incr('total_replies')
+                stats_counter.incr('success_count')
+
+            await _schedule_reply(event, msg, trace_id, config, reply, _sent)
             
         except Exception as e:
             log_system(f"❌ AI 调用失败: {e}")
             if orch_enabled:
                  log_trace_event(trace_id, "ERROR", {"message": str(e)})
             # 统计失败
-            stats['error_count'] += 1
-            save_stats(stats)
+            stats_counter.incr('error_count')
 
 # --- 5. 启动程序 ---
 if __name__ == '__main__':
@@ -1665,4 +1851,16 @@ if __name__ == '__main__':
          log_system("⚠️ [配置警告] SSL验证已开启 (HTTPX_VERIFY_SSL != false)。")
          log_system("   如果遇到连接错误，请在 .env 中设置: HTTPX_VERIFY_SSL=false")
     client.start()
-    client.run_until_disconnected()
+    try:
+        client.run_until_disconnected()
+    finally:
+        log_system("🛑 程序退出")
+        try:
+            # 等待已在发送中的回复收尾，其统计回调要赶在 stats_counter 落盘之前
+            client.loop.run_until_complete(outbound.aclose())
+        except Exception as e:
+            log_system(f"⚠️ 等待待发回复失败: {e}")
+        stats_counter.close()
+        group_cache.close()
+        log_sink.close()
+        ai_clients.close()
@@ -0,0 +1,171 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+
+class OutboundJob:
+    """一条待发送的回复；send_at 为 time.monotonic() 时间"""
+
+    __slots__ = ("chat_id", "text", "send_at", "quote_target", "on_sent", "context", "cancelled", "sent")
+
+    def __init__(self, chat_id, text: str, send_at: float, quote_target=None,
+                 on_sent: Optional[Callable[["OutboundJob", Any], None]] = None, context=None):
+        self.chat_id = chat_id
+        self.text = text
+        self.send_at = send_at
+        self.quote_target = quote_target
+        self.on_sent = on_sent
+        self.context = context
+        self.cancelled = False
+        self.sent = False
+
+
+class OutboundScheduler:
+    """
+    延迟发送调度器：处理流程生成回复后把 (chat_id, reply, send_at, quote_target) 交给调度器即返回，
+    不再在拟人延迟期间占着协程、历史与提示词。调度器用一个按 send_at 排序的小顶堆和单个后台任务到点发送，
+    有待发回复的会话由调度器持续显示“正在输入”，回复可在发出前取消（被新消息取代时）。
+    send(job) 负责实际发送（job.quote_target 为引用目标，None 时直接发送），context 供调用方附带自定义数据。
+    只在事件循环线程内使用。
+    """
+
+    def __init__(self, send: Callable[[OutboundJob], Awaitable[Any]],
+                 typing: Optional[Callable[[Any], Any]] = None,
+                 on_error: Optional[Callable[[OutboundJob, Exception], None]] = None):
+        self._send = send
+        self._typing = typing
+        self._on_error = on_error
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._pending: Dict[Any, int] = {}
+        self._idle: Dict[Any, asyncio.Event] = {}
+        # 事件循环只弱引用任务：“正在输入”与发送任务都在这里持有，直到完成
+        self._tasks: Set[asyncio.Task] = set()
+        self.sent = 0
+        self.cancelled = 0
+        self.failed = 0
+
+    def pending(self, chat_id=None) -> int:
+        if chat_id is None:
+            return sum(self._pending.values())
+        return self._pending.get(chat_id, 0)
+
+    def schedule(self, chat_id, text: str, send_at: float, quote_target=None, on_sent=None, context=None) -> OutboundJob:
+        job = OutboundJob(chat_id, text, send_at, quote_target, on_sent, context)
+        heapq.heappush(self._heap, (send_at, next(self._seq), job))
+        self._pending[chat_id] = self._pending.get(chat_id, 0) + 1
+        if self._typing is not None and chat_id not in self._idle:
+            idle = asyncio.Event()
+            self._idle[chat_id] = idle
+            self._spawn(self._show_typing(chat_id, idle))
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+        else:
+            self._wakeup.set()
+        return job
+
+    def schedule_in(self, chat_id, text: str, delay: float, quote_target=None, on_sent=None, context=None) -> OutboundJob:
+        return self.schedule(chat_id, text, time.monotonic() + max(0.0, delay), quote_target, on_sent, context)
+
+    def cancel_job(self, job: OutboundJob) -> bool:
+        """取消尚未发出的回复；已发出或已取消时返回 False"""
+        if job.cancelled or job.sent:
+            return False
+        job.cancelled = True
+        self.cancelled += 1
+        self._done(job.chat_id)
+        return True
+
+    def cancel(self, chat_id) -> int:
+        """取消某会话所有尚未发出的回复"""
+        return sum(1 for _, _, job in list(self._heap) if job.chat_id == chat_id and self.cancel_job(job))
+
+    async def join(self, poll: float = 0.05):
+        """等待所有待发回复发出或被取消，并等正在发送的任务收尾"""
+        while self._pending or self._tasks:
+            if self._pending:
+                await asyncio.sleep(poll)
+            else:
+                await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    async def aclose(self):
+        """退出时调用：取消尚未到点的回复，等待已在发送中的回复完成"""
+        for _, _, job in list(self._heap):
+            self.cancel_job(job)
+        self._heap.clear()
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        await self.join()
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if task.cancelled():
+            return
+        exc = task.exception()
+        if exc is not None:
+            print(f"⚠️ 回复调度任务异常: {exc!r}")
+
+    def _done(self, chat_id):
+        left = self._pending.get(chat_id, 0) - 1
+        if left > 0:
+            self._pending[chat_id] = left
+            return
+        self._pending.pop(chat_id, None)
+        idle = self._idle.pop(chat_id, None)
+        if idle is not None:
+            idle.set()
+
+    async def _show_typing(self, chat_id, idle: asyncio.Event):
+        try:
+            async with self._typing(chat_id):
+                await idle.wait()
+        except Exception:
+            # “正在输入”只是提示，失败不影响发送
+            await idle.wait()
+
+    async def _run(self):
+        while self._heap:
+            send_at, _, job = self._heap[0]
+            if job.cancelled:
+                heapq.heappop(self._heap)
+                continue
+            delay = send_at - time.monotonic()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            # 发送放到独立任务：一个会话的慢请求不拖住其它会话的到点回复
+            self._spawn(self._deliver(job))
+
+    async def _deliver(self, job: OutboundJob):
+        if job.cancelled:
+            return
+        job.sent = True
+        try:
+            result = await self._send(job)
+            self.sent += 1
+            if job.on_sent is not None:
+                job.on_sent(job, result)
+        except Exception as e:
+            self.failed += 1
+            if self._on_error is not None:
+                self._on_error(job, e)
+            else:
+                print(f"⚠️ 发送回复失败 ({job.chat_id}): {e}")
+        finally:
+            self._done(job.chat_id)
@@ -0,0 +1,170 @@
+import os
+import bisect
+import difflib
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+from aho_corasick import AhoCorasick
+from kb_index import normalize_text, bigram_tokens
+
+
+class QAMatcher:
+    """
+    预编译的 QA 匹配器，与 match_qa_reply 的判定完全一致：
+    按 qa_pairs 顺序返回第一个满足以下任一条件的答案
+      1. 问题与消息互为子串
+      2. 问题 bigram 被消息覆盖比例 >= 0.45
+      3. difflib 相似度 >= 0.5
+    预先归一化问题并计算 bigram 集合；条件 1 用 AC 自动机 + 拼接串查找，条件 2 用 bigram 倒排表计数，
+    条件 3 只对长度可能达到阈值、且排在已命中条目之前的少量候选运行 SequenceMatcher。
+    """
+
+    OVERLAP_THRESHOLD = 0.45
+    RATIO_THRESHOLD = 0.5
+
+    def __init__(self, qa_pairs: List[Tuple[str, str]]):
+        self._answers: List[str] = []
+        self._questions: List[str] = []
+        self._token_counts: List[int] = []
+        self._postings: Dict[str, List[int]] = {}
+        self._char_postings: Dict[str, Set[int]] = {}
+        automaton_patterns: Dict[str, List[int]] = {}
+        for q, a in qa_pairs:
+            if not q:
+                continue
+            norm_q = normalize_text(q)
+            if not norm_q:
+                continue
+            idx = len(self._questions)
+            self._questions.append(norm_q)
+            self._answers.append(a)
+            tokens = bigram_tokens(norm_q)
+            self._token_counts.append(len(tokens))
+            for tok in tokens:
+                self._postings.setdefault(tok, []).append(idx)
+            for ch in set(norm_q):
+                self._char_postings.setdefault(ch, set()).add(idx)
+            automaton_patterns.setdefault(norm_q, []).append(idx)
+        self._automaton = AhoCorasick(automaton_patterns.items())
+        # 所有问题以 \x00 拼接，用于一次性查找“消息是某个问题的子串”
+        self._joined = "\x00".join(self._questions)
+        self._offsets: List[int] = []
+        pos = 0
+        for norm_q in self._questions:
+            self._offsets.append(pos)
+            pos += len(norm_q) + 1
+
+    def __len__(self):
+        return len(self._questions)
+
+    def _first_substring_hit(self, norm_msg: str) -> int:
+        best = len(self._questions)
+        # 问题是消息的子串
+        for _, _, _, indices in self._automaton.finditer(norm_msg):
+            if indices[0] < best:
+                best = indices[0]
+        # 消息是问题的子串
+        start = self._joined.find(norm_msg)
+        while start != -1:
+            idx = bisect.bisect_right(self._offsets, start) - 1
+            if idx < best:
+                best = idx
+            # 跳到下一个问题继续查找
+            nxt = self._offsets[idx + 1] if idx + 1 < len(self._offsets) else len(self._joined)
+            start = self._joined.find(norm_msg, max(nxt, start + 1))
+        return best
+
+    def _first_overlap_hit(self, msg_tokens: Set[str], limit: int) -> int:
+        counts: Dict[int, int] = {}
+        for tok in msg_tokens:
+            for idx in self._postings.get(tok, ()):
+                if idx < limit:
+                    counts[idx] = counts.get(idx, 0) + 1
+        best = limit
+        for idx, c in counts.items():
+            if idx < best and c / max(1, self._token_counts[idx]) >= self.OVERLAP_THRESHOLD:
+                best = idx
+        return best
+
+    def match(self, message_text: str) -> Optional[str]:
+        if not message_text:
+            return None
+        msg = message_text.strip()
+        if not msg:
+            return None
+        norm_msg = normalize_text(msg)
+        if not norm_msg or not self._questions:
+            return None
+        msg_tokens = bigram_tokens(norm_msg)
+
+        best = self._first_substring_hit(norm_msg)
+        best = self._first_overlap_hit(msg_tokens, best)
+
+        # difflib 候选：排在 best 之前、与消息共享字符、且长度满足 2*min/(la+lb) >= 阈值
+        la = len(norm_msg)
+        candidates: Set[int] = set()
+        for ch in set(norm_msg):
+            for idx in self._char_postings.get(ch, ()):
+                if idx < best:
+                    candidates.add(idx)
+        if candidates:
+            sm = difflib.SequenceMatcher(None, "", norm_msg)
+            for idx in sorted(candidates):
+                norm_q = self._questions[idx]
+                lb = len(norm_q)
+                if 2.0 * min(la, lb) / (la + lb) < self.RATIO_THRESHOLD:
+                    continue
+                sm.set_seq1(norm_q)
+                if sm.quick_ratio() < self.RATIO_THRESHOLD:
+                    continue
+                if sm.ratio() >= self.RATIO_THRESHOLD:
+                    best = idx
+                    break
+
+        if best < len(self._questions):
+            return self._answers[best]
+        return None
+
+
+_matcher_cache: Dict[str, Tuple[Optional[Tuple[int, int]], QAMatcher]] = {}
+_matcher_lock = threading.Lock()
+
+
+def get_qa_matcher(file_path: str, loader) -> QAMatcher:
+    """
+    按文件 (mtime, size) 缓存编译好的 QAMatcher；文件未变化时不再读盘与重建
+    loader: 文件路径 -> [(question, answer), ...]，即 main.load_qa_pairs
+    """
+    try:
+        st = os.stat(file_path)
+        sig = (st.st_mtime_ns, st.st_size)
+    except (OSError, TypeError):
+        sig = None
+    with _matcher_lock:
+        cached = _matcher_cache.get(file_path)
+        if cached is not None and cached[0] == sig:
+            return cached[1]
+    matcher = QAMatcher(loader(file_path) if sig is not None else [])
+    with _matcher_lock:
+        _matcher_cache[file_path] = (sig, matcher)
+    return matcher
+
+
+_pairs_cache: Optional[Tuple[tuple, QAMatcher]] = None
+
+
+def get_qa_matcher_for_pairs(qa_pairs) -> QAMatcher:
+    """
+    按 QA 列表内容缓存编译好的 QAMatcher（只保留最近一份）：同一批问答重复调用时不再重新编译。
+    以内容元组为键而非 id，调用方原地修改列表后也会重建
+    """
+    global _pairs_cache
+    key = tuple(tuple(p) for p in (qa_pairs or []))
+    with _matcher_lock:
+        cached = _pairs_cache
+        if cached is not None and cached[0] == key:
+            return cached[1]
+    matcher = QAMatcher(list(key))
+    with _matcher_lock:
+        _pairs_cache = (key, matcher)
+    return matcher
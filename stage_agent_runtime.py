@@ -1,4 +1,4 @@
-from typing import Dict, List
+from typing import Dict, List, Optional
 from datetime import datetime
 import os
 import json
@@ -136,12 +136,13 @@ class StageAgentRuntime:
             "temperature": float((bind.get("default") or {}).get("temperature", 0.7)),
             "matched_rule": {}
         }
-    def route_decision(self, state: Dict, recent_dialog: List[Dict], kb_items: List[Dict]) -> Dict:
+    def route_decision(self, state: Dict, recent_dialog: List[Dict], kb_items: List[Dict], kb_hits: Optional[int] = None) -> Dict:
         last = ""
         if recent_dialog:
             last = recent_dialog[-1].get("content") or ""
         ctx = {
-            "kb_hits": len(kb_items or []),
+            # kb_hits: 调用方已知的阶段分区大小，未提供时按列表计数
+            "kb_hits": kb_hits if kb_hits is not None else len(kb_items or []),
             "msg_len": len(last or ""),
             "intent_score": float(state.get("intent_score", 0.0) or 0.0),
             "risk_level": state.get("risk_level") or "unknown",
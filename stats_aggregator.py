@@ -0,0 +1,140 @@
+import os
+import json
+import atexit
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+COUNTER_FIELDS = ("total_messages", "total_replies", "private_messages", "group_messages",
+                  "success_count", "error_count", "shed_count")
+
+
+def default_stats() -> Dict[str, Any]:
+    stats: Dict[str, Any] = {field: 0 for field in COUNTER_FIELDS}
+    stats["start_time"] = datetime.now().isoformat()
+    stats["last_active"] = None
+    return stats
+
+
+def read_stats(path: str) -> Dict[str, Any]:
+    """
+    读取统计快照（无锁）：文件总是整体替换写入，读到的要么是旧版本要么是新版本，不会是半截内容
+    文件不存在或损坏时返回默认值
+    """
+    stats = default_stats()
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            stats.update(data)
+    except (OSError, ValueError):
+        pass
+    if not stats.get("start_time"):
+        stats["start_time"] = datetime.now().isoformat()
+    return stats
+
+
+def write_stats(path: str, stats: Dict[str, Any]):
+    """原子写入（临时文件 + os.replace）"""
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(stats, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+class StatsAggregator:
+    """
+    进程内统计计数器：处理消息时只在内存中累加，后台线程每 flush_interval 秒把增量合并进 stats.json
+    合并时重新读取文件再加上增量，因此后台“重置统计”或其它进程写入的数据不会被内存中的旧总数覆盖；
+    进程退出时自动 flush；add_flush_hook 注册的附加落盘任务（如缓存统计）也在同一后台线程中执行，不占用事件循环
+    """
+
+    def __init__(self, path: str, flush_interval: float = 5.0):
+        self.path = path
+        self.flush_interval = float(flush_interval)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending: Dict[str, int] = {}
+        self._last_active = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._hooks: List[Callable[[], Any]] = []
+        self.flushes = 0
+        atexit.register(self.close)
+
+    def add_flush_hook(self, hook: Callable[[], Any]):
+        """每次后台 flush 之后（以及 close 时）调用 hook；hook 抛出的异常只打印，不影响统计落盘"""
+        self._hooks.append(hook)
+
+    def incr(self, field: str, n: int = 1):
+        with self._lock:
+            self._pending[field] = self._pending.get(field, 0) + n
+            self._last_active = datetime.now().isoformat()
+        if self._thread is None:
+            self._start()
+
+    def _start(self):
+        with self._flush_lock:
+            if self._thread is None and not self._stop.is_set():
+                self._thread = threading.Thread(target=self._run, name="stats-flush", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"⚠️ 保存统计失败: {e}")
+            self._run_hooks()
+
+    def _run_hooks(self):
+        for hook in list(self._hooks):
+            try:
+                hook()
+            except Exception as e:
+                print(f"⚠️ 统计落盘任务失败: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """文件中的总数加上尚未落盘的增量"""
+        stats = read_stats(self.path)
+        with self._lock:
+            for field, n in self._pending.items():
+                stats[field] = int(stats.get(field, 0) or 0) + n
+            if self._last_active:
+                stats["last_active"] = self._last_active
+        return stats
+
+    def flush(self) -> bool:
+        with self._flush_lock:
+            with self._lock:
+                pending, last_active = self._pending, self._last_active
+                self._pending, self._last_active = {}, None
+            if not pending and not last_active:
+                return False
+            stats = read_stats(self.path)
+            for field, n in pending.items():
+                stats[field] = int(stats.get(field, 0) or 0) + n
+            if last_active:
+                stats["last_active"] = last_active
+            try:
+                write_stats(self.path, stats)
+            except OSError:
+                # 写入失败：增量放回，下次再合并
+                with self._lock:
+                    for field, n in pending.items():
+                        self._pending[field] = self._pending.get(field, 0) + n
+                    self._last_active = self._last_active or last_active
+                raise
+            self.flushes += 1
+            return True
+
+    def close(self):
+        self._stop.set()
+        try:
+            self.flush()
+        except OSError:
+            pass
+        self._run_hooks()
@@ -73,7 +73,7 @@ async def boundary_tests():
     with patch('main.ConversationStateManager') as MockCSM, \
          patch('main.SupervisorAgent') as MockSup, \
          patch('main.StageAgentRuntime') as MockStage, \
-         patch('main.AuditManager') as MockAudit, \
+         patch('main.get_audit_manager') as MockAudit, \
          patch('main.load_kb_entries') as MockLoadKB:
         MockCSM.return_value.get_state.side_effect = ss.get_state
         MockCSM.return_value.update_state.side_effect = ss.update_state
@@ -103,6 +103,7 @@ async def boundary_tests():
         await run_one("'; DROP TABLE users; --")
         # Very short input
         await run_one("嗯?")
+        await main.outbound.join()
     return {"boundary_ran": True}
 
 def db_health():
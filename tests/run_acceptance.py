@@ -158,7 +158,7 @@ async def run_tests():
     with patch('main.ConversationStateManager') as MockCSM, \
          patch('main.SupervisorAgent') as MockSupervisor, \
          patch('main.StageAgentRuntime') as MockStageRuntime, \
-         patch('main.AuditManager') as MockAudit, \
+         patch('main.get_audit_manager') as MockAudit, \
          patch('main.retrieve_kb_context') as MockRetrieveKB, \
          patch('main.db') as MockDB, \
          patch('main.load_kb_entries') as MockLoadKB, \
@@ -235,7 +235,12 @@ async def run_tests():
                  # mock_event.reply.assert_called_with("👨‍💻 正在为您转接人工客服，请稍候...")
                  pass
 
+        # 回复由延迟发送调度器到点发出，等待全部发完再生成报告
+        await main.outbound.join()
+
     print("✅ Tests Execution Completed.")
+    # 追踪日志由后台线程批量写入，生成报告前先落盘
+    main.log_sink.flush()
     print("📊 Generating Report...")
     generate_report()
 
@@ -0,0 +1,72 @@
+import os
+import sys
+import asyncio
+import unittest
+
+sys.path.append(os.path.dirname(__file__) + "/..")
+from admission import (AdmissionController, AdmissionRejected, PRIORITY_PRIVATE, PRIORITY_MENTION,
+                       PRIORITY_KEYWORD, PRIORITY_CONTEXT)
+
+
+class AdmissionControllerTests(unittest.TestCase):
+    def test_concurrency_cap_and_priority_order(self):
+        order = []
+
+        async def job(ctrl, name, priority, hold):
+            ticket = await ctrl.acquire(priority)
+            order.append(name)
+            await asyncio.sleep(hold)
+            ticket.release()
+            ticket.release()  # 重复释放无副作用
+
+        async def main():
+            ctrl = AdmissionController(max_concurrent=1, max_queue=10)
+            first = asyncio.ensure_future(job(ctrl, "first", PRIORITY_CONTEXT, 0.05))
+            await asyncio.sleep(0.01)
+            jobs = [asyncio.ensure_future(job(ctrl, n, p, 0.0)) for n, p in
+                    (("ctx", PRIORITY_CONTEXT), ("kw", PRIORITY_KEYWORD), ("pm", PRIORITY_PRIVATE), ("at", PRIORITY_MENTION))]
+            await asyncio.sleep(0.01)
+            self.assertEqual(ctrl.active, 1)
+            self.assertEqual(ctrl.queue_depth, 4)
+            await asyncio.gather(first, *jobs)
+            self.assertEqual(ctrl.active, 0)
+
+        asyncio.run(main())
+        self.assertEqual(order, ["first", "pm", "at", "kw", "ctx"])
+
+    def test_full_queue_sheds_lowest_priority(self):
+        async def main():
+            ctrl = AdmissionController(max_concurrent=1, max_queue=1)
+            held = await ctrl.acquire(PRIORITY_PRIVATE)
+            low = asyncio.ensure_future(ctrl.acquire(PRIORITY_CONTEXT))
+            await asyncio.sleep(0)
+            # 队列已满：同级或更低优先级直接拒绝
+            with self.assertRaises(AdmissionRejected):
+                await ctrl.acquire(PRIORITY_CONTEXT)
+            # 更高优先级挤掉队尾
+            high = asyncio.ensure_future(ctrl.acquire(PRIORITY_MENTION))
+            await asyncio.sleep(0)
+            with self.assertRaises(AdmissionRejected) as cm:
+                await low
+            self.assertTrue(cm.exception.evicted)
+            held.release()
+            ticket = await high
+            self.assertEqual(ticket.priority, PRIORITY_MENTION)
+            ticket.release()
+            self.assertEqual(ctrl.shed, 2)
+
+            # 排队中被取消的请求不占用槽位
+            held = await ctrl.acquire(PRIORITY_PRIVATE)
+            waiting = asyncio.ensure_future(ctrl.acquire(PRIORITY_KEYWORD))
+            await asyncio.sleep(0)
+            waiting.cancel()
+            await asyncio.sleep(0)
+            self.assertEqual(ctrl.queue_depth, 0)
+            held.release()
+            self.assertEqual(ctrl.active, 0)
+
+        asyncio.run(main())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import sys
+import asyncio
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(__file__) + "/..")
+from ai_client_pool import AIClientRegistry
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class AIClientRegistryTests(unittest.TestCase):
+    def test_clients_are_shared_by_key(self):
+        reg = AIClientRegistry()
+        a = reg.openai_client("http://127.0.0.1:9/v1", "k1", verify=True, timeout=30.0)
+        self.assertIs(reg.openai_client("http://127.0.0.1:9/v1", "k1", verify=True, timeout=30.0), a)
+        b = reg.openai_client("http://127.0.0.1:9/v1", "k2", verify=True, timeout=30.0)
+        self.assertIsNot(b, a)
+        # 同一 (verify, timeout) 的 OpenAI 客户端共用一个 httpx 连接池
+        self.assertIs(reg.http_client(True, 30.0), reg.http_client(True, 30.0))
+        self.assertIsNot(reg.http_client(False, 30.0), reg.http_client(True, 30.0))
+        m = reg.metrics()
+        self.assertEqual((m["client_hits"], m["client_misses"], m["openai_clients"]), (1, 2, 2))
+        asyncio.run(reg.aclose())
+        self.assertEqual(reg.metrics()["http_clients"], 0)
+
+    def test_connection_reuse_is_counted(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _KeepAliveHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/"
+        reg = AIClientRegistry()
+
+        events = []
+
+        async def main():
+            for _ in range(5):
+                resp = await reg.http_client(True, 5.0).get(url)
+                self.assertEqual(resp.text, "ok")
+            # 调用方自带的 trace 回调仍会收到事件
+            await reg.http_client(True, 5.0).get(url, extensions={"trace": lambda name, info: events.append(name)})
+            await reg.aclose()
+
+        try:
+            asyncio.run(main())
+        finally:
+            server.shutdown()
+            server.server_close()
+        m = reg.metrics()
+        self.assertEqual(m["requests"], 6)
+        self.assertEqual(m["connections_opened"], 1)
+        self.assertAlmostEqual(m["connection_reuse_ratio"], 0.8333)
+        self.assertIn("http11.send_request_headers.started", events)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import unittest
+from unittest.mock import AsyncMock, MagicMock, PropertyMock, patch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audit_manager import AuditManager, RemoteAuditor
+from auditor import Auditor, AuditResult
+
+
+def _mock_client(content):
+    client = MagicMock()
+    resp = MagicMock()
+    resp.choices = [MagicMock(message=MagicMock(content=content))]
+    resp.usage = MagicMock(prompt_tokens=3, completion_tokens=2, total_tokens=5)
+    client.chat.completions.create = AsyncMock(return_value=resp)
+    return client
+
+
+class AuditManagerServiceTests(unittest.TestCase):
+    def test_auditors_rebuilt_only_when_mode_or_servers_change(self):
+        cfg = {"AUDIT_MODE": "local"}
+        am = AuditManager(config_loader=lambda: cfg)
+        local = am.auditor_primary
+        self.assertIsInstance(local, Auditor)
+        am.refresh()
+        self.assertIs(am.auditor_primary, local)
+
+        cfg.update(AUDIT_MODE="dual", AUDIT_SERVERS="http://a:1")
+        am.refresh()
+        remote = am.auditor_secondary
+        self.assertIsInstance(remote, RemoteAuditor)
+        self.assertIs(am.auditor_primary, local)
+        am.refresh()
+        self.assertIs(am.auditor_secondary, remote)
+
+        cfg["AUDIT_SERVERS"] = "http://a:1,http://b:2"
+        am.refresh()
+        self.assertIsNot(am.auditor_secondary, remote)
+        self.assertEqual(am.auditor_secondary.server_urls, ["http://a:1", "http://b:2"])
+
+        cfg["AUDIT_MODE"] = "local"
+        am.refresh()
+        self.assertIsNone(am.auditor_secondary)
+        self.assertIs(am.auditor_primary, local)
+
+    def test_client_and_model_are_per_call(self):
+        am = AuditManager(None, "default-model", config_loader=lambda: {"AUDIT_ENABLED": "False"})
+        client = _mock_client("你好")
+        res = asyncio.run(am.generate_with_audit([{"role": "user", "content": "hi"}], "hi", [],
+                                                 ai_client=client, model_name="stage-model"))
+        self.assertEqual(res["content"], "你好")
+        self.assertEqual(res["usage"]["model"], "stage-model")
+        self.assertEqual(client.chat.completions.create.call_args.kwargs["model"], "stage-model")
+
+    def test_audit_prompt_hot_reload(self):
+        client = _mock_client('{"status": "PASS", "reason": "ok"}')
+        now = [0.0]
+        auditor = Auditor(client=client, model_name="m", check_interval=1.0, clock=lambda: now[0])
+        with tempfile.TemporaryDirectory() as tmp:
+            auditor.prompt_path = os.path.join(tmp, "audit_prompt.txt")
+            with open(auditor.prompt_path, "w", encoding="utf-8") as f:
+                f.write("v1")
+            auditor.system_prompt = auditor._load_prompt()
+            with open(auditor.prompt_path, "w", encoding="utf-8") as f:
+                f.write("v2 longer")
+
+            asyncio.run(auditor.audit_content("q", "a", []))
+            sent = client.chat.completions.create.call_args.kwargs["messages"][0]["content"]
+            self.assertEqual(sent, "v1")  # 检查间隔内不 stat
+
+            now[0] = 2.0
+            result = asyncio.run(auditor.audit_content("q", "a", []))
+            sent = client.chat.completions.create.call_args.kwargs["messages"][0]["content"]
+            self.assertEqual(sent, "v2 longer")
+            self.assertTrue(result.approved)
+
+
+
+class _SlowAuditor:
+    def __init__(self, delay, status):
+        self.delay = delay
+        self.status = status
+        self.cancelled = False
+
+    async def audit_content(self, user_input, draft_reply, history):
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return AuditResult(self.status, "", "")
+
+
+class _FakeResponse:
+    def __init__(self, data):
+        self._data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._data
+
+
+class DualAuditConcurrencyTests(unittest.TestCase):
+    def _run(self, primary, secondary):
+        am = AuditManager(_mock_client("草稿"), "m", config_loader=lambda: {
+            "AUDIT_ENABLED": "True", "AUDIT_MODE": "dual", "AUDIT_SERVERS": "http://a:1"})
+        am.auditor_primary, am.auditor_secondary = primary, secondary
+        t0 = time.perf_counter()
+        res = asyncio.run(am.generate_with_audit([{"role": "user", "content": "hi"}], "hi", []))
+        return res, time.perf_counter() - t0
+
+    def test_auditors_run_concurrently_and_fail_cancels_the_other(self):
+        res, elapsed = self._run(_SlowAuditor(0.2, "PASS"), _SlowAuditor(0.2, "PASS"))
+        self.assertLess(elapsed, 0.35)
+        self.assertEqual(res["status"]["final_action"], "send_normal")
+
+        primary = _SlowAuditor(1.0, "PASS")
+        res, elapsed = self._run(primary, _SlowAuditor(0.05, "FAIL"))
+        self.assertLess(elapsed, 0.5)
+        self.assertTrue(primary.cancelled)
+        self.assertEqual(res["status"]["final_action"], "send_safe_reply")
+        self.assertIsNone(res["status"]["audit_primary_passed"])  # 被取消，未执行
+        self.assertFalse(res["status"]["audit_secondary_passed"])
+
+        # 主审核先 FAIL：主审核结论照常记录，被取消的复审与串行流程一致记为 True
+        secondary = _SlowAuditor(1.0, "PASS")
+        res, _ = self._run(_SlowAuditor(0.05, "FAIL"), secondary)
+        self.assertTrue(secondary.cancelled)
+        self.assertIs(res["status"]["audit_primary_passed"], False)
+        self.assertTrue(res["status"]["audit_secondary_passed"])
+        self.assertEqual(res["status"]["final_action"], "send_safe_reply")
+
+    def test_remote_hedges_to_next_server(self):
+        remote = RemoteAuditor("http://slow:1,http://fast:2", hedge_delay=0.05)
+        client = MagicMock()
+
+        async def post(url, **kwargs):
+            if "slow" in url:
+                await asyncio.sleep(1.0)
+            return _FakeResponse({"status": "PASS"})
+
+        client.post = post
+        with patch.object(RemoteAuditor, "client", new_callable=PropertyMock, return_value=client):
+            t0 = time.perf_counter()
+            result = asyncio.run(remote.audit_content("q", "a", []))
+        self.assertLess(time.perf_counter() - t0, 0.5)
+        self.assertTrue(result.approved)
+        self.assertEqual(remote.last_ok_url, "http://fast:2")
+
+
+if __name__ == "__main__":
+    unittest.main()
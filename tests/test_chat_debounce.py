@@ -0,0 +1,100 @@
+import os
+import sys
+import asyncio
+import unittest
+
+sys.path.append(os.path.dirname(__file__) + "/..")
+from chat_debounce import ChatDebouncer, mark_batch_sent, defer_batch
+
+
+class ChatDebouncerTests(unittest.TestCase):
+    def test_messages_within_window_are_merged(self):
+        runs = []
+
+        async def runner(items):
+            runs.append(list(items))
+
+        async def main():
+            deb = ChatDebouncer()
+            for text in ("a", "b", "c"):
+                deb.submit(1, text, 0.05, runner)
+                await asyncio.sleep(0.01)
+            deb.submit(2, "x", 0.05, runner)
+            await asyncio.sleep(0.2)
+            self.assertEqual(deb.pending(1), 0)
+            self.assertEqual(deb.merged, 2)
+
+        asyncio.run(main())
+        self.assertEqual(sorted(runs), [["a", "b", "c"], ["x"]])
+
+    def test_new_message_cancels_unsent_generation(self):
+        started, finished = [], []
+
+        async def runner(items):
+            started.append(list(items))
+            await asyncio.sleep(0.1)
+            mark_batch_sent()
+            finished.append(list(items))
+
+        async def main():
+            deb = ChatDebouncer()
+            deb.submit(1, "a", 0.02, runner)
+            await asyncio.sleep(0.05)  # 第一次生成已开始但尚未发送
+            deb.submit(1, "b", 0.02, runner)
+            await asyncio.sleep(0.2)
+            self.assertEqual(deb.cancelled, 1)
+            # 已发送后的新消息开启新批次，不取消已发出的回复
+            deb.submit(1, "c", 0.02, runner)
+            await asyncio.sleep(0.2)
+
+        asyncio.run(main())
+        self.assertEqual(started, [["a"], ["a", "b"], ["c"]])
+        self.assertEqual(finished, [["a", "b"], ["c"]])
+
+    def test_deferred_reply_is_withdrawn_by_new_message(self):
+        runs, withdrawn, batches = [], [], []
+
+        async def runner(items):
+            runs.append(list(items))
+            # 回复交给延迟发送后 runner 立即返回，批次在真正发出前保持打开
+            batches.append(defer_batch(lambda: withdrawn.append(list(items))))
+
+        async def main():
+            deb = ChatDebouncer()
+            deb.submit(1, "a", 0.01, runner)
+            await asyncio.sleep(0.05)
+            deb.submit(1, "b", 0.01, runner)
+            await asyncio.sleep(0.05)
+            mark_batch_sent(batches[-1])
+            deb.submit(1, "c", 0.01, runner)
+            await asyncio.sleep(0.05)
+
+        asyncio.run(main())
+        self.assertEqual(runs, [["a"], ["a", "b"], ["c"]])
+        self.assertEqual(withdrawn, [["a"]])
+
+    def test_batches_are_released_after_flush(self):
+        batches = []
+
+        async def immediate(items):
+            mark_batch_sent()
+
+        async def deferred(items):
+            batches.append(defer_batch(lambda: None))
+
+        async def main():
+            deb = ChatDebouncer()
+            for chat_id in range(5):
+                deb.submit(chat_id, "a", 0.01, immediate)
+            deb.submit("later", "b", 0.01, deferred)
+            await asyncio.sleep(0.05)
+            # 延迟发送的回复尚未发出：批次保留，以便新消息撤回
+            self.assertEqual(list(deb._batches), ["later"])
+            mark_batch_sent(batches[-1])
+            self.assertEqual(deb._batches, {})
+
+        asyncio.run(main())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import sys
+import unittest
+from collections import namedtuple
+from datetime import datetime
+
+sys.path.append(os.path.dirname(__file__) + "/..")
+from chat_history import ChatHistoryBuffer
+
+Msg = namedtuple("Msg", ["id", "out", "text", "date"])
+
+
+class ChatHistoryBufferTests(unittest.TestCase):
+    def test_history_before_max_id_in_order(self):
+        buf = ChatHistoryBuffer(per_chat=4)
+        for i in (3, 1, 2, 5, 4, 6):
+            buf.add(100, i, i % 2 == 0, f"m{i}")
+        # 每个会话只保留最近 4 条（按 id）
+        self.assertEqual([h["content"] for h in buf.history(100, limit=8)], ["m3", "m4", "m5", "m6"])
+        self.assertEqual(buf.history(100, limit=2, max_id=6),
+                         [{"role": "assistant", "content": "m4"}, {"role": "user", "content": "m5"}])
+        self.assertEqual(buf.previous(100, max_id=5).text, "m4")
+        self.assertIsNone(buf.previous(100, max_id=3))
+        # 同一 id 重复写入（发送结果 + outgoing 事件）只保留一条
+        buf.add(100, 6, False, "m6")
+        self.assertEqual(len(buf.history(100, limit=8)), 4)
+
+    def test_lru_eviction_and_backfill(self):
+        buf = ChatHistoryBuffer(max_chats=2)
+        buf.add("a", 1, False, "a1")
+        buf.add("b", 1, False, "b1")
+        self.assertTrue(buf.needs_backfill("a"))
+        now = datetime(2026, 1, 1)
+        buf.seed("a", [Msg(0, True, "a0", now), Msg(1, False, "a1", now), Msg(2, False, "", now)])
+        self.assertFalse(buf.needs_backfill("a"))
+        self.assertEqual([h["content"] for h in buf.history("a")], ["a0", "a1"])
+        # b 最久未访问，新会话 c 进入后被淘汰；a 保留回填标记
+        buf.add("c", 1, False, "c1")
+        self.assertEqual(buf.history("b"), [])
+        self.assertFalse(buf.needs_backfill("a"))
+        self.assertEqual(len(buf), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(__file__) + "/..")
+from config_registry import ConfigRegistry
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class ConfigRegistryTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "config.txt")
+        self.clock = FakeClock()
+        self.parsed = []
+        self.registry = ConfigRegistry(check_interval_ms=500, clock=self.clock)
+        self.registry.register("config", self.path, self._parse)
+
+    def _parse(self, path):
+        self.parsed.append(path)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return dict(line.strip().split("=", 1) for line in f if "=" in line)
+        except FileNotFoundError:
+            return {"MODE": "default"}
+
+    def _write(self, text):
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def test_reload_only_when_signature_changes(self):
+        self.assertEqual(self.registry.get("config"), {"MODE": "default"})
+        self._write("MODE=on\n")
+        # 检查间隔内直接返回内存快照
+        self.clock.now += 0.1
+        self.assertEqual(self.registry.get("config"), {"MODE": "default"})
+        self.clock.now += 0.5
+        self.assertEqual(self.registry.get("config"), {"MODE": "on"})
+        # 文件未变化：到期只 stat，不重新解析
+        self.clock.now += 1.0
+        snapshot = self.registry.get("config")
+        self.assertIs(snapshot, self.registry.get("config"))
+        self.assertEqual(len(self.parsed), 2)
+
+        self._write("MODE=off,extra\n")
+        self.clock.now += 1.0
+        self.assertEqual(self.registry.get("config"), {"MODE": "off,extra"})
+        os.remove(self.path)
+        self.clock.now += 1.0
+        self.assertEqual(self.registry.get("config"), {"MODE": "default"})
+        self.assertEqual(len(self.parsed), 4)
+
+    def test_invalidate_forces_reparse(self):
+        self._write("MODE=on\n")
+        self.assertEqual(self.registry.get("config"), {"MODE": "on"})
+        # 同样长度的内容在同一时间片内写入：签名可能不变，invalidate 后仍立即生效
+        self._write("MODE=no\n")
+        self.registry.invalidate("config")
+        self.assertEqual(self.registry.get("config"), {"MODE": "no"})
+        self.assertEqual(self.registry.reloads, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import sys
+import json
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(__file__) + "/..")
+from group_cache import GroupCache
+
+
+class GroupCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "group_cache.json")
+
+    def _read(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def test_touch_granularity_coalesces_writes(self):
+        cache = GroupCache(self.path, flush_interval=3600)
+        t0 = datetime(2026, 1, 1, 12, 0, 0)
+        self.assertTrue(cache.record("-100", "Alpha", 60, now=t0))
+        # 粒度内的重复消息不产生写入
+        for s in range(1, 60):
+            self.assertFalse(cache.record("-100", "Alpha", 60, now=t0 + timedelta(seconds=s)))
+        self.assertTrue(cache.flush())
+        self.assertFalse(cache.flush())
+        self.assertEqual(self._read()["-100"], {"title": "Alpha", "last_seen": t0.isoformat()})
+
+        # 标题变化立即标脏；last_seen 超过粒度才前移
+        self.assertTrue(cache.record("-100", "Alpha 2", 60, now=t0 + timedelta(seconds=10)))
+        self.assertTrue(cache.record("-100", "", 60, now=t0 + timedelta(seconds=80)))
+        cache.close()
+        self.assertEqual(self._read()["-100"]["title"], "Alpha 2")
+        self.assertEqual(self._read()["-100"]["last_seen"], (t0 + timedelta(seconds=80)).isoformat())
+
+    def test_loads_existing_file(self):
+        t0 = datetime(2026, 1, 1, 12, 0, 0)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"-200": {"title": "Beta", "last_seen": t0.isoformat()}}, f)
+        cache = GroupCache(self.path, flush_interval=3600)
+        self.assertEqual(cache.get("-200")["title"], "Beta")
+        self.assertFalse(cache.record("-200", "Beta", 60, now=t0 + timedelta(seconds=30)))
+        self.assertIsNone(cache.get("-300"))
+        cache.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,6 @@
 import os
+import random
+import difflib
 import unittest
 import json
 from datetime import datetime
@@ -9,6 +11,35 @@ import sys
 sys.path.append(os.path.dirname(__file__) + "/..")
 
 from main import load_kb_entries, retrieve_kb_context, load_qa_pairs, match_qa_reply
+from kb_cache import QueryCache
+
+
+def _linear_scan_kb(query_text, kb_items, topn=2):
+    """倒排索引之前 retrieve_kb_context 的逐条扫描实现，作为 KBIndex.search 的对照"""
+    from kb_index import normalize_text, bigram_tokens
+    norm_q = normalize_text(query_text)
+    if not norm_q:
+        return []
+    q_tokens = bigram_tokens(norm_q)
+    scored = []
+    for it in kb_items:
+        title = normalize_text(it.get("title", "") or "")
+        content = normalize_text(it.get("content", "") or "")
+        if not title and not content:
+            continue
+        title_overlap = len(q_tokens & bigram_tokens(title)) / max(1, len(q_tokens))
+        content_overlap = len(q_tokens & bigram_tokens(content)) / max(1, len(q_tokens))
+        bonus = 0.0
+        if norm_q in title or title in norm_q:
+            bonus += 0.6
+        if norm_q in content or content in norm_q:
+            bonus += 0.3
+        base = 2.0 * title_overlap + 1.0 * content_overlap + bonus
+        if base == 0.0:
+            base = difflib.SequenceMatcher(None, norm_q, title + content).ratio() * 0.5
+        scored.append((base, it))
+    scored.sort(key=lambda x: x[0], reverse=True)
+    return [it for _, it in scored[:max(1, topn)]]
 
 
 class KnowledgeBaseTests(unittest.TestCase):
@@ -60,6 +91,311 @@ class KnowledgeBaseTests(unittest.TestCase):
         self.assertEqual(items[0]["id"], "t1")
         self.assertEqual(items[0]["title"], "黄金卡尊享版")
 
+    @patch("main.db")
+    def test_load_kb_entries_snapshot(self, mock_db):
+        import main
+        main._kb_snapshot["items"] = None
+        mock_db.get_kb_version.return_value = 7
+        mock_db.get_kb_items.return_value = [dict(it) for it in self.db_items]
+
+        first = load_kb_entries()
+        second = load_kb_entries()
+        self.assertIs(first, second)
+        self.assertEqual(mock_db.get_kb_items.call_count, 1)
+
+        # 其它进程写入知识库后版本号递增，快照失效
+        mock_db.get_kb_version.return_value = 8
+        mock_db.get_kb_items.return_value = [dict(it) for it in self.db_items[:1]]
+        third = load_kb_entries()
+        self.assertIsNot(third, first)
+        self.assertEqual(len(third), 1)
+        main._kb_snapshot["items"] = None
+
+    def test_bulk_import_kb_items(self):
+        import tempfile
+        from database import DatabaseManager
+        tmp_dir = tempfile.mkdtemp()
+        mgr = DatabaseManager(os.path.join(tmp_dir, "kb.db"))
+        ts = datetime.now().isoformat()
+
+        def rows(n, fail_at=None):
+            for i in range(n):
+                if i == fail_at:
+                    raise ValueError("parse error")
+                yield {"id": f"b{i}", "tenant_id": "default", "title": f"标题{i}", "category": "qa",
+                       "tags": "[]", "content": f"内容{i}", "source_file": "", "created_at": ts, "updated_at": ts}
+
+        seen = []
+        total = mgr.bulk_import_kb_items("default", rows(1200), batch_size=500, progress=seen.append)
+        self.assertEqual(total, 1200)
+        self.assertEqual(seen, [500, 1000, 1200])
+        self.assertEqual(len(mgr.get_kb_items("default")), 1200)
+
+        # 解析中途失败：清空与写入一起回滚，旧数据保留
+        with self.assertRaises(ValueError):
+            mgr.bulk_import_kb_items("default", rows(800, fail_at=600), replace=True, batch_size=500)
+        self.assertEqual(len(mgr.get_kb_items("default")), 1200)
+
+        mgr.bulk_import_kb_items("default", rows(3), replace=True)
+        self.assertEqual(len(mgr.get_kb_items("default")), 3)
+
+    def test_sync_kb_items(self):
+        import tempfile
+        from database import DatabaseManager
+        tmp_dir = tempfile.mkdtemp()
+        mgr = DatabaseManager(os.path.join(tmp_dir, "kb.db"))
+        src = "platforms/telegram/qa.txt"
+        ts = datetime.now().isoformat()
+
+        def rows(pairs):
+            return [{"title": t, "category": "qa_txt", "tags": "[]", "content": c, "source_file": src,
+                     "created_at": ts, "updated_at": ts} for t, c in pairs]
+
+        mgr.add_kb_item({"id": "manual", "tenant_id": "default", "title": "手动条目", "category": "manual",
+                         "tags": "[]", "content": "后台添加", "source_file": "", "created_at": ts, "updated_at": ts})
+        stats = mgr.sync_kb_items("default", rows([("价格", "99 元"), ("流程", "先提交资料"), ("时效", "三个月")]), [src])
+        self.assertEqual(stats, {"added": 3, "updated": 0, "deleted": 0, "unchanged": 0})
+        ids = {it["title"]: it["id"] for it in mgr.get_kb_items("default")}
+
+        # 无变化：不写库，版本号不变
+        version = mgr.get_kb_version("default")
+        stats = mgr.sync_kb_items("default", rows([("价格", "99 元"), ("流程", "先提交资料"), ("时效", "三个月")]), [src])
+        self.assertEqual(stats["unchanged"], 3)
+        self.assertEqual(mgr.get_kb_version("default"), version)
+
+        # 改一条、删一条、加一条：被修改的条目保留原 id，手动条目不受影响
+        stats = mgr.sync_kb_items("default", rows([("价格", "199 元"), ("流程", "先提交资料"), ("费用", "另计")]), [src])
+        self.assertEqual(stats, {"added": 1, "updated": 1, "deleted": 1, "unchanged": 1})
+        after = {it["title"]: it for it in mgr.get_kb_items("default")}
+        self.assertEqual(after["价格"]["id"], ids["价格"])
+        self.assertEqual(after["价格"]["content"], "199 元")
+        self.assertEqual(after["流程"]["id"], ids["流程"])
+        self.assertNotIn("时效", after)
+        self.assertIn("手动条目", after)
+
+    def test_search_kb_fts(self):
+        import tempfile
+        from database import DatabaseManager
+        mgr = DatabaseManager(os.path.join(tempfile.mkdtemp(), "kb.db"))
+        for it in self.db_items:
+            row = dict(it, tenant_id="default", tags=json.dumps(it["tags"], ensure_ascii=False))
+            mgr.add_kb_item(row)
+
+        self.assertEqual([r["id"] for r in mgr.search_kb("default", "资金来源审计", 2)], ["t1"])
+        self.assertEqual([r["id"] for r in mgr.search_kb("default", "审计 豁免", 5, tags=["逾期"])], ["t2"])
+        self.assertEqual(mgr.search_kb("other", "资金来源审计", 2), [])
+
+        # 写方法同步维护索引：更新后按新内容命中，删除后不再命中
+        mgr.update_kb_item("t2", {"content": "逾期案件同样需要资金来源审计。"})
+        self.assertEqual({r["id"] for r in mgr.search_kb("default", "资金来源审计", 5)}, {"t1", "t2"})
+        mgr.delete_kb_item("t1")
+        self.assertEqual([r["id"] for r in mgr.search_kb("default", "资金来源审计", 5)], ["t2"])
+
+        # 已有数据库首次启用时回填索引
+        mgr.execute_update("DELETE FROM kb_fts")
+        reopened = DatabaseManager(mgr.db_path)
+        self.assertEqual([r["id"] for r in reopened.search_kb("default", "逾期", 5)], ["t2"])
+
+    def test_search_kb_fts_survives_rowid_renumbering(self):
+        import sqlite3
+        import tempfile
+        from database import DatabaseManager
+        mgr = DatabaseManager(os.path.join(tempfile.mkdtemp(), "kb.db"))
+        topics = ["签证办理", "资金来源审计", "逾期豁免", "服务费用", "材料清单"]
+        for i, topic in enumerate(topics):
+            mgr.add_kb_item({"id": f"k{i}", "tenant_id": "default", "title": topic, "category": "manual",
+                             "tags": "[]", "content": f"{topic}的详细说明", "source_file": "",
+                             "created_at": "2024-01-01", "updated_at": "2024-01-01"})
+        mgr.delete_kb_item("k0")
+        mgr.delete_kb_item("k2")
+        # VACUUM 可能重新编号 TEXT 主键表的隐式 rowid：这里直接改写 rowid 模拟（倒序，保证与原编号错位）
+        conn = sqlite3.connect(mgr.db_path)
+        conn.execute("UPDATE knowledge_base SET rowid = 100 - rowid")
+        conn.commit()
+        conn.execute("VACUUM")
+        conn.close()
+        for i in (1, 3, 4):
+            self.assertEqual([r["id"] for r in mgr.search_kb("default", topics[i], 1)], [f"k{i}"])
+
+        # 旧版索引（无映射表、按 knowledge_base.rowid 关联）在启动时重建
+        mgr.execute_update("DROP TABLE kb_fts_ids")
+        reopened = DatabaseManager(mgr.db_path)
+        self.assertEqual([r["id"] for r in reopened.search_kb("default", topics[3], 1)], ["k3"])
+
+    def test_kb_index_matches_linear_scan(self):
+        from kb_index import KBIndex
+        rng = random.Random(20240601)
+        alphabet = "资金来源审计逾期豁免签证办理费用材料ab1 "
+
+        def text(lo, hi):
+            return "".join(rng.choice(alphabet) for _ in range(rng.randint(lo, hi)))
+
+        for _ in range(20):
+            items = [{"id": f"i{k}", "title": text(0, 6), "content": text(0, 30)} for k in range(rng.randint(1, 60))]
+            index = KBIndex(items)
+            for _ in range(50):
+                query, topn = text(1, 12), rng.randint(1, 5)
+                self.assertEqual([it["id"] for it in index.search(query, topn)],
+                                 [it["id"] for it in _linear_scan_kb(query, items, topn)], (query, topn))
+
+    def test_stage_partitions(self):
+        from kb_index import KBStagePartitions
+        items = [
+            {"id": "g1", "title": "通用说明", "tags": [], "content": "资金来源审计的通用要求。"},
+            {"id": "s1", "title": "S1 审计", "tags": ["S1"], "content": "第一阶段需要资金来源审计。"},
+            {"id": "a1", "title": "全阶段", "tags": ["all", "S2"], "content": "所有阶段都适用的背调流程。"},
+            {"id": "s2", "title": "S2 背调", "tags": ["S2", "S1"], "content": "第二阶段进行背调。"},
+        ]
+        parts = KBStagePartitions(items)
+        for stage in ("S0", "S1", "S2"):
+            expected = [it for it in items
+                        if (not it["tags"]) or ("all" in it["tags"]) or ("global" in it["tags"]) or (stage in it["tags"])]
+            scoped = parts.items_for(stage)
+            self.assertEqual(scoped, expected)
+            self.assertIs(parts.items_for(stage), scoped)
+            self.assertEqual(parts.size(stage), len(expected))
+            self.assertEqual(parts.search("资金来源审计", stage, topn=2),
+                             retrieve_kb_context("资金来源审计", expected, topn=2, engine="bigram"))
+        ids = [it["id"] for it in parts.search("资金来源审计", "S0", topn=5)]
+        self.assertEqual(ids[0], "g1")
+        self.assertNotIn("s1", ids)
+
+    def test_query_cache_lru_ttl(self):
+        from kb_cache import QueryCache
+        now = [0.0]
+        cache = QueryCache(maxsize=2, ttl=10, clock=lambda: now[0])
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), (True, 1))
+        cache.put("c", 3)  # 淘汰最久未使用的 b
+        self.assertEqual(cache.get("b"), (False, None))
+        now[0] = 11
+        self.assertEqual(cache.get("a"), (False, None))
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["evictions"], stats["expired"]), (1, 2, 1, 1))
+
+    def test_cache_stats_writer_skips_unchanged(self):
+        import tempfile
+        from kb_cache import QueryCache, CacheStatsWriter, read_cache_stats
+        cache = QueryCache(maxsize=2)
+        path = os.path.join(tempfile.mkdtemp(), "kb_cache_stats.json")
+        writer = CacheStatsWriter(path, cache.stats)
+        self.assertFalse(writer())
+        self.assertFalse(os.path.exists(path))
+        cache.get("a")
+        self.assertTrue(writer())
+        self.assertEqual(read_cache_stats(path)["misses"], 1)
+        self.assertFalse(writer())
+
+    # 换成独立的缓存对象：后台统计落盘只观察模块原有的缓存，测试中的命中不会写入仓库目录
+    @patch("main._kb_query_cache", QueryCache(maxsize=1024, ttl=300.0))
+    @patch("main.db")
+    def test_retrieve_kb_context_cached(self, mock_db):
+        import main
+        main._kb_snapshot["items"] = None
+        mock_db.get_kb_version.return_value = 3
+        mock_db.get_kb_items.return_value = [dict(it) for it in self.db_items]
+        items = load_kb_entries()
+
+        hits_before = main._kb_query_cache.hits
+        first = retrieve_kb_context("资金来源审计？", items, topn=1, engine="bigram")
+        with patch.object(main, "_retrieve_kb_uncached") as uncached:
+            # 标点/空白不同但归一化后相同的问题直接命中缓存
+            second = retrieve_kb_context(" 资金来源 审计", items, topn=1, engine="bigram")
+            uncached.assert_not_called()
+        self.assertEqual(second, first)
+        self.assertEqual(main._kb_query_cache.hits, hits_before + 1)
+
+        # 知识库版本变化后不再复用旧结果
+        mock_db.get_kb_version.return_value = 4
+        items = load_kb_entries()
+        with patch.object(main, "_retrieve_kb_uncached", return_value=[]) as uncached:
+            retrieve_kb_context("资金来源审计", items, topn=1, engine="bigram")
+            uncached.assert_called_once()
+        main._kb_snapshot["items"] = None
+
+    def test_dense_cache_key_uses_normalized_text(self):
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            self.skipTest("numpy not installed")
+        import tempfile
+        import main
+        from kb_index import DenseIndex, bm25_terms
+        rows = [
+            {"id": "1", "tenant_id": "default", "title": "价格", "content": "格多", "tags": "[]"},
+            {"id": "2", "tenant_id": "default", "title": "价格多少", "content": "价格多", "tags": "[]"},
+        ]
+        warm, query = "价格，格多", "价格多"
+        # 两个查询的 bm25 词项相同，但 dense 的字符 n-gram 不同，排序也不同
+        self.assertEqual(bm25_terms(warm), bm25_terms(query))
+        fresh = [it["id"] for it in DenseIndex([dict(r) for r in rows]).search(query, 1)]
+        self.assertNotEqual(fresh, [it["id"] for it in DenseIndex([dict(r) for r in rows]).search(warm, 1)])
+
+        with patch.object(main, "db") as mock_db, \
+                patch.object(main, "KB_EMBED_DIR", tempfile.mkdtemp()), \
+                patch.object(main, "_kb_query_cache", QueryCache(maxsize=16, ttl=300.0)), \
+                patch.dict(main._kb_indexes, clear=True):
+            main._kb_snapshot["items"] = None
+            mock_db.get_kb_version.return_value = 1
+            mock_db.get_kb_items.return_value = [dict(r) for r in rows]
+            items = load_kb_entries()
+            retrieve_kb_context(warm, items, topn=1, engine="dense")
+            misses = main._kb_query_cache.misses
+            self.assertEqual([it["id"] for it in retrieve_kb_context(query, items, topn=1, engine="dense")], fresh)
+            self.assertEqual(main._kb_query_cache.misses, misses + 1)
+            main._kb_snapshot["items"] = None
+
+    def test_dense_index_mmap_store(self):
+        try:
+            import numpy as np
+        except ImportError:
+            self.skipTest("numpy not installed")
+        import tempfile
+        from kb_index import DenseIndex
+        items = [
+            {"id": "a", "title": "签证办理流程", "content": "先准备护照和照片，然后在线填写申请表并预约面签。"},
+            {"id": "b", "title": "费用说明", "content": "服务费每人五百元，政府规费另计。"},
+            {"id": "c", "title": "退款政策", "content": "拒签后可退还部分服务费。"},
+        ]
+        store = tempfile.mkdtemp()
+        writer = DenseIndex(items, store_dir=store, persist=True)
+        # 用词不同的问法也能召回
+        self.assertEqual(writer.search("申请表怎么填", topn=1)[0]["id"], "a")
+        self.assertEqual(writer.search("被拒了能退钱吗", topn=1)[0]["id"], "c")
+        self.assertTrue(writer.mmapped)
+
+        # 其它进程（相同条目）直接 mmap 复用存储，不复制矩阵
+        reader = DenseIndex([dict(it) for it in items], store_dir=store)
+        self.assertEqual(reader.search("收费标准", topn=1)[0]["id"], "b")
+        self.assertTrue(reader.mmapped)
+        self.assertIsInstance(reader._matrix, np.memmap)
+
+        # 条目不同（如测试或子集）时只在内存中计算，不覆盖共享存储
+        subset = DenseIndex(items[:2], store_dir=store)
+        subset.ensure_built()
+        self.assertFalse(subset.mmapped)
+        self.assertTrue(DenseIndex(list(items), store_dir=store).search("收费标准", topn=1))
+        self.assertEqual(len([n for n in os.listdir(store) if n.endswith(".npy")]), 2)
+
+    def test_chunker_bounded_passages(self):
+        from kb_chunker import iter_chunks
+        sentences = [f"第{i}条说明，资金来源需要逐笔核对并保留凭证。" for i in range(60)]
+        text = "# 资金审计\n" + "".join(sentences[:30]) + "\n# 背调流程\n" + "".join(sentences[30:]) + "\n" + "长" * 500
+        # 以任意大小的碎片流式输入
+        pieces = (text[i:i + 37] for i in range(0, len(text), 37))
+        chunks = list(iter_chunks(pieces, max_chars=200, overlap=40))
+
+        self.assertTrue(all(len(c) <= 200 for c in chunks))
+        self.assertTrue(chunks[0].startswith("# 资金审计"))
+        self.assertTrue(any(c.startswith("# 背调流程") for c in chunks))
+        # 标题处强制分段：同一段落不会跨越两个标题
+        self.assertFalse(any("# 资金审计" in c and "# 背调流程" in c for c in chunks))
+        for s in sentences:
+            self.assertTrue(any(s in c for c in chunks))
+        # 相邻段落以完整句子重叠
+        self.assertTrue(chunks[1].startswith(sentences[chunks[0].count("。") - 1]))
+
     def test_retrieve_kb_context(self):
         # Use the sample items directly for this test
         items = self.db_items
@@ -67,6 +403,64 @@ class KnowledgeBaseTests(unittest.TestCase):
         self.assertEqual(len(hits), 1)
         self.assertIn("审计", hits[0].get("content", ""))
 
+    def test_kb_index_incremental(self):
+        from kb_index import KBIndex
+        index = KBIndex([dict(it) for it in self.db_items])
+        hits = index.search("资金来源审计", topn=1)
+        self.assertEqual(hits[0]["id"], "t1")
+
+        index.update("t2", {"content": "行政豁免同样需要资金来源审计与背调材料。", "title": "资金来源审计说明"})
+        hits = index.search("资金来源审计", topn=1)
+        self.assertEqual(hits[0]["id"], "t2")
+
+        index.remove("t2")
+        index.add({"id": "t3", "title": "签证费用", "category": "qa", "tags": [], "content": "签证费用为每人 500 元。"})
+        ids = [it["id"] for it in index.search("签证费用多少", topn=2)]
+        self.assertEqual(ids[0], "t3")
+        self.assertNotIn("t2", ids)
+
+    def test_retrieve_kb_context_bm25(self):
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            self.skipTest("numpy not installed")
+        hits = retrieve_kb_context("逾期滞留豁免", self.db_items, topn=2, engine="bm25")
+        self.assertEqual(hits[0]["id"], "t2")
+        self.assertIs(hits[0], self.db_items[1])
+        self.assertEqual(retrieve_kb_context("完全无关", self.db_items, topn=2, engine="bm25"), [])
+
+    def test_qa_matcher_cache(self):
+        import tempfile
+        from qa_matcher import get_qa_matcher
+        fd, qa_path = tempfile.mkstemp(suffix=".txt")
+        os.close(fd)
+        try:
+            with open(qa_path, "w", encoding="utf-8") as f:
+                f.write("价格多少 || 每月 99 元\n办理流程 / 怎么办理 || 先提交资料\n")
+            m1 = get_qa_matcher(qa_path, load_qa_pairs)
+            self.assertIs(get_qa_matcher(qa_path, load_qa_pairs), m1)
+            self.assertEqual(m1.match("请问价格多少？"), "每月 99 元")
+            self.assertEqual(m1.match("怎么办理呢"), "先提交资料")
+            self.assertEqual(m1.match("请问价格多少？"), match_qa_reply("请问价格多少？", load_qa_pairs(qa_path)))
+
+            with open(qa_path, "w", encoding="utf-8") as f:
+                f.write("价格多少 || 每月 199 元\n")
+            m2 = get_qa_matcher(qa_path, load_qa_pairs)
+            self.assertIsNot(m2, m1)
+            self.assertEqual(m2.match("价格多少"), "每月 199 元")
+        finally:
+            os.remove(qa_path)
+
+    def test_match_qa_reply_reuses_compiled_matcher(self):
+        from qa_matcher import get_qa_matcher_for_pairs
+        pairs = [("价格多少", "每月 99 元"), ("怎么办理", "先提交资料")]
+        m1 = get_qa_matcher_for_pairs(pairs)
+        self.assertIs(get_qa_matcher_for_pairs(list(pairs)), m1)
+        self.assertEqual(match_qa_reply("请问价格多少？", pairs), "每月 99 元")
+        self.assertIs(get_qa_matcher_for_pairs(pairs), m1)
+        pairs[0] = ("价格多少", "每月 199 元")
+        self.assertEqual(match_qa_reply("请问价格多少？", pairs), "每月 199 元")
+
     def test_qa_compat(self):
         base_dir = os.path.dirname(os.path.dirname(__file__))
         qa_path = os.path.join(base_dir, "platforms", "telegram", "qa.txt")
@@ -85,5 +85,28 @@ class TestKeywordManager(unittest.TestCase):
         self.assertEqual(cat, "allow")
         self.assertEqual(word, "ZHU PENG")
 
+    def test_find_matches_offsets_and_categories(self):
+        self.km.add_keyword("block", "赌博")
+        self.km.add_keyword("sensitive", "博彩")
+        self.km.add_keyword("sensitive", "充值")
+        matches = self.km.find_matches("赌博彩票充值")
+        self.assertEqual([(m.category, m.word, m.start, m.end) for m in matches],
+                         [("block", "赌博", 0, 2), ("sensitive", "博彩", 1, 3), ("sensitive", "充值", 4, 6)])
+        # 同类别多词命中时返回词表中靠前的词
+        safe, cat, word = self.km.check_text("充值 博彩")
+        self.assertEqual((safe, cat, word), (False, "sensitive", "博彩"))
+
+    def test_external_edit_reloaded_after_check_interval(self):
+        import json
+        now = [0.0]
+        km = KeywordManager(self.test_file, check_interval=1.0, clock=lambda: now[0])
+        self.assertTrue(km.check_text("outside edit")[0])
+        with open(self.test_file, "w", encoding="utf-8") as f:
+            json.dump({"block": ["outside"], "sensitive": [], "allow": []}, f)
+        # 检查间隔内沿用已编译的词表
+        self.assertTrue(km.check_text("outside edit")[0])
+        now[0] = 1.5
+        self.assertEqual(km.check_text("outside edit"), (False, "block", "outside"))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,52 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(__file__) + "/..")
+from log_sink import LogSink
+
+
+class LogSinkTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def _read(self, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def test_batched_writes_keep_order_per_file(self):
+        sink = LogSink(max_bytes=0, flush_interval=0.05)
+        a = os.path.join(self.tmp, "logs", "system.log")
+        b = os.path.join(self.tmp, "logs", "trace.jsonl")
+        for i in range(500):
+            sink.write(a, f"a{i}\n")
+            sink.write(b, f"b{i}\n")
+        self.assertTrue(sink.flush())
+        self.assertEqual(self._read(a).splitlines(), [f"a{i}" for i in range(500)])
+        self.assertEqual(self._read(b).splitlines(), [f"b{i}" for i in range(500)])
+        self.assertEqual(sink.written, 1000)
+        # 1000 行远少于 1000 次写文件
+        self.assertLess(sink.batches, 100)
+        sink.close()
+
+    def test_rotation_and_close(self):
+        sink = LogSink(max_bytes=100, backup_count=2, flush_interval=0.05)
+        path = os.path.join(self.tmp, "group.log")
+        for i in range(3):
+            sink.write(path, "x" * 60 + "\n")
+            sink.flush()
+        self.assertEqual(len(self._read(path)), 61)
+        self.assertTrue(os.path.exists(path + ".1"))
+        self.assertTrue(os.path.exists(path + ".2"))
+
+        sink.write(path, "tail\n")
+        sink.close()
+        self.assertTrue(self._read(path).endswith("tail\n"))
+        # 关闭后的写入同步落盘
+        sink.write(path, "after close\n")
+        self.assertTrue(self._read(path).endswith("after close\n"))
+
+
+if __name__ == "__main__":
+    unittest.main()
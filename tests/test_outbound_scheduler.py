@@ -0,0 +1,114 @@
+import os
+import sys
+import time
+import asyncio
+import unittest
+from contextlib import asynccontextmanager
+
+sys.path.append(os.path.dirname(__file__) + "/..")
+from outbound_scheduler import OutboundScheduler
+
+
+class OutboundSchedulerTests(unittest.TestCase):
+    def test_sends_in_send_at_order_and_owns_typing(self):
+        sent, typing = [], []
+
+        async def send(job):
+            sent.append((job.chat_id, job.text, job.quote_target))
+            return len(sent)
+
+        @asynccontextmanager
+        async def show_typing(chat_id):
+            typing.append(("start", chat_id))
+            yield
+            typing.append(("stop", chat_id))
+
+        async def main():
+            sched = OutboundScheduler(send, typing=show_typing)
+            start = time.monotonic()
+            sched.schedule(1, "late", start + 0.08)
+            sched.schedule(2, "early", start + 0.02, quote_target="m2")
+            done = []
+            sched.schedule_in(1, "mid", 0.05, on_sent=lambda job, result: done.append(result))
+            # 调度立即返回，发送由后台完成
+            self.assertEqual(sent, [])
+            self.assertEqual(sched.pending(), 3)
+            await sched.join()
+            self.assertEqual(done, [2])
+            self.assertEqual(sched.pending(), 0)
+            await asyncio.sleep(0)
+
+        asyncio.run(main())
+        self.assertEqual(sent, [(2, "early", "m2"), (1, "mid", None), (1, "late", None)])
+        self.assertEqual(sorted(typing), [("start", 1), ("start", 2), ("stop", 1), ("stop", 2)])
+
+    def test_cancel_superseded_reply(self):
+        sent, errors = [], []
+
+        async def send(job):
+            if job.text == "boom":
+                raise RuntimeError("flood")
+            sent.append(job.text)
+
+        async def main():
+            sched = OutboundScheduler(send, on_error=lambda job, e: errors.append(str(e)))
+            old = sched.schedule_in(7, "old", 0.03)
+            sched.schedule_in(8, "keep", 0.03)
+            sched.schedule_in(8, "boom", 0.01)
+            self.assertTrue(sched.cancel_job(old))
+            self.assertFalse(sched.cancel_job(old))
+            sched.schedule_in(7, "new", 0.02)
+            self.assertEqual(sched.cancel(8), 2)
+            sched.schedule_in(8, "boom", 0.0)
+            await sched.join()
+            self.assertFalse(sched.cancel_job(old))
+
+        asyncio.run(main())
+        self.assertEqual(sent, ["new"])
+        self.assertEqual(errors, ["flood"])
+
+    def test_tasks_are_tracked_and_awaited(self):
+        release = None
+        sent = []
+
+        async def send(job):
+            await release.wait()
+            sent.append(job.text)
+
+        def on_error(job, e):
+            raise RuntimeError("handler broke")
+
+        async def main():
+            nonlocal release
+            release = asyncio.Event()
+            sched = OutboundScheduler(send, on_error=on_error)
+            sched.schedule_in(1, "slow", 0.0)
+            await asyncio.sleep(0.02)
+            # 发送中的任务由调度器持有
+            self.assertEqual(len(sched._tasks), 1)
+            joined = asyncio.ensure_future(sched.join(poll=0.01))
+            await asyncio.sleep(0.02)
+            self.assertFalse(joined.done())
+            release.set()
+            await joined
+            self.assertEqual(sent, ["slow"])
+            self.assertEqual(sched._tasks, set())
+
+            # 回调自身抛出的异常由完成回调记录，任务同样被释放
+            async def flood(job):
+                raise RuntimeError("flood")
+
+            sched._send = flood
+            sched.schedule_in(2, "boom", 1.0)
+            sched.schedule_in(3, "fail", 0.0)
+            await asyncio.sleep(0.02)
+            await sched.aclose()
+            self.assertEqual(sched.pending(), 0)
+            self.assertEqual(sched._tasks, set())
+            self.assertEqual((sched.sent, sched.failed, sched.cancelled), (1, 1, 1))
+
+        asyncio.run(main())
+
+
+if __name__ == "__main__":
+    unittest.main()
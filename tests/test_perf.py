@@ -33,6 +33,36 @@ class KnowledgeBasePerfTests(unittest.TestCase):
         self.assertLess(elapsed, 500, f"检索耗时过长: {elapsed:.2f}ms")
         self.assertEqual(len(hits), 3)
 
+    def test_benchmark_suite_and_baseline_compare(self):
+        sys.path.append(os.path.join(os.path.dirname(__file__), "..", "tools"))
+        import kb_benchmark
+        report = kb_benchmark.run_benchmark([60], ["bigram", "fts5"], n_queries=8, log=lambda msg: None)
+        size = report["sizes"]["60"]
+        self.assertEqual(size["corpus"]["items"], 60)
+        self.assertEqual(size["import"]["resync_unchanged"]["unchanged"], 60)
+        self.assertEqual(size["load_kb_entries"]["fts5"]["items"], 60)
+        for engine in ("bigram", "fts5"):
+            latency = size["retrieval"][engine]["latency_ms"]
+            self.assertLessEqual(latency["p50"], latency["p99"])
+            self.assertGreaterEqual(size["retrieval"][engine]["peak_kb"], 0)
+        self.assertEqual(size["match_qa_reply"]["pairs"], 96)
+
+        # 与自身对比无回归；延迟变慢一倍、吞吐减半均记为回归
+        self.assertEqual(kb_benchmark.compare_reports(report, report), [])
+        slower = json.loads(json.dumps(report))
+        slower["sizes"]["60"]["retrieval"]["bigram"]["latency_ms"]["p95"] += 100
+        slower["sizes"]["60"]["import"]["bulk"]["items_per_s"] /= 2
+        metrics = {r["metric"] for r in kb_benchmark.compare_reports(report, slower)}
+        self.assertEqual(metrics, {"60.retrieval.bigram.latency_ms.p95", "60.import.bulk.items_per_s"})
+
+    def test_keyword_benchmark_matches_legacy(self):
+        sys.path.append(os.path.join(os.path.dirname(__file__), "..", "tools"))
+        import keyword_benchmark
+        r = keyword_benchmark.run_size(2000, n_texts=50)
+        self.assertTrue(r["results_match"])
+        self.assertGreater(r["flagged"], 0)
+        self.assertLessEqual(r["automaton_ms"]["p50"], r["automaton_ms"]["p99"])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,80 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.append(os.path.dirname(__file__) + "/..")
+from stats_aggregator import StatsAggregator, read_stats, write_stats, default_stats
+
+
+class StatsAggregatorTests(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "stats.json")
+
+    def test_concurrent_increments_are_not_lost(self):
+        agg = StatsAggregator(self.path, flush_interval=3600)
+
+        def worker():
+            for _ in range(500):
+                agg.incr("total_messages")
+                agg.incr("group_messages")
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # 尚未落盘时 snapshot 已包含增量，文件仍为空
+        self.assertEqual(agg.snapshot()["total_messages"], 4000)
+        self.assertFalse(os.path.exists(self.path))
+
+        self.assertTrue(agg.flush())
+        self.assertFalse(agg.flush())
+        stats = read_stats(self.path)
+        self.assertEqual(stats["total_messages"], 4000)
+        self.assertEqual(stats["group_messages"], 4000)
+        self.assertIsNotNone(stats["last_active"])
+        agg.close()
+
+    def test_flush_merges_into_external_reset(self):
+        write_stats(self.path, dict(default_stats(), total_messages=10, error_count=2))
+        agg = StatsAggregator(self.path, flush_interval=3600)
+        agg.incr("total_messages", 3)
+        agg.flush()
+        self.assertEqual(read_stats(self.path)["total_messages"], 13)
+
+        # 后台重置后，只有之后的增量被合并
+        write_stats(self.path, default_stats())
+        agg.incr("error_count")
+        agg.close()
+        stats = read_stats(self.path)
+        self.assertEqual(stats["total_messages"], 0)
+        self.assertEqual(stats["error_count"], 1)
+
+
+    def test_flush_hooks_run_in_background_and_on_close(self):
+        agg = StatsAggregator(self.path, flush_interval=0.01)
+        calls = []
+        agg.add_flush_hook(lambda: calls.append(threading.current_thread().name))
+        failures = []
+
+        def failing_hook():
+            if not failures:
+                failures.append(1)
+                raise OSError("disk full")  # 异常不影响其它 hook 与统计落盘
+
+        agg.add_flush_hook(failing_hook)
+        agg.incr("total_messages")
+        for _ in range(200):
+            if calls:
+                break
+            threading.Event().wait(0.01)
+        self.assertEqual(calls[0], "stats-flush")
+        agg.close()
+        self.assertEqual(calls[-1], threading.current_thread().name)
+        self.assertEqual(read_stats(self.path)["total_messages"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
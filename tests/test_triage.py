@@ -0,0 +1,46 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.dirname(__file__) + "/..")
+from triage import TriageRules, TriageCache
+from admission import PRIORITY_PRIVATE, PRIORITY_MENTION, PRIORITY_KEYWORD, PRIORITY_CONTEXT
+
+CONFIG = {'PRIVATE_REPLY': True, 'GROUP_REPLY': True, 'GROUP_CONTEXT': False}
+
+
+class TriageTests(unittest.TestCase):
+    def test_decide_matches_handler_rules(self):
+        rules = TriageRules(["Price", "价格", "套餐"], ["人工", "human"], frozenset({-100}))
+        d = rules.decide("请问套餐和价格？", CONFIG, False, True, False, -100)
+        # 多个触发词命中时取词表中靠前的，与逐个 in 判断一致
+        self.assertEqual((d.action, d.reason, d.keyword, d.priority), ("reply", "keyword", "价格", PRIORITY_KEYWORD))
+        self.assertFalse(d.handoff)
+        self.assertEqual(rules.decide("PRICE list", CONFIG, False, True, False, -100).keyword, "Price")
+        self.assertEqual(rules.decide("hello", CONFIG, False, True, True, -100).priority, PRIORITY_MENTION)
+        self.assertEqual(rules.decide("hello", CONFIG, False, True, False, -100).reason, "no_trigger")
+        self.assertEqual(rules.decide("价格", CONFIG, False, True, True, -200).reason, "not_selected")
+        self.assertEqual(rules.decide("价格", dict(CONFIG, GROUP_REPLY=False), False, True, True, -100).reason, "group_off")
+
+        d = rules.decide("我要找 HUMAN 客服", CONFIG, True, False, False, 5)
+        self.assertEqual((d.action, d.priority, d.handoff), ("reply", PRIORITY_PRIVATE, True))
+        self.assertEqual(rules.decide("hi", dict(CONFIG, PRIVATE_REPLY=False), True, False, False, 5).reason, "private_off")
+
+        # 词表为空时才看 GROUP_CONTEXT；白名单为空时所有群都放行
+        empty = TriageRules([], [], frozenset())
+        self.assertEqual(empty.decide("hi", CONFIG, False, True, False, -1).action, "ignore")
+        d = empty.decide("hi", dict(CONFIG, GROUP_CONTEXT=True), False, True, False, -1)
+        self.assertEqual((d.reason, d.priority), ("context", PRIORITY_CONTEXT))
+
+    def test_cache_rebuilds_only_when_snapshots_change(self):
+        cache = TriageCache()
+        keywords, groups = ["价格"], frozenset()
+        first = cache.get(keywords, "人工", groups)
+        self.assertIs(cache.get(keywords, "人工", groups), first)
+        self.assertIsNot(cache.get(["价格"], "人工", groups), first)
+        self.assertTrue(cache.get(keywords, "人工, 客服", groups).scan("找客服")[1])
+        self.assertEqual(cache.builds, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,436 @@
+"""
+知识库检索扩展性基准：在 1k / 10k / 100k 条合成语料上测量检索、match_qa_reply、load_kb_entries 与导入吞吐
+
+用法:
+    python tools/kb_benchmark.py [--sizes 1000,10000,100000] [--engines bigram,bm25,dense,fts5]
+                                 [--queries 200] [--baseline tests/kb_benchmark_baseline.json]
+                                 [--threshold 0.2] [--no-save] [--no-memory] [--fail-on-regression]
+
+语料按 Knowledge Base.txt 的真实形态生成：多语言 QA 块（QA-xxx / 【问题-简体】…）与较长的 Markdown 章节，
+再经 main 的同一套解析函数转为知识库行。每个阶段记录 p50/p95/p99 延迟与峰值内存（进程 RSS 增量），
+结果写入 JSON 基线；再次运行时先与上一次基线逐项对比，超过阈值的变慢/变大项列为回归。
+"""
+import os
+import re
+import sys
+import gc
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import platform
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import psutil
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_ENGINES = ["bigram", "bm25", "dense", "fts5"]
+DEFAULT_BASELINE = os.path.join(ROOT, "tests", "kb_benchmark_baseline.json")
+
+# 低于此绝对差值的延迟变化视为噪声，不计入回归
+NOISE_FLOOR_MS = 0.5
+
+_SUBJECTS = ["充值", "提现", "结算", "对账", "注单", "返水", "代理佣金", "风控审核", "免费游戏", "jackpot 奖池",
+             "API 对接", "回调地址", "白名单", "币种汇率", "账户冻结", "洗码量", "限红设置", "维护公告", "游戏厂商", "子账号"]
+_ACTIONS = ["怎么计算", "多久到账", "需要哪些资料", "失败了怎么办", "可以修改吗", "有上限吗", "如何开通", "由谁承担",
+            "在哪里查看", "要收手续费吗", "支持哪些币种", "怎么申请"]
+_CONTEXTS = ["新平台上线前", "月底结算时", "玩家投诉后", "切换线路以后", "测试环境里", "周末期间", "大额交易时", ""]
+_ANSWER_PARTS = ["按自然月统计，次月 5 号前出账单。", "需要在后台提交工单，由商务确认后处理。", "一般 T+1 到账，节假日顺延。",
+                 "费率按合同约定，默认 0.3%。", "请提供商户号、订单号与截图。", "系统会自动重试三次，仍失败请联系技术。",
+                 "可以在代理后台的报表中心导出明细。", "修改后需要重新审核，审核期间不影响现有业务。",
+                 "涉及资金的操作需要双人复核。", "接口返回码 1001 表示签名错误，请检查密钥。"]
+_SECTION_TOPICS = ["资金审计流程", "行政豁免说明", "风控规则", "接入指南", "结算周期", "代理制度", "客服话术规范",
+                   "数据安全要求", "异常处理预案", "版本更新说明"]
+# 简体 -> 繁体（只覆盖语料中出现的常用字，足以让繁体问题与简体不同）
+_TC_MAP = str.maketrans("么时间开设认证码发对会员级务单订计钱银现额过样办账户费问题这结审核风险规则绑统数据务门后台线还没为说应请选择报表导实",
+                        "麼時間開設認證碼發對會員級務單訂計錢銀現額過樣辦賬戶費問題這結審核風險規則綁統數據務門後臺線還沒為說應請選擇報表導實")
+
+
+def _qa_block(i, rng):
+    subject = rng.choice(_SUBJECTS)
+    q_sc = f"{rng.choice(_CONTEXTS)}{subject}{rng.choice(_ACTIONS)}？编号{i}"
+    a_sc = "".join(rng.sample(_ANSWER_PARTS, rng.randint(1, 3)))
+    return (f"==============================\nQA-{i:06d}\n"
+            f"【问题-简体】{q_sc}\n【问题-繁体】{q_sc.translate(_TC_MAP)}\n"
+            f"【答案-简体】{a_sc}\n【答案-繁体】{a_sc.translate(_TC_MAP)}\n")
+
+
+def _markdown_section(i, rng):
+    topic = rng.choice(_SECTION_TOPICS)
+    paragraphs = []
+    for _ in range(rng.randint(4, 10)):
+        subject = rng.choice(_SUBJECTS)
+        paragraphs.append(f"关于{subject}，{''.join(rng.sample(_ANSWER_PARTS, 3))}如遇{rng.choice(_CONTEXTS) or '特殊情况'}，"
+                          f"以{topic}为准。")
+    return f"## {topic} 第{i}节\n" + "\n\n".join(paragraphs) + "\n"
+
+
+def generate_corpus(size, md_ratio=0.2, seed=42):
+    """
+    生成 size 条知识库行：QA 块经 _iter_multi_lang_qa 解析、Markdown 章节经 _iter_markdown_kb 解析，
+    与 _iter_kb_file_rows 导入本地文件时的行形态一致。返回 (rows, qa_blocks)
+    """
+    import main
+    rng = random.Random(seed)
+    n_md = int(size * md_ratio)
+    n_qa = size - n_md
+    ts = datetime.now().isoformat()
+    qa_text = "".join(_qa_block(i, rng) for i in range(n_qa))
+    md_text = "".join(_markdown_section(i, rng) for i in range(n_md))
+    blocks = list(main._iter_multi_lang_qa(qa_text))
+    rows = [main._new_kb_row(b["q_sc"][:100], "qa", ["bench", "qa"], main._qa_block_content(b),
+                             main.KB_SOURCE_FILES[0], ts) for b in blocks]
+    rows.extend(main._new_kb_row(mb["title"][:100], "markdown", ["bench", "markdown"], mb["content"],
+                                 main.KB_SOURCE_FILES[2], ts) for mb in main._iter_markdown_kb(md_text))
+    return rows, blocks
+
+
+def build_queries(blocks, count, seed=7):
+    """由 QA 问题派生查询：繁体全句与简体前半句交替"""
+    rng = random.Random(seed)
+    picked = rng.sample(blocks, min(count, len(blocks)))
+    queries = []
+    for n, b in enumerate(picked):
+        text = b["q_tc"] if n % 2 == 0 else b["q_sc"][:len(b["q_sc"]) // 2 + 1]
+        queries.append(text)
+    return queries
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+    vals = sorted(values)
+    out = {}
+    for name, pct in (("p50", 50), ("p95", 95), ("p99", 99)):
+        k = min(len(vals) - 1, int(round(pct / 100.0 * (len(vals) - 1))))
+        out[name] = round(vals[k], 3)
+    return out
+
+
+def _time_calls(fn, args_list):
+    latencies = []
+    for args in args_list:
+        t = time.perf_counter()
+        fn(*args)
+        latencies.append((time.perf_counter() - t) * 1000)
+    return percentiles(latencies)
+
+
+def _measured(fn, memory=True):
+    """
+    执行 fn，返回 (结果, 耗时 ms, 峰值内存 KB)
+    峰值内存为执行期间进程 RSS 相对开始时的最大增量（后台线程每 5ms 采样）；
+    不用 tracemalloc：它在 10 万条规模下的跟踪开销会让内存翻倍并显著拖慢计时
+    """
+    gc.collect()
+    sampler = _RssSampler() if memory else None
+    t = time.perf_counter()
+    try:
+        result = fn()
+    finally:
+        elapsed = round((time.perf_counter() - t) * 1000, 2)
+        peak = sampler.stop() if sampler else None
+    return result, elapsed, peak
+
+
+class _RssSampler:
+    def __init__(self, interval=0.005):
+        self._proc = psutil.Process()
+        self._base = self._proc.memory_info().rss
+        self._peak = self._base
+        self._interval = interval
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._done.wait(self._interval):
+            self._peak = max(self._peak, self._proc.memory_info().rss)
+
+    def stop(self):
+        self._done.set()
+        self._thread.join()
+        self._peak = max(self._peak, self._proc.memory_info().rss)
+        return round((self._peak - self._base) / 1024.0, 1)
+
+
+@contextmanager
+def _isolated_main(mgr, engine, store_dir):
+    """
+    让 main 的知识库函数指向临时库：替换 db、固定检索引擎、dense 矩阵写到临时目录、不落盘缓存统计，
+    并清空快照/索引/查询缓存；退出时全部还原
+    """
+    import main
+    saved = (main.db, main.load_config, main.KB_EMBED_DIR, main._kb_query_cache,
+             dict(main._kb_indexes), dict(main._kb_snapshot))
+    real_load_config = main.load_config
+
+    def load_config():
+        config = dict(real_load_config())
+        config["KB_RETRIEVAL_ENGINE"] = engine
+        config["KB_REFRESH"] = "off"
+        return config
+
+    main.db, main.load_config, main.KB_EMBED_DIR = mgr, load_config, store_dir
+    from kb_cache import QueryCache
+    # 独立的查询缓存：后台统计落盘只观察 main 原有的缓存，基准中的命中不会写入统计文件
+    main._kb_query_cache = QueryCache(maxsize=1024, ttl=300.0)
+    main._kb_indexes.clear()
+    main._kb_snapshot.update({"version": None, "config_mtime": None, "items": None, "by_id": None,
+                              "partitions": None, "engine": engine})
+    try:
+        yield main
+    finally:
+        main.db, main.load_config, main.KB_EMBED_DIR, main._kb_query_cache = saved[:4]
+        main._kb_indexes.clear()
+        main._kb_indexes.update(saved[4])
+        main._kb_snapshot.update(saved[5])
+
+
+def _reset_snapshot(main):
+    main._kb_indexes.clear()
+    main._kb_snapshot.update({"version": None, "items": None, "by_id": None, "partitions": None})
+
+
+def bench_import(rows, workdir, memory=True):
+    from database import DatabaseManager
+
+    def fresh_db(name):
+        path = os.path.join(workdir, name)
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        return DatabaseManager(path)
+
+    mgr = fresh_db("bench.db")
+    _, bulk_ms, bulk_peak = _measured(lambda: mgr.bulk_import_kb_items("default", [dict(r) for r in rows]), memory)
+    sources = sorted({r["source_file"] for r in rows})
+    stats, resync_ms, _ = _measured(lambda: mgr.sync_kb_items("default", [dict(r) for r in rows], sources), False)
+    n = len(rows)
+    result = {
+        "bulk": {"ms": bulk_ms, "items_per_s": round(n / max(bulk_ms, 1e-6) * 1000, 1), "peak_kb": bulk_peak},
+        "resync_unchanged": {"ms": resync_ms, "items_per_s": round(n / max(resync_ms, 1e-6) * 1000, 1),
+                             "unchanged": stats.get("unchanged", 0)},
+    }
+    return mgr, result
+
+
+def bench_engine(mgr, engine, store_dir, queries, topn=3, repeat=3, warm_calls=200, memory=True):
+    """
+    冷加载 load_kb_entries（含索引构建）repeat 次、快照命中的热调用，以及在最后一次冷加载的快照上检索
+    返回 (load_kb_entries 结果, 检索结果)
+    """
+    with _isolated_main(mgr, engine, store_dir) as main:
+        cold, peaks = [], []
+        items = None
+        for _ in range(repeat):
+            _reset_snapshot(main)
+            items, ms, peak = _measured(main.load_kb_entries, memory)
+            cold.append(ms)
+            peaks.append(peak)
+        peak = max(peaks) if memory else None
+        warm = _time_calls(main.load_kb_entries, [()] * warm_calls)
+        load_result = {"items": len(items or []), "cold_ms": percentiles(cold), "warm_ms": warm, "peak_kb": peak}
+
+        items = main.load_kb_entries()
+        resolved = engine if engine in main.KB_SQL_ENGINES else main._get_kb_index(engine).engine
+        # 不经过查询缓存，测的是引擎本身的检索耗时
+        latency = _time_calls(lambda q: main._retrieve_kb_uncached(q, items, topn, engine), [(q,) for q in queries])
+        cached = _time_calls(lambda q: main.retrieve_kb_context(q, items, topn, engine), [(q,) for q in queries] * 2)
+        retrieval_result = {"engine": resolved, "build_ms": cold[-1], "peak_kb": peak, "latency_ms": latency,
+                            "cached_ms": cached}
+        return load_result, retrieval_result
+
+
+def bench_match_qa_reply(blocks, queries, memory=True):
+    import main
+    from qa_matcher import QAMatcher
+    pairs = []
+    for b in blocks:
+        for q in (b["q_sc"], b["q_tc"]):
+            if q:
+                pairs.append((q, b["a_sc"]))
+    matcher, build_ms, peak = _measured(lambda: QAMatcher(pairs), memory)
+    match_ms = _time_calls(matcher.match, [(q,) for q in queries])
+    # match_qa_reply 按问答内容复用编译结果，首次调用含编译
+    reply_ms = _time_calls(lambda q: main.match_qa_reply(q, pairs), [(q,) for q in queries])
+    return {"pairs": len(pairs), "build_ms": build_ms, "peak_kb": peak, "match_ms": match_ms,
+            "match_qa_reply_ms": reply_ms}
+
+
+def run_size(size, engines, n_queries, md_ratio=0.2, memory=True, log=print):
+    rows, blocks = generate_corpus(size, md_ratio)
+    queries = build_queries(blocks, n_queries)
+    workdir = tempfile.mkdtemp(prefix="kb_bench_")
+    try:
+        log(f"[{size}] 导入 {len(rows)} 条...")
+        mgr, import_result = bench_import(rows, workdir, memory)
+        result = {
+            "corpus": {"items": len(rows), "qa": len(blocks), "markdown": len(rows) - len(blocks),
+                       "chars": sum(len(r["content"]) for r in rows), "queries": len(queries)},
+            "import": import_result,
+            "load_kb_entries": {},
+            "retrieval": {},
+        }
+        for engine in engines:
+            store_dir = os.path.join(workdir, f"store_{engine}")
+            log(f"[{size}] load_kb_entries / 检索: {engine}")
+            result["load_kb_entries"][engine], result["retrieval"][engine] = bench_engine(
+                mgr, engine, store_dir, queries, memory=memory)
+        log(f"[{size}] match_qa_reply")
+        result["match_qa_reply"] = bench_match_qa_reply(blocks, queries, memory)
+        return result
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_benchmark(sizes, engines, n_queries=200, md_ratio=0.2, memory=True, log=print):
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": numpy_version,
+        "machine": platform.machine(),
+        "engines": list(engines),
+        "sizes": {str(size): run_size(size, engines, n_queries, md_ratio, memory, log) for size in sizes},
+    }
+
+
+def _flatten(data, prefix=""):
+    out = {}
+    for key, value in data.items():
+        path = f"{prefix}.{key}" if prefix else str(key)
+        if isinstance(value, dict):
+            out.update(_flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            out[path] = value
+    return out
+
+
+def _direction(path):
+    """返回 1 表示越小越好（延迟/内存），-1 表示越大越好（吞吐），0 表示不参与对比"""
+    leaf = path.rsplit(".", 1)[-1]
+    if leaf == "items_per_s":
+        return -1
+    if leaf == "peak_kb" or leaf.endswith("_ms") or re.fullmatch(r"p\d+", leaf):
+        return 1
+    return 0
+
+
+def compare_reports(previous, current, threshold=0.2):
+    """
+    对比两次运行的同名指标（只比较两边都存在的规模与引擎），返回回归列表：
+    [{"metric", "previous", "current", "change"}]，change 为相对变化比例（正数表示变差）
+    """
+    prev = _flatten(previous.get("sizes", {}))
+    cur = _flatten(current.get("sizes", {}))
+    regressions = []
+    for path, new in cur.items():
+        old = prev.get(path)
+        direction = _direction(path)
+        if old is None or not direction or old <= 0:
+            continue
+        change = (new - old) / old * direction
+        if change <= threshold:
+            continue
+        is_latency = not path.endswith("peak_kb") and direction == 1
+        if is_latency and abs(new - old) < NOISE_FLOOR_MS:
+            continue
+        regressions.append({"metric": path, "previous": old, "current": new, "change": round(change, 4)})
+    regressions.sort(key=lambda r: -r["change"])
+    return regressions
+
+
+def load_baseline(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_baseline(path, report):
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def _print_summary(report):
+    print("-" * 88)
+    print(f"{'size':>7} {'stage':<22} {'engine':<8} {'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9} {'build_ms':>10} {'peak_kb':>10}")
+    for size, r in report["sizes"].items():
+        imp = r["import"]
+        print(f"{size:>7} {'import (items/s)':<22} {'':<8} {imp['bulk']['items_per_s']:>9} "
+              f"{imp['resync_unchanged']['items_per_s']:>9} {'':>9} {imp['bulk']['ms']:>10} {imp['bulk']['peak_kb'] or '-':>10}")
+        for engine, lr in r["load_kb_entries"].items():
+            c = lr["cold_ms"]
+            print(f"{size:>7} {'load_kb_entries cold':<22} {engine:<8} {c['p50']:>9} {c['p95']:>9} {c['p99']:>9} "
+                  f"{'':>10} {lr['peak_kb'] or '-':>10}")
+        for engine, rr in r["retrieval"].items():
+            lat = rr["latency_ms"]
+            print(f"{size:>7} {'retrieve_kb_context':<22} {rr['engine']:<8} {lat['p50']:>9} {lat['p95']:>9} "
+                  f"{lat['p99']:>9} {rr['build_ms']:>10} {rr['peak_kb'] or '-':>10}")
+        qa = r["match_qa_reply"]
+        m = qa["match_ms"]
+        print(f"{size:>7} {'QAMatcher.match':<22} {'':<8} {m['p50']:>9} {m['p95']:>9} {m['p99']:>9} "
+              f"{qa['build_ms']:>10} {qa['peak_kb'] or '-':>10}")
+    print("-" * 88)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KB retrieval scaling benchmark")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES))
+    parser.add_argument("--engines", default=",".join(DEFAULT_ENGINES))
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--md-ratio", type=float, default=0.2, help="Markdown 章节占比")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.2, help="相对变差超过该比例记为回归")
+    parser.add_argument("--no-save", action="store_true", help="只对比，不覆盖基线")
+    parser.add_argument("--no-memory", action="store_true", help="跳过峰值内存采样")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    engines = [e.strip() for e in args.engines.split(",") if e.strip()]
+    report = run_benchmark(sizes, engines, args.queries, args.md_ratio, memory=not args.no_memory)
+    _print_summary(report)
+
+    regressions = []
+    previous = load_baseline(args.baseline)
+    if previous:
+        regressions = compare_reports(previous, report, args.threshold)
+        report["compared_to"] = previous.get("created_at")
+        report["regressions"] = regressions
+        if regressions:
+            print(f"⚠️ 相对上次基线 ({previous.get('created_at')}) 的回归 (> {args.threshold:.0%}):")
+            for r in regressions:
+                print(f"  {r['metric']}: {r['previous']} -> {r['current']} (+{r['change']:.1%})")
+        else:
+            print(f"✅ 与上次基线 ({previous.get('created_at')}) 相比无回归")
+    else:
+        print("未找到历史基线，本次结果作为新基线")
+
+    if not args.no_save:
+        save_baseline(args.baseline, report)
+        print(f"Baseline saved: {args.baseline}")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+知识库检索引擎对比报告：bigram（现有打分） vs bm25 vs dense（本地哈希 n-gram 向量）
+
+用法:
+    python tools/kb_engine_report.py [--tenant default] [--qa-file platforms/telegram/qa.txt] [--json out.json]
+
+语料优先取数据库中的知识库条目；为空时直接解析 qa.txt 的多语言 QA 块。
+查询由 QA 条目自身的问题派生（繁体问题 / 简体问题前半句），期望命中即该条目，
+统计 hit@1、hit@3、MRR 与单次检索耗时 (avg / p95)。
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from kb_index import create_kb_index
+
+ENGINES = ["bigram", "bm25", "dense"]
+
+
+def _parse_qa_blocks(path):
+    items = []
+    if not os.path.exists(path):
+        return items
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        content = f.read()
+    for i, chunk in enumerate(re.split(r"\n(?=QA-\d+)", content)):
+        q_sc = re.search(r"【问题-简体】(.*)", chunk)
+        q_tc = re.search(r"【问题-繁体】(.*)", chunk)
+        a_sc = re.search(r"【答案-简体】(.*)", chunk)
+        if not q_sc:
+            continue
+        q_sc, q_tc = q_sc.group(1).strip(), (q_tc.group(1).strip() if q_tc else "")
+        a_sc = a_sc.group(1).strip() if a_sc else ""
+        items.append({
+            "id": f"qa_{i}",
+            "title": q_sc[:100],
+            "category": "qa",
+            "tags": ["qa"],
+            "content": f"Question: {q_sc}\nQuestion_TC: {q_tc}\nAnswer: {a_sc}",
+        })
+    return items
+
+
+def _load_corpus(tenant_id, qa_file):
+    try:
+        from database import db
+        items = db.get_kb_items(tenant_id)
+    except Exception:
+        items = []
+    if items:
+        return items, "database"
+    return _parse_qa_blocks(qa_file), qa_file
+
+
+def _build_queries(items):
+    queries = []
+    for it in items:
+        content = it.get("content", "") or ""
+        q_tc = re.search(r"Question_TC:\s*(.+)", content)
+        q_sc = re.search(r"Question:\s*(.+)", content)
+        if q_tc and q_tc.group(1).strip():
+            queries.append((q_tc.group(1).strip(), it.get("id")))
+        if q_sc:
+            text = q_sc.group(1).strip()
+            if len(text) >= 8:
+                queries.append((text[:len(text) // 2 + 1], it.get("id")))
+    return queries
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    vals = sorted(values)
+    k = min(len(vals) - 1, int(round(pct / 100.0 * (len(vals) - 1))))
+    return vals[k]
+
+
+def evaluate(engine, items, queries, topn=3):
+    t0 = time.perf_counter()
+    index = create_kb_index(engine, items)
+    index.search("warmup", topn)
+    build_ms = (time.perf_counter() - t0) * 1000
+    hit1 = hit3 = 0
+    rr = 0.0
+    latencies = []
+    for query, expected in queries:
+        t = time.perf_counter()
+        hits = index.search(query, topn)
+        latencies.append((time.perf_counter() - t) * 1000)
+        ids = [h.get("id") for h in hits]
+        if ids[:1] == [expected]:
+            hit1 += 1
+        if expected in ids:
+            hit3 += 1
+            rr += 1.0 / (ids.index(expected) + 1)
+    n = max(1, len(queries))
+    return {
+        "engine": index.engine,
+        "queries": len(queries),
+        "hit@1": round(hit1 / n, 4),
+        "hit@3": round(hit3 / n, 4),
+        "mrr": round(rr / n, 4),
+        "build_ms": round(build_ms, 2),
+        "avg_ms": round(sum(latencies) / n, 3),
+        "p95_ms": round(_percentile(latencies, 95), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KB retrieval engine comparison")
+    parser.add_argument("--tenant", default="default")
+    parser.add_argument("--qa-file", default=os.path.join(ROOT, "platforms", "telegram", "qa.txt"))
+    parser.add_argument("--json", default="")
+    args = parser.parse_args()
+
+    items, source = _load_corpus(args.tenant, args.qa_file)
+    queries = _build_queries(items)
+    print(f"Corpus: {len(items)} items ({source}), {len(queries)} queries")
+    if not queries:
+        print("No QA-style items found, nothing to compare.")
+        return
+
+    results = [evaluate(engine, items, queries) for engine in ENGINES]
+    print("-" * 72)
+    print(f"{'engine':<8} {'hit@1':>7} {'hit@3':>7} {'mrr':>7} {'build_ms':>10} {'avg_ms':>8} {'p95_ms':>8}")
+    for r in results:
+        print(f"{r['engine']:<8} {r['hit@1']:>7} {r['hit@3']:>7} {r['mrr']:>7} {r['build_ms']:>10} {r['avg_ms']:>8} {r['p95_ms']:>8}")
+    print("-" * 72)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"source": source, "items": len(items), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"Report saved: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+KeywordManager.check_text 微基准：在 10k / 100k 条合成关键词上对比逐词 `in` 扫描与 AC 自动机
+
+用法:
+    python tools/keyword_benchmark.py [--sizes 10000,100000] [--texts 200] [--text-len 120]
+
+每个规模生成 block / sensitive 词表（比例 8:2，allow 取 sensitive 中的少量词）写入临时 keywords.json，
+文本为正常消息，约一成插入一个随机关键词；
+记录自动机编译耗时，以及两种实现对同一批文本的逐条 p50 / p95 / p99 延迟，并校验两者结果一致。
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from keyword_manager import KeywordManager  # noqa: E402
+
+DEFAULT_SIZES = [10000, 100000]
+_ALPHABET = "赌博博彩代理充值提现返水洗钱跑分套现账户银行卡号码微信支付宝群组客服优惠活动注册链接下载"
+# 正常消息用字（与关键词字表不相交），多数文本不命中任何词，逐词扫描需要走完整个词表
+_PLAIN = "请问今天明天什么时候可以帮我看一下这个问题谢谢好的收到没有关系，。？ abcdefg123"
+
+
+def _word(rng, lo=2, hi=6):
+    return "".join(rng.choice(_ALPHABET) for _ in range(rng.randint(lo, hi)))
+
+
+def build_keywords(size, seed=7):
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add(_word(rng))
+    words = sorted(words)
+    rng.shuffle(words)
+    n_block = size * 8 // 10
+    n_allow = max(1, size // 1000)
+    return {"block": words[:n_block], "sensitive": words[n_block:], "allow": words[n_block:n_block + n_allow]}
+
+
+def build_texts(n, text_len, keywords, hit_ratio=0.1, seed=11):
+    """约 hit_ratio 的文本中插入一个随机关键词，其余为正常消息"""
+    rng = random.Random(seed)
+    pool = keywords["block"] + keywords["sensitive"]
+    texts = []
+    for _ in range(n):
+        chars = [rng.choice(_PLAIN) for _ in range(text_len)]
+        if rng.random() < hit_ratio:
+            pos = rng.randrange(text_len)
+            chars[pos:pos] = list(rng.choice(pool))
+        texts.append("".join(chars))
+    return texts
+
+
+def legacy_check_text(keywords, text):
+    """改造前的实现：按类别逐词子串判断"""
+    for word in keywords.get("allow", []):
+        if word and word in text:
+            return True, "allow", word
+    for word in keywords.get("block", []):
+        if word in text:
+            return False, "block", word
+    for word in keywords.get("sensitive", []):
+        if word in text:
+            return False, "sensitive", word
+    return True, None, None
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 4)
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)}
+
+
+def _time_each(fn, texts):
+    samples, results = [], []
+    for text in texts:
+        t0 = time.perf_counter()
+        results.append(fn(text))
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    return percentiles(samples), results
+
+
+def run_size(size, n_texts=200, text_len=120):
+    keywords = build_keywords(size)
+    texts = build_texts(n_texts, text_len, keywords)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "keywords.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(keywords, f, ensure_ascii=False)
+        km = KeywordManager(path, check_interval=3600)
+        t0 = time.perf_counter()
+        km._compile()
+        compile_ms = (time.perf_counter() - t0) * 1000.0
+        automaton_stats, automaton_results = _time_each(km.check_text, texts)
+    legacy_stats, legacy_results = _time_each(lambda t: legacy_check_text(keywords, t), texts)
+    return {
+        "keywords": size,
+        "texts": n_texts,
+        "compile_ms": round(compile_ms, 1),
+        "automaton_ms": automaton_stats,
+        "legacy_ms": legacy_stats,
+        "results_match": automaton_results == legacy_results,
+        "flagged": sum(1 for r in automaton_results if not r[0]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KeywordManager.check_text microbenchmark")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES))
+    parser.add_argument("--texts", type=int, default=200)
+    parser.add_argument("--text-len", type=int, default=120)
+    args = parser.parse_args()
+    for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        r = run_size(size, args.texts, args.text_len)
+        print(f"[{size}] 编译 {r['compile_ms']} ms | 自动机 p50/p95/p99 "
+              f"{r['automaton_ms']['p50']}/{r['automaton_ms']['p95']}/{r['automaton_ms']['p99']} ms | "
+              f"逐词扫描 {r['legacy_ms']['p50']}/{r['legacy_ms']['p95']}/{r['legacy_ms']['p99']} ms | "
+              f"命中 {r['flagged']}/{r['texts']} | 结果一致: {r['results_match']}")
+
+
+if __name__ == "__main__":
+    main()
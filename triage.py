@@ -0,0 +1,94 @@
+from collections import namedtuple
+from typing import Iterable, Optional
+
+from aho_corasick import AhoCorasick
+from admission import PRIORITY_PRIVATE, PRIORITY_MENTION, PRIORITY_KEYWORD, PRIORITY_CONTEXT
+
+# action: reply / ignore；reason 说明触发或忽略的原因，keyword 为命中的群聊触发词
+Triage = namedtuple("Triage", ["action", "reason", "priority", "keyword", "handoff"])
+
+_TRIGGER = 0
+_HANDOFF = 1
+
+
+def split_handoff_keywords(raw) -> list:
+    return [k.strip().lower() for k in str(raw or "").split(",") if k.strip()]
+
+
+class TriageRules:
+    """
+    预编译的消息分流规则：群聊触发词（keywords.txt）与转人工关键词（HANDOFF_KEYWORDS）编进同一个 AC 自动机，
+    群聊白名单为整数集合。decide 对小写后的消息只扫描一遍，就得出 回复 / 转人工 / 忽略。
+    判定顺序与原 handler 一致：私聊直接回复；群聊依次看 @、触发词（词表非空时）、GROUP_CONTEXT。
+    """
+
+    def __init__(self, trigger_keywords: Iterable[str], handoff_keywords: Iterable[str], selected_group_ids=None):
+        self.trigger_keywords = [k for k in trigger_keywords if k]
+        self.handoff_keywords = [k for k in handoff_keywords if k]
+        self.selected_group_ids = frozenset(selected_group_ids or ())
+        patterns = [(k.lower(), (_TRIGGER, i)) for i, k in enumerate(self.trigger_keywords)]
+        patterns += [(k.lower(), (_HANDOFF, i)) for i, k in enumerate(self.handoff_keywords)]
+        self._automaton = AhoCorasick(patterns)
+
+    def scan(self, text: str):
+        """返回 (最先出现在词表中的触发词或 None, 是否包含转人工关键词)"""
+        first = None
+        handoff = False
+        for _, _, _, (kind, idx) in self._automaton.finditer((text or "").lower()):
+            if kind == _HANDOFF:
+                handoff = True
+            elif first is None or idx < first:
+                first = idx
+        return (self.trigger_keywords[first] if first is not None else None), handoff
+
+    def group_allowed(self, chat_id) -> bool:
+        if not self.selected_group_ids:
+            return True
+        try:
+            return chat_id is not None and int(chat_id) in self.selected_group_ids
+        except (TypeError, ValueError):
+            return False
+
+    def decide(self, text: str, config, is_private: bool, is_group: bool, mentioned: bool, chat_id=None) -> Triage:
+        if is_private and not config.get('PRIVATE_REPLY', True):
+            return Triage("ignore", "private_off", PRIORITY_PRIVATE, None, False)
+        if is_group and not config.get('GROUP_REPLY', True):
+            return Triage("ignore", "group_off", PRIORITY_CONTEXT, None, False)
+        if is_group and not self.group_allowed(chat_id):
+            return Triage("ignore", "not_selected", PRIORITY_CONTEXT, None, False)
+
+        keyword, handoff = self.scan(text)
+        if is_private:
+            return Triage("reply", "private", PRIORITY_PRIVATE, None, handoff)
+        if is_group:
+            if mentioned:
+                return Triage("reply", "mention", PRIORITY_MENTION, None, handoff)
+            if self.trigger_keywords:
+                if keyword is not None:
+                    return Triage("reply", "keyword", PRIORITY_KEYWORD, keyword, handoff)
+            elif config.get('GROUP_CONTEXT', False):
+                return Triage("reply", "context", PRIORITY_CONTEXT, None, handoff)
+        return Triage("ignore", "no_trigger", PRIORITY_CONTEXT, keyword, handoff)
+
+
+class TriageCache:
+    """
+    按输入快照缓存 TriageRules：关键词列表与白名单是 ConfigRegistry 的共享快照，文件未变化时对象不变，
+    因此按对象身份比较即可；HANDOFF_KEYWORDS 按字符串比较。
+    """
+
+    def __init__(self):
+        self._key = None
+        self._rules: Optional[TriageRules] = None
+        self._refs = None
+        self.builds = 0
+
+    def get(self, trigger_keywords, handoff_raw, selected_group_ids) -> TriageRules:
+        key = (id(trigger_keywords), str(handoff_raw or ""), id(selected_group_ids))
+        if self._rules is None or key != self._key:
+            self._rules = TriageRules(trigger_keywords or [], split_handoff_keywords(handoff_raw), selected_group_ids)
+            # 保留快照引用，避免对象被回收后 id 被复用
+            self._key = key
+            self._refs = (trigger_keywords, selected_group_ids)
+            self.builds += 1
+        return self._rules